@@ -1 +1,4 @@
-from .api import Response, Api, resource, content_type, HTTPBreak
+from .api import (
+    Response, Api, resource, content_type, HTTPBreak, cached, invalidates,
+    streaming
+)
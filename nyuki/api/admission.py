@@ -0,0 +1,14 @@
+from .api import Response, resource
+
+
+@resource('/admission', versions=['v1'])
+class ApiAdmission:
+
+    async def get(self, request):
+        """
+        Return the in-flight, queue and reject counters of each gate
+        """
+        admission = self.nyuki.api.admission
+        if admission is None:
+            return Response(status=404)
+        return Response(admission.stats())
@@ -1,10 +1,16 @@
-from aiohttp import web
+from aiohttp import web, UnixConnector
 from aiohttp.hdrs import METH_ALL
 import asyncio
-from functools import partial
+from collections import OrderedDict
+from functools import partial, wraps
 import json
 import logging
+import os
+import socket
+import stat
+import time
 
+from nyuki import metrics
 from nyuki.services import Service
 from nyuki.utils import serialize_object
 
@@ -14,6 +20,19 @@ log = logging.getLogger(__name__)
 access_log = logging.getLogger('.'.join([__name__, 'access']))
 access_log.info = access_log.debug
 
+HTTP_REQUESTS = metrics.counter(
+    'nyuki_http_requests_total', 'HTTP requests served',
+    ['method', 'route', 'status'],
+)
+HTTP_LATENCY = metrics.histogram(
+    'nyuki_http_request_duration_seconds', 'HTTP requests latency',
+    ['method', 'route'],
+)
+HTTP_CACHE = metrics.counter(
+    'nyuki_http_cache_requests_total', 'Cacheable HTTP requests by result',
+    ['route', 'result'],
+)
+
 
 def resource(path, versions=None, content_type='application/json'):
     """
@@ -36,6 +55,79 @@ def content_type(content_type):
     return decorated
 
 
+def streaming(func):
+    """
+    Decorator for methods holding their request for a long time (such as
+    websockets), admitted without a gate.
+    """
+    func.STREAMING = True
+    return func
+
+
+def cached(ttl, tags=()):
+    """
+    Decorator to keep the successful responses of a GET method for `ttl`
+    seconds, keyed by path and query string. Tags are formatted with the
+    route's parameters (ie. 'template:{tid}') and dropped by `invalidates`.
+    The cache and its invalidations are local to the process: other
+    instances (or pre-forked workers) keep serving their copies until they
+    expire, so it is only enabled from the `api.cache` configuration.
+    """
+    def decorated(func):
+        @wraps(func)
+        async def wrapper(self, request, **kwargs):
+            cache = request.app.get('cache')
+            if cache is None or not cache.enabled:
+                return await func(self, request, **kwargs)
+
+            route = route_path(request)
+            key = cache_key(request)
+            response = cache.get(key, route)
+            if response is not None:
+                return response
+
+            generation = cache.generation
+            response = await func(self, request, **kwargs)
+            # Skip responses built while a write invalidated the cache
+            if generation == cache.generation:
+                cache.set(
+                    key, response, ttl,
+                    [tag.format(**kwargs) for tag in tags],
+                )
+            return response
+        return wrapper
+    return decorated
+
+
+def invalidates(*tags):
+    """
+    Decorator to drop the cached responses of these tags once a write
+    method (put, patch, post, delete) is over, successful or not.
+    """
+    def decorated(func):
+        @wraps(func)
+        async def wrapper(self, request, **kwargs):
+            try:
+                return await func(self, request, **kwargs)
+            finally:
+                cache = request.app.get('cache')
+                if cache is not None:
+                    cache.invalidate(*[tag.format(**kwargs) for tag in tags])
+        return wrapper
+    return decorated
+
+
+def cache_key(request):
+    """
+    Cache key of a request, the query parameters order does not matter.
+    """
+    query = '&'.join(
+        '{}={}'.format(key, value)
+        for key, value in sorted(request.query.items())
+    )
+    return '{}?{}'.format(request.path, query)
+
+
 class HTTPBreak(Exception):
 
     def __init__(self, status, body=None):
@@ -115,13 +207,82 @@ async def mw_capability(app, capa_handler):
         except HTTPBreak as exc:
             return Response(exc.body, status=exc.status)
 
-        if isinstance(capa_resp, Response):
+        # Also covers streamed and websocket responses
+        if isinstance(capa_resp, web.StreamResponse):
             return capa_resp
         return Response()
 
     return middleware
 
 
+async def mw_metrics(app, handler):
+    """
+    Record the latency and status of every request, per route.
+    """
+    async def middleware(request):
+        if not metrics.REGISTRY.enabled:
+            return await handler(request)
+
+        start = time.monotonic()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as exc:
+            status = exc.status
+            raise
+        finally:
+            route = route_path(request) or 'unmatched'
+            HTTP_REQUESTS.labels(request.method, route, str(status)).inc()
+            HTTP_LATENCY.labels(request.method, route).observe(
+                time.monotonic() - start
+            )
+
+    return middleware
+
+
+async def mw_admission(app, handler):
+    """
+    Shed the requests exceeding their route's admission gate with a fast
+    '503 Service Unavailable'.
+    """
+    admission = app['admission']
+
+    async def middleware(request):
+        # Long-lived streams would hold a slot for their whole life
+        if getattr(request.match_info.handler, 'STREAMING', False) is True:
+            return await handler(request)
+
+        route = route_path(request)
+        gate = admission.gate(route) if route is not None else None
+        if gate is None:
+            return await handler(request)
+
+        if not await gate.acquire():
+            log.debug('Request on %s rejected (%s)', route, gate.name)
+            return Response(
+                {'error': 'Too many requests, retry later'},
+                status=503,
+                headers={'Retry-After': str(admission.retry_after)},
+            )
+        try:
+            return await handler(request)
+        finally:
+            gate.release()
+
+    return middleware
+
+
+def route_path(request):
+    """
+    Return the path template of the route matched by a request, None if
+    no route matched (404/405).
+    """
+    info = request.match_info.get_info()
+    return info.get('formatter') or info.get('path')
+
+
 class ResourceClass:
 
     """
@@ -145,6 +306,7 @@ class ResourceClass:
                 async_handler.CONTENT_TYPE = getattr(
                     handler, 'CONTENT_TYPE', self.content_type
                 )
+                async_handler.STREAMING = getattr(handler, 'STREAMING', False)
                 route = resource.add_route(method, async_handler)
                 log.debug('Added route: %s', route)
 
@@ -158,12 +320,282 @@ class ResourceClass:
                 self._add_routes(router, route)
 
 
+class AdmissionGate:
+
+    """
+    Bound the number of concurrent requests going through a route (or a
+    group of routes), with a short wait queue in front of it.
+    """
+
+    def __init__(self, name, limit, queue, timeout, loop=None):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(limit, loop=loop)
+        # Counters
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        """
+        Return True if the request is admitted, False if it must be shed.
+        """
+        if self._semaphore.locked():
+            if self.waiting >= self.queue:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+            self.queued += 1
+            try:
+                await asyncio.wait_for(
+                    self._semaphore.acquire(), self.timeout
+                )
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                return False
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self.running += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.running -= 1
+        self._semaphore.release()
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'queue': self.queue,
+            'running': self.running,
+            'waiting': self.waiting,
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'rejected': self.rejected,
+        }
+
+
+class AdmissionControl:
+
+    """
+    Map routes to their admission gate.
+    Routes matching a group's prefixes share the group's gate, others get
+    their own gate using the default limits. Exempt routes (the control
+    plane, such as the Raft protocol) are never queued nor rejected.
+    """
+
+    CONF_SCHEMA = {
+        'type': 'object',
+        'properties': {
+            'limit': {'type': 'integer', 'minimum': 1},
+            'queue': {'type': 'integer', 'minimum': 0},
+            'timeout': {'type': 'number', 'minimum': 0},
+            'retry_after': {'type': 'integer', 'minimum': 1},
+            'exempt': {'type': 'array', 'items': {'type': 'string'}},
+            'groups': {
+                'type': 'object',
+                'additionalProperties': {
+                    'type': 'object',
+                    'required': ['routes'],
+                    'properties': {
+                        'routes': {
+                            'type': 'array',
+                            'items': {'type': 'string', 'minLength': 1},
+                        },
+                        'limit': {'type': 'integer', 'minimum': 1},
+                        'queue': {'type': 'integer', 'minimum': 0},
+                        'timeout': {'type': 'number', 'minimum': 0},
+                    },
+                },
+            },
+        },
+    }
+
+    def __init__(self, limit=100, queue=100, timeout=1.0, retry_after=1,
+                 exempt=None, groups=None, loop=None):
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        # Batched requests are admitted one by one on their own routes
+        self.exempt = exempt if exempt is not None else [
+            '/v1/raft', '/v1/metrics', '/v1/batch',
+        ]
+        self._loop = loop
+        self._groups = []
+        self._gates = {}
+
+        for name, group in (groups or {}).items():
+            gate = AdmissionGate(
+                name,
+                group.get('limit', limit),
+                group.get('queue', queue),
+                group.get('timeout', timeout),
+                loop=loop,
+            )
+            self._groups.append((tuple(group['routes']), gate))
+
+    def gate(self, route):
+        """
+        Return the gate of a route path, None if the route is exempt.
+        """
+        try:
+            return self._gates[route]
+        except KeyError:
+            pass
+
+        if route.startswith(tuple(self.exempt)):
+            gate = None
+        else:
+            for prefixes, gate in self._groups:
+                if route.startswith(prefixes):
+                    break
+            else:
+                gate = AdmissionGate(
+                    route, self.limit, self.queue, self.timeout,
+                    loop=self._loop,
+                )
+        self._gates[route] = gate
+        return gate
+
+    def stats(self):
+        gates = {gate.name: gate for _, gate in self._groups}
+        gates.update({
+            gate.name: gate for gate in self._gates.values()
+            if gate is not None
+        })
+        return {name: gate.stats() for name, gate in gates.items()}
+
+
+class ResponseCache:
+
+    """
+    Keep copies of successful responses, with an expiry date and a set of
+    invalidation tags. The least recently used entries are evicted first.
+    """
+
+    CONF_SCHEMA = {
+        'type': 'object',
+        'properties': {
+            'enabled': {'type': 'boolean'},
+            'max_entries': {'type': 'integer', 'minimum': 1},
+        },
+    }
+
+    def __init__(self, enabled=False, max_entries=1000):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        # Incremented on each invalidation
+        self.generation = 0
+        # key -> (expires, tags, status, body, headers)
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._routes = {}
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def _count(self, route, result):
+        counters = self._routes.setdefault(route, {'hits': 0, 'misses': 0})
+        counters[result] += 1
+        setattr(self, result, getattr(self, result) + 1)
+        HTTP_CACHE.labels(route, result).inc()
+
+    def get(self, key, route):
+        """
+        Return a new response from the cached entry, None if there is none.
+        """
+        try:
+            expires, _, status, body, headers = self._entries[key]
+        except KeyError:
+            self._count(route, 'misses')
+            return None
+        if expires <= time.monotonic():
+            self._remove(key)
+            self._count(route, 'misses')
+            return None
+        self._entries.move_to_end(key)
+        self._count(route, 'hits')
+        return Response(body=body, status=status, headers=headers)
+
+    def set(self, key, response, ttl, tags=()):
+        """
+        Store a response if it can be replayed, only 200s are kept.
+        """
+        if not isinstance(response, web.Response) or response.status != 200:
+            return
+        if key in self._entries:
+            self._remove(key)
+        headers = {
+            name: value for name, value in response.headers.items()
+            if name != 'Content-Length'
+        }
+        self._entries[key] = (
+            time.monotonic() + ttl, tags,
+            response.status, response.body, headers,
+        )
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, tags, *_ = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, *tags):
+        """
+        Drop every entry tagged with any of these tags.
+        """
+        self.generation += 1
+        for tag in tags:
+            for key in self._tags.pop(tag, ()):
+                if key in self._entries:
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+        self._tags.clear()
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'evictions': self.evictions,
+            'routes': self._routes,
+        }
+
+
 class Api(Service):
 
     """
     Manage a webserver built using the nyuki's defined HTTP resources
     """
 
+    # Seconds to wait for a process serving an existing unix socket
+    SOCKET_PROBE_TIMEOUT = 0.5
+
     CONF_SCHEMA = {
         "type": "object",
         "required": ["api"],
@@ -172,52 +604,155 @@ class Api(Service):
                 "type": "object",
                 "properties": {
                     "host": {"type": "string"},
-                    "port": {"type": "integer"}
+                    "port": {"type": "integer"},
+                    "unix_socket": {"type": "string", "minLength": 1},
+                    "admission": AdmissionControl.CONF_SCHEMA,
+                    "cache": ResponseCache.CONF_SCHEMA
                 }
             }
         }
     }
 
-    def __init__(self, nyuki):
+    def __init__(self, nyuki, reuse_port=False):
         self._nyuki = nyuki
         self._nyuki.register_schema(self.CONF_SCHEMA)
         self._loop = self._nyuki.loop or asyncio.get_event_loop()
         self._host = None
         self._port = None
-        self._middlewares = [mw_capability]
+        self._unix_socket = None
+        # Pre-forked workers all bind the same port (SO_REUSEPORT)
+        self._reuse_port = reuse_port
+        self._middlewares = [mw_metrics, mw_capability]
+        self._admission = None
+        self._cache = None
         self._app = None
         self._handler = None
         self._server = None
+        self._unix_server = None
 
     @property
     def capabilities(self):
         return self._nyuki.HTTP_RESOURCES
 
-    def configure(self, host='0.0.0.0', port=5558):
+    @property
+    def admission(self):
+        return self._admission
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def unix_socket(self):
+        return self._unix_socket
+
+    @property
+    def local_url(self):
+        """
+        Base URL the nyuki uses to query its own API.
+        """
+        if self._unix_socket is not None:
+            # The host is only used for the 'Host' header
+            return 'http://localhost'
+        return 'http://localhost:{}'.format(self._port)
+
+    def local_connector(self):
+        """
+        Connector to use along `local_url`, None for the default TCP one.
+        """
+        if self._unix_socket is None:
+            return None
+        return UnixConnector(path=self._unix_socket, loop=self._loop)
+
+    def configure(self, host='0.0.0.0', port=5558, admission=None,
+                  unix_socket=None, cache=None):
         self._host = host
         self._port = port
+        if unix_socket is not None and self._nyuki.worker is not None:
+            # Each pre-forked worker needs its own socket file
+            unix_socket = '{}.{}'.format(unix_socket, self._nyuki.worker)
+        self._unix_socket = unix_socket
+        if admission is not None:
+            self._admission = AdmissionControl(**admission, loop=self._loop)
+        else:
+            self._admission = None
+        self._cache = ResponseCache(**(cache or {}))
 
     async def start(self):
         """
         Expose capabilities by building the HTTP server.
         The server will be started with the event loop.
         """
-        self._app = web.Application(
-            loop=self._loop, middlewares=self._middlewares
-        )
+        # Refuse a wrong socket path before listening on anything
+        if self._unix_socket is not None:
+            self._remove_stale_socket()
+        middlewares = list(self._middlewares)
+        if self._admission is not None:
+            # Shed requests before any processing, but still measure them
+            middlewares.insert(1, mw_admission)
+        self._app = web.Application(loop=self._loop, middlewares=middlewares)
+        self._app['admission'] = self._admission
+        self._app['cache'] = self._cache
         for resource in self._nyuki.HTTP_RESOURCES:
             resource.RESOURCE_CLASS.register(self._nyuki, self._app.router)
         log.info("Starting the http server on {}:{}".format(self._host, self._port))
         self._handler = self._app.make_handler(access_log=access_log)
         self._server = await self._loop.create_server(
-            self._handler, host=self._host, port=self._port
+            self._handler, host=self._host, port=self._port,
+            reuse_port=self._reuse_port
         )
+        if self._unix_socket is not None:
+            log.info("Listening on unix socket {}".format(self._unix_socket))
+            self._unix_server = await self._loop.create_unix_server(
+                self._handler, path=self._unix_socket
+            )
+
+    def _remove_stale_socket(self):
+        """
+        A socket file left behind by a killed process prevents binding,
+        one still served by another process (e.g. restarting) is kept.
+        """
+        try:
+            mode = os.stat(self._unix_socket).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise ValueError("'{}' exists and is not a socket".format(
+                self._unix_socket
+            ))
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.SOCKET_PROBE_TIMEOUT)
+            try:
+                sock.connect(self._unix_socket)
+            except (ConnectionRefusedError, FileNotFoundError):
+                pass
+            else:
+                raise ValueError("'{}' is in use by another process".format(
+                    self._unix_socket
+                ))
+        try:
+            os.unlink(self._unix_socket)
+        except FileNotFoundError:
+            pass
 
     async def stop(self):
         log.info('Stopped the http server')
         self._server.close()
+        if self._unix_server is not None:
+            self._unix_server.close()
         await self._handler.shutdown()
         await self._server.wait_closed()
+        if self._unix_server is not None:
+            await self._unix_server.wait_closed()
+            try:
+                os.unlink(self._unix_socket)
+            except FileNotFoundError:
+                pass
+            self._unix_server = None
         self._app = None
         self._handler = None
         self._server = None
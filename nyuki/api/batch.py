@@ -0,0 +1,162 @@
+import asyncio
+import json
+import logging
+from aiohttp import web, hdrs
+from jsonschema import ValidationError, validate
+from multidict import CIMultiDict
+
+from .api import Response, resource
+
+
+log = logging.getLogger(__name__)
+
+BATCH_SCHEMA = {
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'required': ['method', 'path'],
+        'properties': {
+            'method': {
+                'type': 'string',
+                'enum': ['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE'],
+            },
+            'path': {'type': 'string', 'pattern': '^/'},
+            'body': {'description': 'any JSON value'},
+        },
+    },
+}
+
+# Requests without side effects, run concurrently
+SAFE_METHODS = {'GET', 'HEAD'}
+# Batch headers given to each sub-request, others (such as `Expect`, which
+# would be handled once per sub-request) only concern the batch itself
+SHARED_HEADERS = (hdrs.AUTHORIZATION, hdrs.COOKIE, hdrs.HOST, hdrs.REFERER)
+SHARED_PREFIXES = ('accept', 'x-')
+
+
+def _shared_header(name):
+    name = name.lower()
+    return (
+        name in (header.lower() for header in SHARED_HEADERS) or
+        name.startswith(SHARED_PREFIXES)
+    )
+
+
+def _with_body(request, body, **changes):
+    """
+    `request.clone(**changes)`, whose content reads as `body` (bytes)
+    instead of the batch's.
+    aiohttp refuses to clone a request once its content is read (as the
+    batch's is) and has no public way to set one: both rely on the
+    `_read_bytes` cache of `Request.read` (pinned by the tests).
+    """
+    read, request._read_bytes = request._read_bytes, None
+    try:
+        clone = request.clone(**changes)
+    finally:
+        request._read_bytes = read
+    clone._read_bytes = body
+    return clone
+
+
+def _sub_request(request, method, path, body):
+    """
+    Build a request on the batch's connection, sharing its allowed headers,
+    with an already-read JSON body.
+    """
+    headers = CIMultiDict(
+        (name, value) for name, value in request.headers.items()
+        if _shared_header(name)
+    )
+    data = b''
+    if body is not None:
+        data = json.dumps(body).encode()
+        headers[hdrs.CONTENT_TYPE] = 'application/json'
+    headers[hdrs.CONTENT_LENGTH] = str(len(data))
+    return _with_body(
+        request, data, method=method, rel_url=path, headers=headers
+    )
+
+
+def _response_body(response):
+    body = response.body
+    if not body:
+        return None
+    if response.content_type == 'application/json':
+        return json.loads(body.decode())
+    return body.decode(response.charset or 'utf-8')
+
+
+@resource('/batch', versions=['v1'])
+class ApiBatch:
+
+    MAX_REQUESTS = 100
+
+    async def _call(self, request, item):
+        """
+        Go through routing and middlewares as a real request would.
+        """
+        if item['path'].split('?')[0].rstrip('/') == request.path.rstrip('/'):
+            return {'status': 400, 'body': {'error': 'Nested batch request'}}
+
+        sub_request = _sub_request(
+            request, item['method'], item['path'], item.get('body')
+        )
+        try:
+            match_info = await request.app.router.resolve(sub_request)
+            # Would write to the batch's connection
+            if getattr(match_info.handler, 'STREAMING', False) is True:
+                return {
+                    'status': 400, 'body': {'error': 'Unsupported route'}
+                }
+            # No public way to go through the middlewares (pinned by tests)
+            response = await request.app._handle(sub_request)
+        except web.HTTPException as exc:
+            return {'status': exc.status, 'body': {'error': exc.reason}}
+        except Exception as exc:
+            log.exception('Batch request %s %s failed', item['method'],
+                          item['path'])
+            return {'status': 500, 'body': {'error': str(exc)}}
+
+        if not isinstance(response, web.Response):
+            # Streamed responses and websockets can't be batched
+            return {'status': 400, 'body': {'error': 'Unsupported route'}}
+        return {'status': response.status, 'body': _response_body(response)}
+
+    async def post(self, request):
+        """
+        Run a list of {method, path, body} requests, return the list of
+        {status, body} responses in the same order.
+        Consecutive GET requests run concurrently, other methods run one
+        at a time, in order.
+        """
+        items = await request.json()
+        try:
+            validate(items, BATCH_SCHEMA)
+        except ValidationError as exc:
+            return Response({'error': exc.message}, status=400)
+        if len(items) > self.MAX_REQUESTS:
+            return Response({
+                'error': 'Batch limited to {} requests'.format(
+                    self.MAX_REQUESTS
+                )
+            }, status=400)
+
+        results = []
+        pending = []
+        for item in items:
+            if item['method'] in SAFE_METHODS:
+                pending.append(item)
+                continue
+            if pending:
+                results.extend(await asyncio.gather(*[
+                    self._call(request, safe) for safe in pending
+                ]))
+                pending = []
+            results.append(await self._call(request, item))
+        if pending:
+            results.extend(await asyncio.gather(*[
+                self._call(request, safe) for safe in pending
+            ]))
+
+        return Response(results)
@@ -0,0 +1,24 @@
+from .api import Response, resource
+
+
+@resource('/cache', versions=['v1'])
+class ApiCache:
+
+    async def get(self, request):
+        """
+        Return the hit, miss and invalidation counters of the response cache
+        """
+        cache = self.nyuki.api.cache
+        if cache is None:
+            return Response(status=404)
+        return Response(cache.stats())
+
+    async def delete(self, request):
+        """
+        Drop every cached response
+        """
+        cache = self.nyuki.api.cache
+        if cache is None:
+            return Response(status=404)
+        cache.clear()
+        return Response(cache.stats())
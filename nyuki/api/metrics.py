@@ -0,0 +1,18 @@
+from nyuki import metrics
+
+from .api import Response, resource
+
+
+@resource('/metrics', versions=['v1'])
+class ApiMetrics:
+
+    async def get(self, request):
+        """
+        Expose all the nyuki's metrics in the Prometheus text format
+        """
+        if not metrics.REGISTRY.enabled:
+            return Response(status=404)
+        return Response(
+            body=metrics.REGISTRY.expose().encode(),
+            headers={'Content-Type': metrics.Registry.CONTENT_TYPE},
+        )
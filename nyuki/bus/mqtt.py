@@ -9,6 +9,7 @@ from uuid import uuid4
 from hbmqtt.client import MQTTClient, ConnectException, ClientException
 from hbmqtt.errors import NoDataException
 from hbmqtt.mqtt.constants import QOS_0, QOS_1, QOS_2
+from nyuki import metrics
 from nyuki.services import Service
 from nyuki.utils import serialize_object
 from yarl import URL
@@ -16,6 +17,16 @@ from yarl import URL
 
 log = logging.getLogger(__name__)
 
+BUS_PUBLISHED = metrics.counter(
+    'nyuki_bus_published_total', 'Events published on the bus', ['status'],
+)
+BUS_PUBLISH_LATENCY = metrics.histogram(
+    'nyuki_bus_publish_duration_seconds', 'Bus publication latency',
+)
+BUS_RECEIVED = metrics.counter(
+    'nyuki_bus_received_total', 'Events received from the bus',
+)
+
 MQTTSubRegex = namedtuple('MQTTSubRegex', ['regex', 'callbacks'])
 
 
@@ -49,6 +60,7 @@ class MqttBus(Service):
         self._subscriptions = {}
         self._regex_subscriptions = {}
         self._persisted = {}
+        self._will = None
 
         # Coroutines
         self.connect_future = None
@@ -72,18 +84,37 @@ class MqttBus(Service):
                 )
 
         self._cafile = cafile
+        # Pre-forked workers need their own MQTT session
+        client_id = self.name
+        if self._nyuki.worker is not None:
+            client_id = '{}-{}'.format(client_id, self._nyuki.worker)
+        config = {
+            'auto_reconnect': False,
+            'certfile': certfile,
+            'keyfile': keyfile,
+            'keep_alive': keep_alive,
+            'ping_delay': ping_delay
+        }
+        if self._will is not None:
+            config['will'] = self._will
         self.client = MQTTClient(
-            client_id=self.name,
-            config={
-                'auto_reconnect': False,
-                'certfile': certfile,
-                'keyfile': keyfile,
-                'keep_alive': keep_alive,
-                'ping_delay': ping_delay
-            },
-            loop=self._loop
+            client_id=client_id, config=config, loop=self._loop
         )
 
+    def set_will(self, data, topic, qos=QOS_1, retain=True):
+        """
+        Event published by the broker if this client disconnects without
+        notice, it is sent with the next connection.
+        """
+        self._will = {
+            'topic': topic,
+            'message': json.dumps(data, default=serialize_object).encode(),
+            'qos': qos,
+            'retain': retain,
+        }
+        if self.client is not None:
+            self.client.config['will'] = self._will
+
     async def start(self):
         def cancelled(future):
             try:
@@ -222,25 +253,36 @@ class MqttBus(Service):
     async def publish_qos_2(self, data, topic):
         return await self.publish(data, topic, qos=QOS_2)
 
-    async def publish(self, data, topic=None, qos=QOS_0):
+    @metrics.timed(BUS_PUBLISH_LATENCY)
+    async def publish(self, data, topic=None, qos=QOS_0, retain=False):
         """
-        Publish in given topic or default one
+        Publish in given topic or default one, a retained event is kept by
+        the broker and sent to future subscribers (until a retained `None`,
+        sent as an empty payload, removes it).
         """
         if not topic:
             topic = self.name
 
         log.debug("Publishing event to '%s': %s", topic, data)
-        data = json.dumps(data, default=serialize_object)
+        if data is None:
+            payload = b''
+        else:
+            payload = json.dumps(data, default=serialize_object).encode()
 
         if self.client._connected_state.is_set():
             try:
-                await self.client.publish(topic, data.encode(), qos=qos)
+                await self.client.publish(
+                    topic, payload, qos=qos, retain=retain
+                )
             except Exception as exc:
                 log.error('Error while publishing: %s', exc)
+                BUS_PUBLISHED.labels('failure').inc()
             else:
                 log.debug('Event successfully sent to topic %s', topic)
+                BUS_PUBLISHED.labels('success').inc()
         else:
             log.error('Failed to send event to topic %s', topic)
+            BUS_PUBLISHED.labels('failure').inc()
 
     async def _run(self):
         """
@@ -290,24 +332,29 @@ class MqttBus(Service):
                 log.info('listening loop ended')
                 break
 
+            BUS_RECEIVED.inc()
+            # An empty payload clears a retained event
             self._handle_message(
                 message.topic,
-                json.loads(message.data.decode()),
+                json.loads(message.data.decode()) if message.data else None,
             )
 
     def _handle_message(self, topic, data):
+        def copy():
+            return data.copy() if data is not None else None
+
         handled = False
         # Iterate and call all regex topics callbacks
         for mqttregex in self._regex_subscriptions.values():
             if mqttregex.regex.match(topic):
                 for callback in mqttregex.callbacks:
-                    asyncio.ensure_future(callback(topic, data.copy()))
+                    asyncio.ensure_future(callback(topic, copy()))
                 handled = True
 
         # Iterate and call all single topic callbacks
         if topic in self._subscriptions:
             for callback in self._subscriptions[topic]:
-                asyncio.ensure_future(callback(topic, data.copy()))
+                asyncio.ensure_future(callback(topic, copy()))
             handled = True
 
         # If the message was not linked to any known topic, keep it
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+from aiohttp import ClientSession, TCPConnector, TraceConfig
+
+from nyuki import metrics
+from nyuki.services import Service
+
+
+log = logging.getLogger(__name__)
+
+HTTP_CLIENT_REQUESTS = metrics.counter(
+    'nyuki_http_client_requests_total', 'HTTP requests sent',
+    ['method', 'host', 'status'],
+)
+HTTP_CLIENT_LATENCY = metrics.histogram(
+    'nyuki_http_client_request_duration_seconds', 'HTTP requests latency',
+    ['method', 'host'],
+)
+
+
+async def _on_request_start(session, context, params):
+    context.start = session.loop.time()
+
+
+async def _on_request_end(session, context, params):
+    _observe(session, context, params, str(params.response.status))
+
+
+async def _on_request_exception(session, context, params):
+    _observe(session, context, params, 'error')
+
+
+def _observe(session, context, params, status):
+    if not metrics.REGISTRY.enabled:
+        return
+    method = params.method.upper()
+    host = params.url.host or 'unknown'
+    HTTP_CLIENT_REQUESTS.labels(method, host, status).inc()
+    HTTP_CLIENT_LATENCY.labels(method, host).observe(
+        session.loop.time() - context.start
+    )
+
+
+class HttpClient(Service):
+
+    """
+    Pooled HTTP client shared by all the components of a nyuki.
+    Connections are kept alive between requests, instead of opening a
+    session (and a connection) per request.
+    """
+
+    CONF_SCHEMA = {
+        'type': 'object',
+        'properties': {
+            'http': {
+                'type': 'object',
+                'properties': {
+                    'limit': {'type': 'integer', 'minimum': 0},
+                    'limit_per_host': {'type': 'integer', 'minimum': 0},
+                    'keepalive_timeout': {'type': 'number', 'minimum': 0},
+                    'timeout': {'type': 'number', 'minimum': 0},
+                    'connect_timeout': {'type': 'number', 'minimum': 0},
+                }
+            }
+        }
+    }
+
+    def __init__(self, nyuki):
+        self._nyuki = nyuki
+        self._nyuki.register_schema(self.CONF_SCHEMA)
+        self._loop = self._nyuki.loop or asyncio.get_event_loop()
+        self._config = {}
+        self._session = None
+        self._local_session = None
+
+    def configure(self, limit=100, limit_per_host=30, keepalive_timeout=30,
+                  timeout=30, connect_timeout=5):
+        self._config = {
+            'limit': limit,
+            'limit_per_host': limit_per_host,
+            'keepalive_timeout': keepalive_timeout,
+            'timeout': timeout,
+            'connect_timeout': connect_timeout,
+        }
+
+    def _new_session(self, connector):
+        trace = TraceConfig()
+        trace.on_request_start.append(_on_request_start)
+        trace.on_request_end.append(_on_request_end)
+        trace.on_request_exception.append(_on_request_exception)
+        return ClientSession(
+            connector=connector,
+            loop=self._loop,
+            read_timeout=self._config['timeout'],
+            conn_timeout=self._config['connect_timeout'],
+            trace_configs=[trace],
+        )
+
+    async def start(self, *args, **kwargs):
+        self._session = self._new_session(TCPConnector(
+            limit=self._config['limit'],
+            limit_per_host=self._config['limit_per_host'],
+            keepalive_timeout=self._config['keepalive_timeout'],
+            loop=self._loop,
+        ))
+        # Requests to this nyuki's own API may use its unix socket
+        connector = self._nyuki.api.local_connector()
+        if connector is not None:
+            self._local_session = self._new_session(connector)
+
+    async def stop(self, *args, **kwargs):
+        for session in (self._session, self._local_session):
+            if session is not None:
+                await session.close()
+        self._session = None
+        self._local_session = None
+
+    def session(self, local=False):
+        """
+        Return the shared session, do not close it.
+        `local` selects the session to use along `Api.local_url`.
+        """
+        if local and self._local_session is not None:
+            return self._local_session
+        return self._session
+
+    def request(self, method, url, *, local=False, **kwargs):
+        """
+        Same as `ClientSession.request`, to be used with `async with`.
+        """
+        return self.session(local).request(method, url, **kwargs)
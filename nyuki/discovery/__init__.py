@@ -1,6 +1,12 @@
+import asyncio
+import logging
+
 from nyuki.services import Service
 
 
+log = logging.getLogger(__name__)
+
+
 class Discovery(type):
 
     _REGISTRY = {}
@@ -21,11 +27,61 @@ class Discovery(type):
 
 class DiscoveryService(Service, metaclass=Discovery):
 
+    """
+    Discovered instances are given to the registered callbacks as deltas:
+    `callback(added, removed)`, `added` mapping each new address to its
+    port (None if unknown) and `removed` listing the addresses gone.
+    """
+
     SERVICE = 'discovery'
     SCHEME = None
 
-    def register(self, callback):
+    def __init__(self, nyuki):
+        self._nyuki = nyuki
+        self._callbacks = []
+        # Current members, address to port
+        self.members = {}
+
+    async def lookup(self, service):
+        """
+        Instances of another service, address to port (None if unknown).
+        """
         raise NotImplementedError()
 
+    def register(self, callback):
+        if not callable(callback) or callback in self._callbacks:
+            raise ValueError('Invalid or already registered callback')
+        self._callbacks.append(callback)
+
+    def update(self, members):
+        """
+        Set the discovered members, the callbacks are only triggered if
+        they changed. A member whose port changed is removed and added.
+        """
+        added = {
+            address: port for address, port in members.items()
+            if address not in self.members or self.members[address] != port
+        }
+        removed = [
+            address for address, port in self.members.items()
+            if address not in members or members[address] != port
+        ]
+        if not added and not removed:
+            return False
+
+        log.info(
+            'Discovery update: %d added, %d removed', len(added), len(removed)
+        )
+        self.members = dict(members)
+        for callback in self._callbacks:
+            coro = (
+                callback if asyncio.iscoroutinefunction(callback)
+                else asyncio.coroutine(callback)
+            )
+            asyncio.ensure_future(coro(added, removed))
+        return True
+
 
 from .dns import DnsDiscovery
+from .bus import BusDiscovery
+from .balancer import ServiceBalancer
@@ -0,0 +1,62 @@
+import random
+import logging
+from contextlib import contextmanager
+
+
+log = logging.getLogger(__name__)
+
+
+class ServiceBalancer:
+
+    """
+    Pick an instance of another service, as found by the discovery service,
+    to call it directly.
+    'round_robin' takes each instance in turn, 'least_outstanding' the one
+    with the fewest requests in progress (as counted by `track`).
+    """
+
+    POLICIES = ('round_robin', 'least_outstanding')
+
+    def __init__(self, discovery, policy='round_robin'):
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown balancing policy '{}'".format(policy))
+        self._discovery = discovery
+        self.policy = policy
+        self._turns = {}
+        # Requests in progress, per (address, port)
+        self.outstanding = {}
+
+    async def instances(self, service):
+        """
+        Instances of a service, as sorted (address, port) tuples.
+        """
+        members = await self._discovery.lookup(service)
+        return sorted(members.items(), key=lambda item: item[0])
+
+    async def pick(self, service):
+        """
+        Return the (address, port) to call, None if no instance is known.
+        """
+        instances = await self.instances(service)
+        if not instances:
+            return None
+        if self.policy == 'least_outstanding':
+            return min(instances, key=lambda instance: (
+                self.outstanding.get(instance, 0), random.random()
+            ))
+        turn = self._turns.get(service, 0)
+        self._turns[service] = turn + 1
+        return instances[turn % len(instances)]
+
+    @contextmanager
+    def track(self, instance):
+        """
+        Count a request to `instance` while in progress.
+        """
+        self.outstanding[instance] = self.outstanding.get(instance, 0) + 1
+        try:
+            yield instance
+        finally:
+            self.outstanding[instance] -= 1
+            if not self.outstanding[instance]:
+                del self.outstanding[instance]
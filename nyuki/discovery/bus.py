@@ -0,0 +1,176 @@
+import socket
+import asyncio
+import logging
+
+from nyuki.discovery import DiscoveryService
+
+
+log = logging.getLogger(__name__)
+
+
+class BusDiscovery(DiscoveryService):
+
+    """
+    Presence over the bus: each instance publishes a retained presence event
+    on `<topic>/<service>/<address>` every `period` seconds, and a retained
+    departure when it stops (or as its last will, published by the broker if
+    it disconnects without notice). An instance not heard from within
+    `timeout` seconds is gone. Departures are then removed from the broker,
+    for new subscribers not to receive every address ever seen.
+    Other services are followed the same way from their first lookup.
+    """
+
+    SCHEME = 'bus'
+    CONF_SCHEMA = {
+        "type": "object",
+        "properties": {
+            "discovery": {
+                "type": "object",
+                "properties": {
+                    "method": {"type": "string", "enum": ["bus"]},
+                    "topic": {"type": "string", "minLength": 1},
+                    "period": {"type": "number", "minimum": 0.1},
+                    "timeout": {"type": "number", "minimum": 0.1}
+                },
+                "additionalProperties": False
+            }
+        }
+    }
+
+    def __init__(self, nyuki, loop=None):
+        super().__init__(nyuki)
+        self._loop = loop or asyncio.get_event_loop()
+        self.ipv4 = socket.gethostbyname(socket.gethostname())
+        self._prefix = None
+        self._topic = None
+        self._period = None
+        self._timeout = None
+        self._future = None
+        # Last presence received from each instance (loop time)
+        self._seen = {}
+        # Other services' instances: address to port and last presence
+        self._lookups = {}
+
+        self._nyuki.register_schema(self.CONF_SCHEMA)
+
+    def configure(self, topic='nyuki/presence', period=1, timeout=None,
+                  **kwargs):
+        self._prefix = topic
+        self._topic = '{}/{}'.format(topic, self._nyuki.config['service'])
+        self._period = period
+        self._timeout = timeout or 3 * period
+        if 'bus' not in self._nyuki.config:
+            raise ValueError("Bus discovery requires the 'bus' service")
+        self._nyuki.bus.set_will(self._presence(False), self.topic)
+
+    @property
+    def topic(self):
+        """
+        Presence topic of this instance.
+        """
+        return '{}/{}'.format(self._topic, self.ipv4)
+
+    def _presence(self, up=True):
+        return {
+            'address': self.ipv4,
+            'port': self._nyuki.api.port,
+            'up': up,
+        }
+
+    async def start(self, *args, **kwargs):
+        # This instance is part of the service right away
+        self.update({**self.members, self.ipv4: self._nyuki.api.port})
+        # Subscribing waits for the broker, which must not block the start
+        asyncio.ensure_future(self._nyuki.bus.subscribe(
+            '{}/+'.format(self._topic), self.presence_handler
+        ))
+        self._future = asyncio.ensure_future(self.heartbeat())
+
+    async def heartbeat(self):
+        while True:
+            await self._nyuki.bus.publish(
+                self._presence(), self.topic, retain=True
+            )
+            self.expire()
+            await asyncio.sleep(self._period)
+
+    async def presence_handler(self, topic, data):
+        """
+        Presence or departure of an instance.
+        """
+        # Removed retained event
+        if not data:
+            return
+        address = data['address']
+        if address == self.ipv4:
+            return
+        members = dict(self.members)
+        if data['up']:
+            self._seen[address] = self._loop.time()
+            members[address] = data.get('port')
+        else:
+            self._seen.pop(address, None)
+            members.pop(address, None)
+            # Last will, retained by the broker
+            asyncio.ensure_future(
+                self._nyuki.bus.publish(None, topic, retain=True)
+            )
+        self.update(members)
+
+    async def lookup(self, service):
+        """
+        Instances of another service, none until their presence events are
+        received.
+        """
+        if service == self._nyuki.config['service']:
+            return dict(self.members)
+        if service not in self._lookups:
+            self._lookups[service] = {}
+            asyncio.ensure_future(self._nyuki.bus.subscribe(
+                '{}/{}/+'.format(self._prefix, service), self.lookup_handler
+            ))
+        deadline = self._loop.time() - self._timeout
+        instances = self._lookups[service]
+        for address in [a for a, (_, seen) in instances.items()
+                        if seen < deadline]:
+            del instances[address]
+        return {address: port for address, (port, _) in instances.items()}
+
+    async def lookup_handler(self, topic, data):
+        """
+        Presence or departure of another service's instance.
+        """
+        service = topic[len(self._prefix) + 1:].rsplit('/', 1)[0]
+        instances = self._lookups.get(service)
+        if instances is None or not data:
+            return
+        if data['up']:
+            instances[data['address']] = (data.get('port'), self._loop.time())
+        else:
+            instances.pop(data['address'], None)
+
+    def expire(self):
+        """
+        Remove the instances not heard from within the timeout.
+        """
+        deadline = self._loop.time() - self._timeout
+        expired = [
+            address for address, seen in self._seen.items()
+            if seen < deadline
+        ]
+        if not expired:
+            return
+        for address in expired:
+            del self._seen[address]
+        self.update({
+            address: port for address, port in self.members.items()
+            if address not in expired
+        })
+
+    async def stop(self):
+        if self._future:
+            self._future.cancel()
+            self._future = None
+        # Leave without waiting for the timeout, and without a trace
+        await self._nyuki.bus.publish(self._presence(False), self.topic)
+        await self._nyuki.bus.publish(None, self.topic, retain=True)
@@ -3,14 +3,33 @@ import logging
 from aiodns import DNSResolver
 from aiodns.error import DNSError
 
+from nyuki import metrics
 from nyuki.discovery import DiscoveryService
 
 
 log = logging.getLogger(__name__)
 
+DNS_QUERIES = metrics.counter(
+    'nyuki_discovery_dns_queries_total', 'DNS discovery queries',
+    ['type', 'result'],
+)
+DNS_LATENCY = metrics.histogram(
+    'nyuki_discovery_dns_query_duration_seconds', 'DNS discovery latency',
+    ['type'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0),
+)
+
 
 class DnsDiscovery(DiscoveryService):
 
+    """
+    Query the A records of `entry` (or its SRV records, which also give the
+    instances' ports) again once their TTL expired, but never more often
+    than every `period` seconds.
+    Other services are looked up under the `lookup` name, '{service}' being
+    replaced by the service's name.
+    """
+
     SCHEME = 'dns'
     CONF_SCHEMA = {
         "type": "object",
@@ -20,7 +39,9 @@ class DnsDiscovery(DiscoveryService):
                 "properties": {
                     "method": {"type": "string", "enum": ["dns"]},
                     "entry": {"type": "string", "minLength": 1},
-                    "period": {"type": "integer", "minimum": 1}
+                    "period": {"type": "number", "minimum": 1},
+                    "record": {"type": "string", "enum": ["A", "SRV"]},
+                    "lookup": {"type": "string", "minLength": 1}
                 },
                 "additionalProperties": False
             }
@@ -30,48 +51,100 @@ class DnsDiscovery(DiscoveryService):
     _RETRY_PERIOD = 5
 
     def __init__(self, nyuki, loop=None):
-        self._nyuki = nyuki
+        super().__init__(nyuki)
+        self._loop = loop or asyncio.get_event_loop()
         self._entry = None
         self._period = None
+        self._record = 'A'
+        self._lookup = '{service}'
+        # Other services' instances, with their expiry time
+        self._lookups = {}
         self._future = None
-        self._callbacks = []
-        self._resolver = DNSResolver(loop=loop or asyncio.get_event_loop())
+        self._resolver = DNSResolver(loop=self._loop)
 
         self._nyuki.register_schema(self.CONF_SCHEMA)
 
-    def configure(self, entry=None, period=2, **kwargs):
+    def configure(self, entry=None, period=2, record='A',
+                  lookup='{service}', **kwargs):
         self._entry = entry or self._nyuki.config['service']
         self._period = period
-
-    def register(self, callback):
-        if not callable(callback) or callback in self._callbacks:
-            raise ValueError('Invalid or already registered callback')
-        self._callbacks.append(callback)
+        self._record = record
+        self._lookup = lookup
+        self._lookups = {}
 
     async def start(self, *args, **kwargs):
         self._future = asyncio.ensure_future(self.periodic_query())
 
+    async def _query(self, name, qtype):
+        start = self._loop.time()
+        try:
+            answers = await self._resolver.query(name, qtype)
+        except DNSError:
+            DNS_QUERIES.labels(qtype, 'error').inc()
+            raise
+        DNS_LATENCY.labels(qtype).observe(self._loop.time() - start)
+        DNS_QUERIES.labels(qtype, 'ok').inc()
+        return answers
+
+    async def resolve(self, name=None):
+        """
+        Return the members found under `name` (the discovery entry by
+        default), address to port, and the lowest TTL.
+        """
+        name = name or self._entry
+        if self._record == 'A':
+            answers = await self._query(name, 'A')
+            members = {record.host: None for record in answers}
+            return members, min((r.ttl for r in answers), default=0)
+
+        answers = await self._query(name, 'SRV')
+        targets = await asyncio.gather(*[
+            self._query(record.host, 'A') for record in answers
+        ])
+        members = {}
+        ttls = [record.ttl for record in answers]
+        for srv, target in zip(answers, targets):
+            for record in target:
+                members[record.host] = srv.port
+                ttls.append(record.ttl)
+        return members, min(ttls, default=0)
+
+    async def lookup(self, service):
+        """
+        Instances of another service, cached until their records expire.
+        The last answer is kept if the DNS fails.
+        """
+        now = self._loop.time()
+        members, expiry = self._lookups.get(service, ({}, None))
+        if expiry is not None and now < expiry:
+            return members
+        try:
+            members, ttl = await self.resolve(
+                self._lookup.format(service=service)
+            )
+        except DNSError as exc:
+            log.warning("DNS lookup failed for service '%s'", service)
+            log.debug("DNS failure reason: %s", str(exc))
+            self._lookups[service] = (members, now + self._RETRY_PERIOD)
+            return members
+        self._lookups[service] = (members, now + max(ttl, self._period))
+        return members
+
     async def periodic_query(self):
         while True:
             try:
-                answers = await self._resolver.query(self._entry, 'A')
+                members, ttl = await self.resolve()
             except DNSError as exc:
                 log.error("DNS query failed for discovery service")
                 log.debug("DNS failure reason: %s", str(exc))
                 await asyncio.sleep(self._RETRY_PERIOD)
                 continue
-            addresses = [record.host for record in answers]
-
-            # Trigger callbacks for discovered instances IPs
-            for callback in self._callbacks:
-                coro = (
-                    callback if asyncio.iscoroutinefunction(callback)
-                    else asyncio.coroutine(callback)
-                )
-                asyncio.ensure_future(coro(addresses))
-
-            # Periodically execute this method
-            await asyncio.sleep(self._period)
+
+            # Trigger callbacks if the discovered instances changed
+            self.update(members)
+
+            # Query again once the records expired
+            await asyncio.sleep(max(ttl, self._period))
 
     async def stop(self):
         self._future.cancel()
@@ -3,11 +3,18 @@ import logging
 from socket import error as SocketError
 from aioredis import create_reconnecting_redis, RedisError
 
+from nyuki import metrics
 from nyuki.services import Service
 
 
 log = logging.getLogger(__name__)
 
+MEMORY_LATENCY = metrics.histogram(
+    'nyuki_memory_pipeline_duration_seconds',
+    'Shared memory pipelines round-trip time', ['operation'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5),
+)
+
 
 def memsafe(coro):
     async def wrapper(*args, **kwargs):
@@ -22,6 +29,38 @@ def memsafe(coro):
     return wrapper
 
 
+class Batch:
+
+    """
+    Commands queued on `pipe` are sent in a single round trip when leaving
+    the `async with` block, and not at all if it raised. Their results are
+    the futures returned when queuing them, only to be awaited afterwards.
+    """
+
+    def __init__(self, memory, operation, transaction):
+        self._memory = memory
+        self._operation = operation
+        self._transaction = transaction
+        self.pipe = None
+
+    async def __aenter__(self):
+        store = self._memory.store
+        if self._transaction:
+            self.pipe = store.multi_exec()
+        else:
+            self.pipe = store.pipeline()
+        return self.pipe
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            return
+        start = self._memory.loop.time()
+        await self.pipe.execute()
+        MEMORY_LATENCY.labels(self._operation).observe(
+            self._memory.loop.time() - start
+        )
+
+
 class Memory(Service):
 
     def __init__(self, nyuki):
@@ -40,6 +79,19 @@ class Memory(Service):
             keyspace = '{}.{}'.format(keyspace, arg)
         return keyspace
 
+    def pipeline(self, operation, transaction=True):
+        """
+        Batch commands in a single round trip, a MULTI/EXEC transaction
+        unless `transaction` is False, timed under the `operation` label:
+
+            async with memory.pipeline('name') as pipe:
+                created = pipe.set(key, value)
+                pipe.expire(key, 60)
+            if await created:
+                ...
+        """
+        return Batch(self, operation, transaction)
+
     def configure(self, *args, **kwargs):
         self.config = kwargs
 
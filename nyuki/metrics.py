@@ -0,0 +1,296 @@
+import time
+import logging
+from functools import wraps
+
+
+log = logging.getLogger(__name__)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    labels = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace(
+            '"', r'\"').replace('\n', r'\n'))
+        for name, value in zip(names, values)
+    )
+    return '{' + labels + '}'
+
+
+class _NoopValue:
+
+    """
+    Returned by every metric while the registry is disabled.
+    """
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+NOOP = _NoopValue()
+
+
+class _CounterValue:
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _GaugeValue(_CounterValue):
+
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramValue:
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+
+class Metric:
+
+    """
+    A named metric, optionally split by a fixed set of labels.
+    """
+
+    TYPE = None
+
+    def __init__(self, name, documentation, labels=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labels)
+        self.registry = registry
+        self._values = {}
+
+    def _new_value(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """
+        Return the value holder for these label values.
+        """
+        if not self.registry.enabled:
+            return NOOP
+        if len(values) != len(self.labelnames):
+            raise ValueError('{} expects labels {}'.format(
+                self.name, self.labelnames
+            ))
+        try:
+            return self._values[values]
+        except KeyError:
+            value = self._values[values] = self._new_value()
+            return value
+
+    def clear(self):
+        self._values = {}
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, labels, value.value
+
+    def expose(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self.TYPE),
+        ]
+        for name, labels, value in self.samples():
+            lines.append('{}{} {}'.format(
+                name,
+                _format_labels(self.labelnames, labels),
+                _format_value(value),
+            ))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+
+    TYPE = 'counter'
+
+    def _new_value(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+
+    TYPE = 'gauge'
+
+    def _new_value(self):
+        return _GaugeValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+
+    TYPE = 'histogram'
+    DEFAULT_BUCKETS = (
+        .005, .01, .025, .05, .075, .1, .25, .5, .75, 1.0, 2.5, 5.0, 7.5, 10.0
+    )
+
+    def __init__(self, name, documentation, labels=(), registry=None,
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels, registry)
+        buckets = sorted(float(bound) for bound in buckets)
+        if buckets[-1] != float('inf'):
+            buckets.append(float('inf'))
+        self.buckets = tuple(buckets)
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        for labels, value in self._values.items():
+            cumulative = 0
+            for bound, count in zip(value.buckets, value.counts):
+                cumulative += count
+                yield (
+                    '{}_bucket'.format(self.name),
+                    labels + (_format_value(bound),),
+                    cumulative,
+                )
+            yield '{}_sum'.format(self.name), labels, value.sum
+            yield '{}_count'.format(self.name), labels, value.count
+
+    def expose(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self.TYPE),
+        ]
+        for name, labels, value in self.samples():
+            names = self.labelnames
+            if name.endswith('_bucket'):
+                names = names + ('le',)
+            lines.append('{}{} {}'.format(
+                name, _format_labels(names, labels), _format_value(value),
+            ))
+        return '\n'.join(lines)
+
+
+class Registry:
+
+    """
+    Hold all the metrics of a nyuki and expose them using the Prometheus
+    text format. While disabled, metrics record nothing.
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._metrics = {}
+
+    def _register(self, cls, name, *args, **kwargs):
+        try:
+            metric = self._metrics[name]
+        except KeyError:
+            metric = self._metrics[name] = cls(
+                name, *args, registry=self, **kwargs
+            )
+            return metric
+        if not isinstance(metric, cls):
+            raise ValueError('Metric {} already registered as a {}'.format(
+                name, metric.TYPE
+            ))
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(),
+                  buckets=Histogram.DEFAULT_BUCKETS):
+        return self._register(
+            Histogram, name, documentation, labels, buckets=buckets
+        )
+
+    def clear(self):
+        """
+        Reset all the recorded values.
+        """
+        for metric in self._metrics.values():
+            metric.clear()
+
+    def expose(self):
+        return '\n'.join(
+            metric.expose()
+            for _, metric in sorted(self._metrics.items())
+        ) + '\n'
+
+
+# Default registry shared by all the nyuki components
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+def timed(metric, *labels):
+    """
+    Decorator observing the duration of a coroutine into a histogram.
+    """
+    def decorated(coro):
+        @wraps(coro)
+        async def wrapper(*args, **kwargs):
+            if not metric.registry.enabled:
+                return await coro(*args, **kwargs)
+            start = time.monotonic()
+            try:
+                return await coro(*args, **kwargs)
+            finally:
+                metric.labels(*labels).observe(time.monotonic() - start)
+        return wrapper
+    return decorated
@@ -1,3 +1,4 @@
+import os
 import json
 import asyncio
 import logging
@@ -8,17 +9,24 @@ from jsonschema import validate
 from signal import SIGHUP, SIGINT, SIGTERM
 
 from .api import Api
+from .api.admission import ApiAdmission
+from .api.batch import ApiBatch
+from .api.cache import ApiCache
 from .api.bus import ApiBusTopics, ApiBusPublish
 from .api.config import ApiConfiguration, ApiSwagger
+from .api.metrics import ApiMetrics
 from .bus import MqttBus
+from .client import HttpClient
 from .commands import get_command_kwargs
 from .config import get_full_config, write_conf_json, merge_configs
 from .debugging import StackSampler, ApiSampleEmitter
 from .logs import DEFAULT_LOGGING
+from .metrics import REGISTRY
 from .services import ServiceManager
 from .discovery import Discovery
 from .raft import RaftProtocol, ApiRaft
 from .memory import Memory
+from .workers import WorkerSupervisor
 
 
 log = logging.getLogger(__name__)
@@ -45,6 +53,8 @@ class Nyuki:
         'properties': {
             'service': {'type': 'string', 'minLength': 1},
             'trace': {'type': 'boolean'},
+            'metrics': {'type': 'boolean'},
+            'workers': {'type': 'integer', 'minimum': 1},
         }
     }
 
@@ -56,6 +66,10 @@ class Nyuki:
         ApiSwagger,
         ApiRaft,
         ApiSampleEmitter,
+        ApiAdmission,
+        ApiMetrics,
+        ApiBatch,
+        ApiCache,
     ]
 
     def __init__(self, **kwargs):
@@ -79,15 +93,28 @@ class Nyuki:
             })
         self.register_schema(self.BASE_CONF_SCHEMA)
 
-        # Setup stack sampling
+        # Pre-fork worker processes if required, before any loop is created
+        self._supervisor = None
+        self._worker = None
+        self._set_workers()
+
+        # Setup stack sampling and metrics
         self._sampler = None
         self._set_stack_sampling()
+        self._set_metrics()
         # Set loop
-        self.loop = asyncio.get_event_loop() or asyncio.new_event_loop()
+        if self._worker is not None:
+            # Never share the parent's loop (and its selector) after a fork
+            self.loop = asyncio.new_event_loop()
+        else:
+            self.loop = asyncio.get_event_loop() or asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
 
         self._services = ServiceManager(self)
-        self._services.add('api', Api(self))
+        self._services.add(
+            'api', Api(self, reuse_port=self._worker is not None)
+        )
+        self._services.add('http', HttpClient(self))
 
         # Add bus service if in conf file
         bus_config = self._config.get('bus')
@@ -104,7 +131,7 @@ class Nyuki:
             self._services.add('discovery', discovery(self))
             # Raft
             self._services.add('raft', RaftProtocol(self))
-            self.discovery.register(self.raft.discovery_handler)
+            self.discovery.register(self.raft.membership_handler)
             # Memory
             if self._config.get('memory'):
                 self._services.add('memory', Memory(self))
@@ -131,14 +158,29 @@ class Nyuki:
     def config(self):
         return self._config
 
+    @property
+    def worker(self):
+        """
+        Worker id of this process in pre-fork mode, None otherwise.
+        """
+        return self._worker
+
     def start(self):
         """
         Start the nyuki
         The nyuki process is terminated when this method is finished
         """
         self._validate_config()
+
+        # The supervisor process only waits for its workers
+        if self._supervisor is not None:
+            self._supervisor.run()
+            return
+
         self.loop.add_signal_handler(SIGTERM, self.abort, SIGTERM)
-        self.loop.add_signal_handler(SIGINT, self.abort, SIGINT)
+        if self._worker is None:
+            # Workers are stopped by their supervisor using SIGTERM
+            self.loop.add_signal_handler(SIGINT, self.abort, SIGINT)
         self.loop.add_signal_handler(SIGHUP, self.hang_up, SIGHUP)
 
         # Configure services with nyuki's configuration
@@ -295,6 +337,7 @@ class Nyuki:
         """
         logging.config.dictConfig(self._config['log'])
         self._set_stack_sampling()
+        self._set_metrics()
         await self.reload()
         for name, service in self._services.all.items():
             if (request is not None and name in request) or request is None:
@@ -302,6 +345,33 @@ class Nyuki:
                 service.configure(**self._config.get(name, {}))
                 asyncio.ensure_future(service.start())
 
+    def _set_workers(self):
+        # Report an invalid configuration before forking, not once per
+        # worker (only the base schema is registered yet)
+        self._validate_config()
+        workers = self._config.get('workers', 1)
+        if workers <= 1:
+            return
+        if self._config.get('service'):
+            raise ValueError("'workers' can't be used along with 'service'")
+
+        self._supervisor = WorkerSupervisor(workers)
+        self._worker = self._supervisor.fork()
+        if self._worker is not None:
+            # Each worker gets its own identity
+            self._supervisor = None
+            self._id = '{}-{}'.format(str(uuid4())[:8], self._worker)
+            log.info('Worker %d started (pid %d)', self._worker, os.getpid())
+
+    def _set_metrics(self):
+        enable = self.config.get('metrics') is True
+        if enable and not REGISTRY.enabled:
+            log.info('Metrics enabled')
+        elif not enable and REGISTRY.enabled:
+            # Start from scratch if metrics are enabled again
+            REGISTRY.clear()
+        REGISTRY.enabled = enable
+
     def _set_stack_sampling(self):
         enable = self.config.get('trace') is True
         # Enable sampler trace
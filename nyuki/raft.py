@@ -1,18 +1,44 @@
-import json
 import math
 import socket
 import logging
 import asyncio
 import aiohttp
+from collections import deque
 from enum import Enum
-from random import uniform
+from random import random, uniform
+from resource import getpagesize
 
+from nyuki import metrics
 from nyuki.services import Service
 from nyuki.api import Response, resource
+from nyuki.utils import HashRing
 
 
 log = logging.getLogger(__name__)
 
+RAFT_REQUESTS = metrics.counter(
+    'nyuki_raft_requests_total', 'Raft requests sent to each peer',
+    ['peer', 'method', 'result'],
+)
+RAFT_RTT = metrics.histogram(
+    'nyuki_raft_request_rtt_seconds', 'Raft requests round-trip time',
+    ['peer', 'method'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0),
+)
+RAFT_LOG = metrics.counter(
+    'nyuki_raft_log_replications_total',
+    'Cluster map replications sent in heartbeats', ['kind'],
+)
+RAFT_PARTITION = metrics.counter(
+    'nyuki_partitioned_events_total',
+    'Partitioned bus events, processed or owned by another instance',
+    ['result'],
+)
+RAFT_JOBS = metrics.counter(
+    'nyuki_raft_leader_jobs_total', 'Leader-only jobs runs',
+    ['job', 'result'],
+)
+
 
 class State(Enum):
     UNKNOWN = 'unknown'
@@ -43,6 +69,12 @@ class ApiRaft:
                 status=403,
                 body={'voted': proto.voted_for, 'instance': proto.uid}
             )
+        # The current leader is still alive
+        if proto.pre_vote and proto.leader_alive():
+            return Response(
+                status=403,
+                body={'leader': True, 'instance': proto.uid}
+            )
 
         # Local variables
         data = await request.json()
@@ -53,65 +85,550 @@ class ApiRaft:
         proto.set_timer(proto.candidate)
         return Response(status=200, body={'instance': proto.uid})
 
+    async def patch(self, request):
+        """
+        Raft pre-vote request: would this instance vote for the candidate?
+        Nothing changes until the candidate gets the majority and starts a
+        real election.
+        """
+        proto = self.nyuki.raft
+        return Response(status=200, body={
+            'instance': proto.uid,
+            'granted': not proto.leader_alive(),
+        })
+
+    async def get(self, request):
+        """
+        Return the state of this instance, the round-trip times to its
+        peers and, on the leader, their suspicion level and load.
+        """
+        proto = self.nyuki.raft
+        now = proto.loop.time()
+        peers = {
+            ipv4: {'instance': proto.cluster.get(ipv4), **rtt.stats()}
+            for ipv4, rtt in proto.rtt.items()
+        }
+        for ipv4, detector in proto.detectors.items():
+            if ipv4 in peers:
+                peers[ipv4].update(detector.stats(now))
+        for ipv4, load in proto.loads.items():
+            if ipv4 in peers:
+                peers[ipv4]['load'] = load
+        return Response({
+            'instance': proto.uid,
+            'state': proto.state.value,
+            'term': proto.term,
+            'peers': peers,
+        })
+
     async def post(self, request):
         """
         Heartbeat endpoint.
         """
         proto = self.nyuki.raft
         data = await request.json()
-        suspicious = proto.suspicious
+        suspicious = list(proto.suspicious)
 
         # Local variables
         proto.state = State.FOLLOWER
         proto.votes = 0
         proto.voted_for = None
-        proto.log = data['log']
+        proto.leader_contact = proto.loop.time()
+        proto.follow_heartbeat(data.get('heartbeat'))
+        proto.follow_jobs(data.get('jobs'))
+        version = proto.replicate(data)
         proto.suspicious.clear()
 
         # Reset the timer
         proto.set_timer(proto.candidate)
         return Response(status=200, body={
             'instance': proto.uid,
-            'suspicious': list(suspicious)
+            'suspicious': suspicious,
+            'version': version,
+            'load': proto.load_vector(),
         })
 
 
+class PeerRtt:
+    """
+    Smoothed round-trip time to a peer, computed as TCP does (RFC 6298).
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.last = None
+        self.samples = 0
+        self.failures = 0
+        # Requests failed in a row, since the last answer
+        self.missed = 0
+
+    def update(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.ALPHA * (rtt - self.srtt)
+        self.last = rtt
+        self.samples += 1
+        self.missed = 0
+
+    @property
+    def rto(self):
+        """
+        Upper bound of the expected round-trip time.
+        """
+        if self.srtt is None:
+            return None
+        return self.srtt + 4 * self.rttvar
+
+    def stats(self):
+        return {
+            'srtt': self.srtt,
+            'rttvar': self.rttvar,
+            'last': self.last,
+            'samples': self.samples,
+            'failures': self.failures,
+        }
+
+
+class LeaderJob:
+    """
+    Periodic coroutine run by the leader of the cluster only, every
+    `interval` seconds from the start of its previous run, wherever it ran.
+    """
+
+    def __init__(self, name, coro_factory, interval, loop):
+        self.name = name
+        self.coro_factory = coro_factory
+        self.interval = interval
+        self.loop = loop
+        # Loop time of the last run's start, on this leader or another one
+        self.last_run = None
+        self._future = None
+
+    @property
+    def running(self):
+        return self._future is not None
+
+    def start(self):
+        if self._future is None:
+            self._future = asyncio.ensure_future(self._run(), loop=self.loop)
+
+    def stop(self):
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
+
+    async def _run(self):
+        while True:
+            if self.last_run is not None:
+                delay = self.last_run + self.interval - self.loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self.last_run = self.loop.time()
+            try:
+                await self.coro_factory()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Leader job '%s' failed", self.name)
+                RAFT_JOBS.labels(self.name, 'error').inc()
+            else:
+                RAFT_JOBS.labels(self.name, 'ok').inc()
+
+
+class PhiAccrual:
+    """
+    Phi accrual failure detector, fed with the heartbeat arrivals of a peer.
+    Rather than a yes/no answer after a fixed delay, phi grows with the time
+    elapsed since the last arrival, relative to the intervals seen so far:
+    phi = 1 means a 10% chance to be wrong in suspecting the peer, phi = 2
+    a 1% chance, and so on.
+    Paper: https://doi.org/10.1109/RELDIS.2004.1353004
+    """
+
+    # Number of inter-arrival intervals kept
+    WINDOW = 50
+
+    def __init__(self, interval, now, min_std=0.1, pause=0.0):
+        # Bootstrap the history with the expected interval, the peer is
+        # watched from `now` until its first heartbeat
+        self.intervals = deque([interval, interval], maxlen=self.WINDOW)
+        self.last = now
+        self.min_std = min_std
+        self.pause = pause
+        self._started = False
+
+    def heartbeat(self, now):
+        if self._started:
+            self.intervals.append(now - self.last)
+        self._started = True
+        self.last = now
+
+    def phi(self, now):
+        count = len(self.intervals)
+        mean = sum(self.intervals) / count
+        variance = sum((i - mean) ** 2 for i in self.intervals) / count
+        std = max(math.sqrt(variance), self.min_std)
+        # Logistic approximation of the normal distribution's CDF
+        y = (now - self.last - mean - self.pause) / std
+        exponent = -y * (1.5976 + 0.070566 * y * y)
+        e = math.exp(min(max(exponent, -700), 700))
+        if y > 0:
+            return -math.log10(e / (1 + e))
+        return -math.log10(1 - 1 / (1 + e))
+
+    def stats(self, now):
+        return {'phi': self.phi(now), 'last_heartbeat': now - self.last}
+
+
+def _memory():
+    """
+    Resident memory of this process in MiB, None where unknown.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * getpagesize() / 2 ** 20
+
+
+def load_scores(loads):
+    """
+    Compare instances by load: each value of their load vectors is scaled
+    by the highest one among them, and summed up.
+    """
+    highest = {}
+    for load in loads.values():
+        for name, value in load.items():
+            highest[name] = max(highest.get(name, 0), value or 0)
+    return {
+        key: sum(
+            (value or 0) / highest[name]
+            for name, value in load.items() if highest[name]
+        )
+        for key, load in loads.items()
+    }
+
+
 class RaftProtocol(Service):
     """
     Leader election based on Raft distributed algorithm.
     Paper: https://raft.github.io/raft.pdf
     """
 
+    # Heartbeat interval and election timeouts range, when not adapted
     HEARTBEAT = 1.0
     TIMEOUT = (2.0, 3.5)
+    # Adapted heartbeat interval, as a multiple of the peers' RTO
+    RTO_FACTOR = 10
+    # Number of cluster map changes kept to be sent as deltas
+    LOG_HISTORY = 32
+    # Event loop lag probe interval, and smoothing of the measures
+    LAG_PROBE = 0.5
+    LAG_ALPHA = 1 / 4
+    # Lower bound of the heartbeat intervals' standard deviation, so that a
+    # perfectly regular network doesn't turn any jitter into a failure
+    PHI_MIN_STD = 0.1
+    # Requests failed in a row before a suspected follower is failing, so
+    # that a stalled but answering instance isn't
+    FAILED_RPCS = 2
+    # Default acceptable pause of the failure detectors, as a multiple of
+    # the longest election timeout: followers' stalls are tolerated as long
+    # as they don't disrupt the cluster
+    PAUSE_FACTOR = 1.5
+
+    CONF_SCHEMA = {
+        'type': 'object',
+        'properties': {
+            'raft': {
+                'type': 'object',
+                'properties': {
+                    'port': {'type': 'integer', 'minimum': 1},
+                    'timeout': {'type': 'number', 'minimum': 0},
+                    'keepalive_timeout': {'type': 'number', 'minimum': 0},
+                    'heartbeat_min': {'type': 'number', 'minimum': 0},
+                    'heartbeat_max': {'type': 'number', 'minimum': 0},
+                    'pre_vote': {'type': 'boolean'},
+                    'phi_threshold': {'type': 'number', 'minimum': 0},
+                    'acceptable_pause': {'type': 'number', 'minimum': 0},
+                }
+            }
+        }
+    }
 
     def __init__(self, nyuki):
+        self._nyuki = nyuki
+        self._nyuki.register_schema(self.CONF_SCHEMA)
         self.service = nyuki.config['service']
         self.loop = nyuki.loop or asyncio.get_event_loop()
         self.uid = nyuki.id
         self.ipv4 = socket.gethostbyname(socket.gethostname())
         self.handlers = {event: set() for event in Event}
+        self.jobs = {}
 
         self.cluster = {}
-        self.suspicious = DanausSet(after=5, callback=self.failure_handler)
+        # Discovered addresses, and ports when the discovery provides them
+        self.discovered = set()
+        self.ports = {}
+        # Partition keys owned by each instance of the cluster
+        self.ring = HashRing([self.ipv4])
+        # Failing instances to report to the leader
+        self.suspicious = set()
         self.timer = None
-        self.state = State.UNKNOWN
+        self._state = State.UNKNOWN
         self.term = -1
         self.votes = -1
         self.voted_for = None
         self.majority = math.inf
+        # Last heartbeat received from a leader (loop time)
+        self.leader_contact = None
+        self.pre_vote = False
+        # Cluster map, versioned by the leader that replicated it
         self.log = {}
+        self.log_leader = None
+        self.log_version = None
+        # Leader only
+        self._tick = None
+        self._journal = deque(maxlen=self.LOG_HISTORY)
+        self.acked = {}
+        # Failure detection, the last uid handled as failing for each ipv4
+        self.detectors = {}
+        self.failed = {}
+        self.phi_threshold = 8.0
+        self._acceptable_pause = self.TIMEOUT[1] * self.PAUSE_FACTOR
+        # Load vectors of the followers, and of this instance
+        self._loads = {}
+        self.load_probes = {}
+        self.loop_lag = 0.0
+        self._lag_probe = None
+        # Heartbeat interval used by the leader (or received from it), the
+        # election timeouts are scaled accordingly
+        self.heartbeat_interval = self.HEARTBEAT
+        self._heartbeat_bounds = (self.HEARTBEAT, self.HEARTBEAT)
+        # Transport
+        self.rtt = {}
+        self._port = None
+        self._timeout = 0.5
+        self._keepalive_timeout = 30
+        self._session = None
+
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        """
+        Leader-only jobs start and stop along the leadership.
+        """
+        previous, self._state = self._state, state
+        if state is State.LEADER and previous is not State.LEADER:
+            for job in self.jobs.values():
+                job.start()
+            self._dispatch(Event.ELECTED)
+        elif previous is State.LEADER and state is not State.LEADER:
+            log.info("Leadership lost for the service '%s'", self.service)
+            for job in self.jobs.values():
+                job.stop()
+            self._dispatch(Event.DISMISSED)
 
     @property
     def network(self):
         return {**self.cluster, self.ipv4: self.uid}
 
-    def configure(self, *args, **kwargs):
-        pass
+    @property
+    def port(self):
+        """
+        Port of the peers' API when not discovered, the same as this
+        instance's by default.
+        """
+        return self._port or self._nyuki.api.port
+
+    def configure(self, port=None, timeout=0.5, keepalive_timeout=30,
+                  heartbeat_min=0.25, heartbeat_max=None, pre_vote=True,
+                  phi_threshold=8.0, acceptable_pause=None):
+        self._port = port
+        self.pre_vote = pre_vote
+        self.phi_threshold = phi_threshold
+        self._timeout = timeout
+        self._keepalive_timeout = keepalive_timeout
+        heartbeat_max = heartbeat_max or self.HEARTBEAT
+        # Based on the slowest heartbeat, whatever the adapted interval is
+        if acceptable_pause is None:
+            acceptable_pause = (
+                heartbeat_max * self.TIMEOUT[1] / self.HEARTBEAT *
+                self.PAUSE_FACTOR
+            )
+        self._acceptable_pause = acceptable_pause
+        self._heartbeat_bounds = (min(heartbeat_min, heartbeat_max),
+                                  heartbeat_max)
+        # Be conservative until a leader tells otherwise
+        self.heartbeat_interval = heartbeat_max
+
+    @property
+    def election_timeout(self):
+        """
+        Election timeouts range, scaled along the heartbeat interval.
+        """
+        scale = self.heartbeat_interval / self.HEARTBEAT
+        return (self.TIMEOUT[0] * scale, self.TIMEOUT[1] * scale)
+
+    def _clamp_heartbeat(self, interval):
+        low, high = self._heartbeat_bounds
+        return min(max(interval, low), high)
+
+    def adapt_heartbeat(self):
+        """
+        Leader only: derive the heartbeat interval from the slowest
+        follower's RTO (smoothed RTT plus variance).
+        """
+        rtos = [
+            self.rtt[ipv4].rto for ipv4 in self.cluster
+            if ipv4 in self.rtt and self.rtt[ipv4].rto is not None
+        ]
+        if not rtos:
+            interval = self._heartbeat_bounds[1]
+        else:
+            interval = self._clamp_heartbeat(max(rtos) * self.RTO_FACTOR)
+        self.heartbeat_interval = interval
+        return interval
+
+    def follow_heartbeat(self, interval):
+        """
+        Follower: use the leader's heartbeat interval for the election
+        timeouts, within this instance's own bounds.
+        """
+        if interval is None:
+            interval = self._heartbeat_bounds[1]
+        self.heartbeat_interval = self._clamp_heartbeat(interval)
 
     def register(self, etype, callback):
         self.handlers[Event(etype)].add(callback)
 
+    def _dispatch(self, event, *args):
+        for callback in self.handlers[event]:
+            asyncio.ensure_future(callback(*args))
+
+    def run_on_leader(self, coro_factory, interval, name=None):
+        """
+        Run `coro_factory()` every `interval` seconds on the leader only, so
+        that cluster-wide jobs run once per service. A new leader takes over
+        from the last run it heard of in the heartbeats.
+        """
+        name = name or coro_factory.__qualname__
+        if name in self.jobs:
+            raise ValueError("Leader job '{}' already exists".format(name))
+        job = LeaderJob(name, coro_factory, interval, self.loop)
+        self.jobs[name] = job
+        if self.state is State.LEADER:
+            job.start()
+        return job
+
+    def register_load(self, name, probe):
+        """
+        Add `probe()` to this instance's load vector.
+        """
+        self.load_probes[name] = probe
+
+    def load_vector(self):
+        """
+        Load of this instance: event loop lag (seconds), resident memory
+        (MiB) and the registered probes.
+        """
+        load = {'lag': round(self.loop_lag, 4)}
+        memory = _memory()
+        if memory is not None:
+            load['memory'] = round(memory, 1)
+        for name, probe in self.load_probes.items():
+            load[name] = probe()
+        return load
+
+    @property
+    def loads(self):
+        """
+        Leader only: the last load reported by each instance of the cluster.
+        """
+        return {
+            **{
+                ipv4: load for ipv4, load in self._loads.items()
+                if ipv4 in self.cluster
+            },
+            self.ipv4: self.load_vector(),
+        }
+
+    def add_load(self, ipv4, name, amount=1):
+        """
+        Account for work sent to an instance, until it reports its load.
+        """
+        load = self._loads.get(ipv4)
+        if load is not None:
+            load[name] = load.get(name, 0) + amount
+
+    def least_loaded(self, ipv4s):
+        """
+        Sort instances from the least loaded, the ones that never reported
+        their load come last, ties are broken randomly.
+        """
+        loads = self.loads
+        scores = load_scores({
+            ipv4: loads[ipv4] for ipv4 in ipv4s if ipv4 in loads
+        })
+        return sorted(ipv4s, key=lambda ipv4: (
+            scores.get(ipv4, math.inf), random()
+        ))
+
+    def _probe_lag(self, expected=None):
+        """
+        Measure how late the event loop runs a callback.
+        """
+        now = self.loop.time()
+        if expected is not None:
+            lag = max(now - expected, 0)
+            self.loop_lag += self.LAG_ALPHA * (lag - self.loop_lag)
+        self._lag_probe = self.loop.call_later(
+            self.LAG_PROBE, self._probe_lag, now + self.LAG_PROBE
+        )
+
+    def owns(self, key):
+        """
+        Whether the partition `key` belongs to this instance.
+        """
+        return self.ring.get(key) == self.ipv4
+
+    def partitioned(self, callback, key=None):
+        """
+        Wrap a bus callback so that it only receives the events this
+        instance owns, partitioned by `key(topic, data)` (the topic by
+        default) among the whole cluster.
+        """
+        async def owned(topic, data):
+            if not self.owns(key(topic, data) if key else topic):
+                RAFT_PARTITION.labels('dropped').inc()
+                return
+            RAFT_PARTITION.labels('owned').inc()
+            await callback(topic, data)
+
+        owned.__name__ = callback.__name__
+        return owned
+
+    def follow_jobs(self, ages):
+        """
+        Follower: time since the leader's jobs last started.
+        """
+        if not ages:
+            return
+        now = self.loop.time()
+        for name, age in ages.items():
+            if name in self.jobs:
+                self.jobs[name].last_run = now - age
+
     def set_timer(self, cb, factor=1):
         """
         Set or reset a unique timer.
@@ -119,28 +636,87 @@ class RaftProtocol(Service):
         if self.timer:
             self.timer.cancel()
         self.timer = self.loop.call_later(
-            uniform(*self.TIMEOUT) * factor, asyncio.ensure_future, cb()
+            uniform(*self.election_timeout) * factor,
+            lambda: asyncio.ensure_future(cb())
+        )
+
+    def _new_session(self):
+        """
+        Raft requests get their own small pool of kept-alive connections,
+        so that they never wait behind the nyuki's other HTTP requests.
+        """
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=0,
+                limit_per_host=2,
+                keepalive_timeout=self._keepalive_timeout,
+                loop=self.loop,
+            ),
+            loop=self.loop,
         )
 
-    @staticmethod
-    async def request(ipv4, method, data=None):
+    def leader_alive(self):
+        """
+        Whether this instance is the leader or heard from one within the
+        minimum election timeout, in which case it refuses to vote.
+        """
+        if self.state is State.LEADER:
+            return True
+        return (
+            self.state is State.FOLLOWER and
+            self.leader_contact is not None and
+            self.loop.time() - self.leader_contact < self.election_timeout[0]
+        )
+
+    async def _send(self, ipv4, method, data):
+        """
+        Transport of the Raft requests, return the status and JSON body.
+        """
+        if self._session is None:
+            self._session = self._new_session()
+        url = 'http://{}:{}/v1/raft'.format(
+            ipv4, self.ports.get(ipv4) or self.port
+        )
+        async with self._session.request(method, url, json=data) as resp:
+            if resp.status != 200:
+                return resp.status, None
+            return resp.status, await resp.json()
+
+    async def request(self, ipv4, method, data=None):
         """
         Utility method to perform HTTP requests, Raft-specific, to an instance.
         """
-        request = {
-            'url': 'http://{host}:5558/v1/raft'.format(host=ipv4),
-            'headers': {'Content-Type': 'application/json'},
-            'data': json.dumps(data or {})
-        }
+        _, body = await self._rpc(ipv4, method, data)
+        return body
+
+    async def _rpc(self, ipv4, method, data=None):
+        """
+        Same as `request`, also returning the status (None on failure).
+        """
+        rtt = self.rtt.setdefault(ipv4, PeerRtt())
+        method = method.upper()
+        start = self.loop.time()
         try:
-            async with aiohttp.ClientSession() as session:
-                http_method = getattr(session, method)
-                async with http_method(**request) as resp:
-                    if resp.status != 200:
-                        return
-                    return await resp.json()
+            # aiohttp rounds its own timeouts up to the next second
+            status, body = await asyncio.wait_for(
+                self._send(ipv4, method, data or {}), self._timeout
+            )
+        except asyncio.TimeoutError:
+            result, status, body = 'timeout', None, None
         except (aiohttp.ClientError, ConnectionError):
-            return
+            result, status, body = 'error', None, None
+        else:
+            # Any answer, even a refused vote, is a round-trip
+            elapsed = self.loop.time() - start
+            rtt.update(elapsed)
+            RAFT_RTT.labels(ipv4, method).observe(elapsed)
+            result = 'ok' if body is not None else str(status)
+
+        if result in ('timeout', 'error'):
+            rtt.failures += 1
+            rtt.missed += 1
+        RAFT_REQUESTS.labels(ipv4, method, result).inc()
+        return status, body
 
     async def start(self, *args, **kwargs):
         """
@@ -149,6 +725,8 @@ class RaftProtocol(Service):
         self.state = State.FOLLOWER
         self.term = 0
         self.votes = 0
+        if self._lag_probe is None:
+            self._probe_lag()
         # Won't bootstrap the timer here to avoid any unwanted early election
 
     async def stop(self, *args, **kwargs):
@@ -158,10 +736,33 @@ class RaftProtocol(Service):
         self.state = State.FOLLOWER
         if self.timer:
             self.timer.cancel()
+        if self._tick:
+            self._tick.cancel()
+            self._tick = None
+        if self._lag_probe:
+            self._lag_probe.cancel()
+            self._lag_probe = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def membership_handler(self, added, removed):
+        """
+        The discovery service provides the instances that joined (with
+        their port, if known) and left.
+        """
+        for ipv4 in removed:
+            self.discovered.discard(ipv4)
+            self.ports.pop(ipv4, None)
+        for ipv4, port in added.items():
+            self.discovered.add(ipv4)
+            if port is not None:
+                self.ports[ipv4] = port
+        await self.discovery_handler(self.discovered)
 
     async def discovery_handler(self, addresses):
         """
-        The discovery service provides updates periodically.
+        Update the cluster from all the discovered addresses.
         """
         cluster = {ipv4: self.cluster.get(ipv4) for ipv4 in addresses}
         if self.ipv4 in cluster:
@@ -173,14 +774,22 @@ class RaftProtocol(Service):
 
         # Check differences
         added = set(cluster.keys()) - set(self.cluster.keys())
-        self.suspicious.update([
+        self.suspect([
             (ipv4, self.cluster[ipv4] or self.log.get(ipv4))
             for ipv4 in set(self.cluster.keys()) - set(cluster.keys())
         ])
         self.cluster = cluster
+        if self.ring.update(self.network):
+            log.info(
+                'Partitions shared among %d instances', len(self.ring.nodes)
+            )
+        for peers in (self.rtt, self.acked, self.detectors, self._loads):
+            for ipv4 in set(peers) - set(cluster):
+                del peers[ipv4]
 
         if self.state is State.LEADER:
-            # Schedule HB for new workers
+            # New workers get the cluster map without waiting for the tick
+            self.update_log()
             for ipv4 in added:
                 asyncio.ensure_future(self.heartbeat(ipv4))
         elif self.state is State.FOLLOWER and not self.timer:
@@ -188,15 +797,50 @@ class RaftProtocol(Service):
             # Initial factor for the timer is higher (discovery reasons)
             self.set_timer(self.candidate, 5)
 
+    def suspect(self, instances):
+        """
+        Instances known to have failed are handled by the leader, followers
+        report them in their next heartbeat response.
+        """
+        if not instances:
+            return
+        if self.state is State.LEADER:
+            asyncio.ensure_future(self.failure_handler(instances))
+        else:
+            self.suspicious.update(instances)
+
+    def check_failures(self):
+        """
+        Leader only: the followers whose suspicion level reached the
+        threshold, and that no longer answer requests, are failing.
+        Discovery removals and uid changes are suspected as they happen.
+        """
+        now = self.loop.time()
+        failing = [
+            (ipv4, self.cluster[ipv4])
+            for ipv4, detector in self.detectors.items()
+            if ipv4 in self.cluster and
+            ipv4 in self.rtt and
+            self.rtt[ipv4].missed >= self.FAILED_RPCS and
+            detector.phi(now) >= self.phi_threshold
+        ]
+        if failing:
+            asyncio.ensure_future(self.failure_handler(failing))
+
     async def failure_handler(self, instances):
         """
-        Handle suspicous instances.
+        Handle failing instances, each one once.
         """
-        failing = [uid for ipv4, uid in instances if uid is not None]
+        failing = []
+        for ipv4, uid in instances:
+            if uid is None or self.failed.get(ipv4) == uid:
+                continue
+            self.failed[ipv4] = uid
+            failing.append(uid)
         if not failing:
             return
-        for callback in self.handlers[Event.FAILURES]:
-            asyncio.ensure_future(callback(failing))
+        log.info('Failing instances: %s', ', '.join(failing))
+        self._dispatch(Event.FAILURES, failing)
 
     async def candidate(self):
         """
@@ -209,6 +853,13 @@ class RaftProtocol(Service):
             await self.promote()
             return
 
+        # Don't disrupt a live leader with a new term
+        if self.pre_vote and not await self.request_pre_votes():
+            log.debug('Pre-vote failed, not starting an election')
+            if self.state is not State.LEADER:
+                self.set_timer(self.candidate)
+            return
+
         # Local variables
         self.state = State.CANDIDATE
         self.term += 1
@@ -239,12 +890,47 @@ class RaftProtocol(Service):
 
         # Use the log to restore ipv4-to-uid mapping
         for ipv4, uid in self.log.items():
-            if self.cluster.get(ipv4):
+            if ipv4 in self.cluster and not self.cluster[ipv4]:
                 self.cluster[ipv4] = uid
 
+        # Followers are watched from their first heartbeat, suspicions
+        # not reported yet are now this instance's to handle
+        self.detectors = {}
+        self.suspect(list(self.suspicious))
+        self.suspicious.clear()
+
         # Sending heartbeats to the cluster
-        for ipv4 in self.cluster:
-            asyncio.ensure_future(self.heartbeat(ipv4))
+        asyncio.ensure_future(self.broadcast())
+
+    async def request_pre_votes(self):
+        """
+        Ask the cluster whether this instance could win an election, ie.
+        whether a majority did not hear from a leader lately.
+        """
+        if self.leader_alive():
+            return False
+        majority = int(math.floor((len(self.cluster) + 1) / 2) + 1)
+        granted = 1
+        pending = {
+            asyncio.ensure_future(
+                self._rpc(ipv4, 'patch', {'candidate': self.uid})
+            )
+            for ipv4 in self.cluster
+        }
+        # Don't wait for the unreachable instances once the majority is there
+        while pending and granted < majority:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                status, body = task.result()
+                # Instances not knowing pre-votes (405) would vote
+                if status == 405 or (body is not None and body['granted']):
+                    granted += 1
+        for task in pending:
+            task.cancel()
+        # A leader may have shown up meanwhile
+        return granted >= majority and not self.leader_alive()
 
     async def request_vote(self, ipv4, term):
         """
@@ -271,6 +957,120 @@ class RaftProtocol(Service):
         if self.votes >= self.majority:
             await self.promote()
 
+    def update_log(self):
+        """
+        Leader only: record the changes of the cluster map as a new version.
+        """
+        if self.log_leader != self.uid:
+            # Start a new versioned log, followers get it whole at first
+            self.log = {}
+            self.log_leader = self.uid
+            self.log_version = 0
+            self._journal.clear()
+            self.acked = {}
+
+        network = self.network
+        if network == self.log:
+            return
+        delta = {
+            'set': {
+                ipv4: uid for ipv4, uid in network.items()
+                if ipv4 not in self.log or self.log[ipv4] != uid
+            },
+            'del': [ipv4 for ipv4 in self.log if ipv4 not in network],
+        }
+        self.log_version += 1
+        self.log = network
+        self._journal.append((self.log_version, delta))
+
+    def _log_entry(self, ipv4):
+        """
+        What a follower misses of the log: the changes since the version
+        it acknowledged, or the whole log if they are not known anymore.
+        """
+        acked = self.acked.get(ipv4)
+        if (
+            acked is not None and acked <= self.log_version and (
+                acked == self.log_version or
+                (self._journal and self._journal[0][0] <= acked + 1)
+            )
+        ):
+            changes = {}
+            removed = set()
+            for version, delta in self._journal:
+                if version <= acked:
+                    continue
+                for key in delta['del']:
+                    changes.pop(key, None)
+                    removed.add(key)
+                for key, uid in delta['set'].items():
+                    changes[key] = uid
+                    removed.discard(key)
+            RAFT_LOG.labels('delta').inc()
+            return {'base': acked, 'delta': {
+                'set': changes, 'del': list(removed)
+            }}
+        RAFT_LOG.labels('snapshot').inc()
+        return {'log': self.log}
+
+    def replicate(self, data):
+        """
+        Follower side: apply the log received in a heartbeat, return the
+        version held to acknowledge it (None if unknown).
+        """
+        leader = data.get('leader')
+        if 'log' in data:
+            self.log = data['log']
+            self.log_leader = leader
+            self.log_version = data.get('version')
+        elif (
+            self.log_leader == leader and
+            self.log_version is not None and
+            self.log_version == data.get('base')
+        ):
+            log = {
+                ipv4: uid for ipv4, uid in self.log.items()
+                if ipv4 not in data['delta']['del']
+            }
+            log.update(data['delta']['set'])
+            self.log = log
+            self.log_version = data['version']
+        # Else, out of sync: the acknowledged version tells the leader what
+        # to send next
+        if self.log_leader != leader:
+            return None
+        return self.log_version
+
+    async def broadcast(self):
+        """
+        Leader tick: send heartbeats to all the followers at once, all the
+        answers are expected before the next tick.
+        """
+        if self.state is not State.LEADER:
+            self._tick = None
+            return
+
+        # Schedule the next tick, the followers learn the new interval from
+        # this tick's heartbeats
+        interval = self.adapt_heartbeat()
+        self._tick = self.loop.call_later(
+            interval, lambda: asyncio.ensure_future(self.broadcast())
+        )
+
+        self.check_failures()
+        self.update_log()
+        tasks = {
+            asyncio.ensure_future(self.heartbeat(ipv4)): ipv4
+            for ipv4 in self.cluster
+        }
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=interval)
+        for task in pending:
+            # Missed the deadline, the failure detector takes it from here
+            task.cancel()
+            self.rtt.setdefault(tasks[task], PeerRtt()).missed += 1
+
     async def heartbeat(self, ipv4):
         """
         Send a heartbeat to reset instance's timer.
@@ -283,77 +1083,52 @@ class RaftProtocol(Service):
         ):
             return
 
-        # Schedule the next HB
-        self.loop.call_later(
-            self.HEARTBEAT, asyncio.ensure_future, self.heartbeat(ipv4)
-        )
+        if ipv4 not in self.detectors:
+            self.detectors[ipv4] = self._new_detector()
 
         # Heartbeats allow to refresh follower's timers and to replicate logs
-        response = await self.request(ipv4, 'post', {
+        data = {
             'leader': self.uid,
-            'log': self.network
-        })
+            'heartbeat': self.heartbeat_interval,
+            'version': self.log_version,
+            **self._log_entry(ipv4),
+        }
+        # And the jobs' schedule, for the next leader to follow it
+        now = self.loop.time()
+        jobs = {
+            name: now - job.last_run for name, job in self.jobs.items()
+            if job.last_run is not None
+        }
+        if jobs:
+            data['jobs'] = jobs
+        response = await self.request(ipv4, 'post', data)
 
-        # Empty answer or no response is suspicious
-        uid = self.cluster.get(ipv4)
-        if not response:
-            self.suspicious.add((ipv4, uid))
+        # Empty answer or no response raises the suspicion level
+        if not response or ipv4 not in self.cluster:
             return
+        uid = self.cluster[ipv4]
+        instance = response['instance']
 
-        # An instance isn't referenced under the same ID anymore
-        if uid and uid != response['instance']:
-            self.suspicious.add((ipv4, uid))
-        self.cluster[ipv4] = response['instance']
-
-        # Collect suspicious instances from heartbeat's response
-        self.suspicious.update(
-            [tuple(entry) for entry in response['suspicious']]
-        )
+        if uid and uid != instance:
+            # An instance isn't referenced under the same ID anymore
+            self.suspect([(ipv4, uid)])
+            self.detectors[ipv4] = self._new_detector()
+        elif ipv4 in self.detectors:
+            self.detectors[ipv4].heartbeat(self.loop.time())
+        if self.failed.get(ipv4) == instance:
+            # Wrongly handled as failing, it can fail again
+            del self.failed[ipv4]
+        self.cluster[ipv4] = instance
+        self.acked[ipv4] = response.get('version')
+        if 'load' in response:
+            self._loads[ipv4] = response['load']
 
+        # Collect failing instances from heartbeat's response
+        self.suspect([tuple(entry) for entry in response['suspicious']])
 
-class DanausSet(set):
-    """
-    Named after the myth of the daughters of Danaus.
-    This set can be filled up but will eventually be emptied (upon timeout).
-    """
+    def _new_detector(self):
+        return PhiAccrual(
+            self.heartbeat_interval, self.loop.time(),
+            min_std=self.PHI_MIN_STD, pause=self._acceptable_pause,
+        )
 
-    def __init__(self, seq=(), *, after=1, callback=None, loop=None):
-        super().__init__(seq)
-        self.loop = loop or asyncio.get_event_loop()
-        self.after = after
-        self.callback = callback
-        self._timer = None
-
-    def abort(self):
-        if self._timer:
-            self._timer.cancel()
-        self._timer = None
-
-    def add(self, item):
-        if item not in self:
-            self._schedule()
-        super().add(item)
-
-    def update(self, seq):
-        if set(seq) - self:
-            self._schedule()
-        super().update(seq)
-
-    def clear(self):
-        super().clear()
-        self.abort()
-
-    def _schedule(self):
-        self.abort()
-        self._timer = self.loop.call_later(self.after, self._empty)
-
-    def _empty(self):
-        cleared = self.copy()
-        self.clear()
-        self._timer = None
-
-        if cleared and self.callback:
-            cb = self.callback
-            if not asyncio.iscoroutine(self.callback):
-                cb = asyncio.coroutine(cb)
-            asyncio.ensure_future(cb(cleared))
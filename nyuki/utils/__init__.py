@@ -1,4 +1,6 @@
 from .dtutils import from_isoformat, utcnow
 from .evaluate import safe_eval, ConditionBlock
+from .fields import field_tree, field_paths, select_fields
 from .serialize import serialize_object
 from .transform import Converter
+from .hashring import HashRing
@@ -0,0 +1,58 @@
+def field_tree(fields):
+    """
+    Turn a list of dotted paths into a tree of nested dicts:
+    ['id', 'template.tasks.state'] -> {'id': {}, 'template': {'tasks': {'state': {}}}}
+    An empty dict selects the whole value.
+    """
+    tree = {}
+    for field in fields:
+        node = tree
+        keys = field.split('.')
+        for key in keys[:-1]:
+            child = node.setdefault(key, {})
+            if child is None:
+                # A parent is already fully selected
+                break
+            node = child
+        else:
+            node[keys[-1]] = None
+    return _clean(tree)
+
+
+def _clean(tree):
+    return {
+        key: {} if sub is None else _clean(sub)
+        for key, sub in tree.items()
+    }
+
+
+def select_fields(value, tree):
+    """
+    Keep only the fields of a tree (see `field_tree`), lists of dicts are
+    filtered item by item.
+    """
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [select_fields(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {
+            key: select_fields(value[key], sub)
+            for key, sub in tree.items()
+            if key in value
+        }
+    return value
+
+
+def field_paths(tree, prefix=''):
+    """
+    Back from a tree to dotted paths, without redundant sub-paths.
+    """
+    paths = []
+    for key, sub in tree.items():
+        path = '{}{}'.format(prefix, key)
+        if sub:
+            paths.extend(field_paths(sub, path + '.'))
+        else:
+            paths.append(path)
+    return paths
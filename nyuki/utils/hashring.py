@@ -0,0 +1,52 @@
+from bisect import bisect
+from hashlib import md5
+
+
+def _hash(value):
+    return int.from_bytes(md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent hashing: each node owns `vnodes` points of a ring, a key
+    belongs to the node of the first point after its own hash. A node
+    joining or leaving only moves the keys next to its own points, about
+    1/N of them.
+    """
+
+    def __init__(self, nodes=(), vnodes=64):
+        self.vnodes = vnodes
+        self._nodes = set()
+        self._points = []
+        self._owners = []
+        self.update(nodes)
+
+    @property
+    def nodes(self):
+        return set(self._nodes)
+
+    def update(self, nodes):
+        """
+        Replace the ring's nodes, return whether they changed.
+        """
+        nodes = set(nodes)
+        if nodes == self._nodes:
+            return False
+        self._nodes = nodes
+        ring = sorted(
+            (_hash('{}#{}'.format(node, index)), node)
+            for node in nodes
+            for index in range(self.vnodes)
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [node for _, node in ring]
+        return True
+
+    def get(self, key):
+        """
+        Node owning `key`, None if the ring is empty.
+        """
+        if not self._points:
+            return None
+        index = bisect(self._points, _hash(str(key))) % len(self._points)
+        return self._owners[index]
@@ -0,0 +1,83 @@
+import os
+import signal
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+class WorkerSupervisor:
+
+    """
+    Pre-fork a nyuki into several worker processes.
+    Each worker runs its own event loop and binds the HTTP API with
+    SO_REUSEPORT, the kernel balancing incoming connections between them.
+    The supervisor only forwards signals and waits for its workers to exit.
+    """
+
+    # Signals relayed from the supervisor to every worker
+    RELAYED = {
+        signal.SIGTERM: signal.SIGTERM,
+        signal.SIGINT: signal.SIGTERM,
+        signal.SIGHUP: signal.SIGHUP,
+    }
+
+    def __init__(self, count):
+        if count < 1:
+            raise ValueError('at least one worker is required')
+        self.count = count
+        self.workers = {}
+
+    def fork(self):
+        """
+        Fork all the workers.
+        Return the worker id in the child processes, None in the supervisor.
+        """
+        for worker in range(self.count):
+            pid = os.fork()
+            if pid == 0:
+                # Stopping the workers is coordinated by the supervisor,
+                # a terminal's SIGINT must not hit them twice.
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                self.workers = {}
+                return worker
+            self.workers[pid] = worker
+        log.info('Forked %d workers: %s', self.count, list(self.workers))
+        return None
+
+    def _relay(self, signum, frame):
+        """
+        Signal handler: forward the signal to all running workers.
+        """
+        relayed = self.RELAYED[signum]
+        log.warning(
+            'Caught signal %d, sending signal %d to workers', signum, relayed
+        )
+        for pid in self.workers:
+            try:
+                os.kill(pid, relayed)
+            except ProcessLookupError:
+                log.debug('Worker %d already exited', pid)
+
+    def run(self):
+        """
+        Block until all the workers have exited.
+        """
+        for signum in self.RELAYED:
+            signal.signal(signum, self._relay)
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else status
+            if code != 0:
+                log.error('Worker %d (pid %d) exited with %d', worker, pid, code)
+            else:
+                log.info('Worker %d (pid %d) exited', worker, pid)
+
+        log.info('All workers exited, stopping supervisor')
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import logging
+from functools import partial
+from aiohttp import web, WSMsgType, WSCloseCode
+
+from nyuki.api import Response, resource, streaming
+from nyuki.utils import serialize_object
+
+
+log = logging.getLogger(__name__)
+
+FILTERS = ('instances', 'templates', 'types')
+
+
+def _query_filters(query):
+    """
+    Read comma-separated filters from the query string
+    """
+    return {
+        key: [value for value in query[key].split(',') if value]
+        for key in FILTERS
+        if key in query
+    }
+
+
+@resource('/workflow/events', versions=['v1'])
+class ApiWorkflowEvents:
+
+    @streaming
+    async def get(self, request):
+        """
+        Stream the workflow exec events through a websocket.
+        Filters are given in the query string and can be replaced at any
+        time by sending a JSON message, e.g. {"instances": ["<uid>"]}
+        """
+        ws = web.WebSocketResponse(heartbeat=30)
+        if not ws.can_prepare(request).ok:
+            return Response(
+                {'error': 'Websocket upgrade required'}, status=400
+            )
+
+        subscriber = self.nyuki.events.subscribe(
+            **_query_filters(request.query)
+        )
+        await ws.prepare(request)
+        sender = asyncio.ensure_future(self._send_events(ws, subscriber))
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                try:
+                    filters = json.loads(msg.data)
+                    subscriber.update(**{
+                        key: list(filters[key])
+                        for key in FILTERS
+                        if key in filters
+                    })
+                except (ValueError, TypeError):
+                    await ws.send_json({'error': 'Invalid filters'})
+        finally:
+            # Wakes the sender up, letting it finish a pending close
+            self.nyuki.events.unsubscribe(subscriber)
+            await sender
+        return ws
+
+    async def _send_events(self, ws, subscriber):
+        dumps = partial(json.dumps, default=serialize_object)
+        try:
+            while True:
+                payload = await subscriber.get()
+                if payload is None:
+                    # Unsubscribed, a slow consumer must reconnect
+                    await ws.close(
+                        code=WSCloseCode.TRY_AGAIN_LATER,
+                        message=b'Slow consumer',
+                    )
+                    return
+                await ws.send_json(payload, dumps=dumps)
+        except (ConnectionError, RuntimeError) as exc:
+            log.debug('Event stream client gone: %s', exc)
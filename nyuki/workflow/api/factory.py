@@ -8,7 +8,10 @@ from aiohttp.web import FileField
 from pymongo.errors import AutoReconnect
 
 from nyuki.workflow.tasks import FACTORY_SCHEMAS
-from nyuki.api import Response, resource, content_type
+from nyuki.api import Response, resource, content_type, cached, invalidates
+from nyuki.workflow.api.utils import (
+    page_params, page_response, is_paged, CACHE_TTL
+)
 
 
 log = logging.getLogger(__name__)
@@ -36,12 +39,21 @@ class ApiFactoryRegexes:
     async def get(self, request):
         """
         Return the list of all regexes
+        Filters:
+            * `title` regexes whose title starts with this value
+            * `offset`/`limit` return a page of regexes
+            * `fields` comma-separated list of fields to return
         """
+        page = page_params(request)
+        title = request.query.get('title')
+        count = None
         try:
-            regexes = await self.nyuki.storage.regexes.get()
+            regexes = await self.nyuki.storage.regexes.get(title=title, **page)
+            if is_paged(page):
+                count = await self.nyuki.storage.regexes.count(title=title)
         except AutoReconnect:
             return Response(status=503)
-        return Response(regexes)
+        return page_response(regexes, count)
 
     async def put(self, request):
         """
@@ -67,6 +79,7 @@ class ApiFactoryRegexes:
             return Response(status=503)
         return Response(regex)
 
+    @invalidates('regexes')
     async def delete(self, request):
         """
         Delete all regexes and return the list
@@ -82,6 +95,7 @@ class ApiFactoryRegexes:
 @resource('/workflow/regexes/{regex_id}', versions=['v1'])
 class ApiFactoryRegex:
 
+    @cached(CACHE_TTL, ['regexes', 'regex:{regex_id}'])
     async def get(self, request, regex_id):
         """
         Return the regex for id `regex_id`
@@ -94,6 +108,7 @@ class ApiFactoryRegex:
             return Response(status=404)
         return Response(regex)
 
+    @invalidates('regex:{regex_id}')
     async def patch(self, request, regex_id):
         """
         Modify an existing regex
@@ -120,6 +135,7 @@ class ApiFactoryRegex:
         await self.nyuki.storage.regexes.insert(regex)
         return Response(regex)
 
+    @invalidates('regex:{regex_id}')
     async def delete(self, request, regex_id):
         """
         Delete the regex with id `regex_id`
@@ -169,12 +185,21 @@ class ApiFactoryLookups:
     async def get(self, request):
         """
         Return the list of all lookups
+        Filters:
+            * `title` lookups whose title starts with this value
+            * `offset`/`limit` return a page of lookups
+            * `fields` comma-separated list of fields to return
         """
+        page = page_params(request)
+        title = request.query.get('title')
+        count = None
         try:
-            lookups = await self.nyuki.storage.lookups.get()
+            lookups = await self.nyuki.storage.lookups.get(title=title, **page)
+            if is_paged(page):
+                count = await self.nyuki.storage.lookups.count(title=title)
         except AutoReconnect:
             return Response(status=503)
-        return Response(lookups)
+        return page_response(lookups, count)
 
     @content_type('multipart/form-data')
     async def post(self, request):
@@ -8,10 +8,15 @@ from tukio.workflow import (
 )
 from pymongo.errors import AutoReconnect
 
-from nyuki.api import Response, resource, content_type, HTTPBreak
+from nyuki.api import (
+    Response, resource, content_type, HTTPBreak, cached, invalidates
+)
 from nyuki.utils import from_isoformat
 from nyuki.workflow.tasks.utils.uri import URI, InvalidWorkflowUri
 from nyuki.workflow.db.workflow_instances import Ordering
+from nyuki.workflow.api.utils import (
+    page_params, page_response, is_paged, list_param, CACHE_TTL
+)
 
 
 log = logging.getLogger(__name__)
@@ -47,20 +52,32 @@ class _WorkflowResource:
 @resource('/workflow/instances', ['v1'], 'application/json')
 class ApiWorkflows(_WorkflowResource):
 
+    # Default and max seconds to wait for a workflow to end (?wait=end)
+    WAIT_TIMEOUT = 60.0
+    MAX_WAIT_TIMEOUT = 600.0
+
     async def get(self, request):
         """
         Return workflow instances
+        Filters:
+            * `children` also return the workflows triggered by others
+            * `tasks` return the graph and tasks of the workflows
+            * `fields` comma-separated list of dotted paths to return
         """
         workflows = []
-        children = request.GET.get('children', '0') == '1'
-        tasks = request.GET.get('tasks', '0') == '1'
+        children = request.query.get('children', '0') == '1'
+        tasks = request.query.get('tasks', '0') == '1'
+        fields = list_param(request, 'fields')
+        if fields:
+            # Requested fields decide whether tasks are needed
+            tasks = True
 
         for wflow in self.nyuki.running_workflows.values():
             if children is False:
                 requester = wflow.exec.get('requester')
                 if requester and requester.startswith('nyuki://'):
                     continue
-            workflows.append(wflow.report(tasks=tasks))
+            workflows.append(wflow.report(tasks=tasks, fields=fields))
 
         return Response(workflows)
 
@@ -72,7 +89,29 @@ class ApiWorkflows(_WorkflowResource):
             "draft": true/false,
             "exec": {}
         }
+        With `?wait=end`, reply once the workflow is over (or after
+        `?timeout=<seconds>` with a 202 and the current report).
         """
+        wait = request.query.get('wait')
+        if wait is not None and wait != 'end':
+            return Response(status=400, body={
+                'error': "'wait' can only be 'end'"
+            })
+        # The timeout is only read when waiting for the end
+        timeout = None
+        if wait == 'end':
+            try:
+                timeout = float(
+                    request.query.get('timeout', self.WAIT_TIMEOUT)
+                )
+            except ValueError:
+                timeout = -1
+            if not 0 < timeout <= self.MAX_WAIT_TIMEOUT:
+                return Response(status=400, body={
+                    'error': "'timeout' must be a number of seconds up to "
+                             "{}".format(self.MAX_WAIT_TIMEOUT)
+                })
+
         async_topic = request.headers.get('X-Surycat-Async-Topic')
         async_events = request.headers.get('X-Surycat-Async-Events')
         exec_track = request.headers.get('X-Surycat-Exec-Track')
@@ -90,7 +129,7 @@ class ApiWorkflows(_WorkflowResource):
         if exec:
             # Suspended/crashed instance
             # The request's payload is the last known execution report
-            templates = [request]
+            template = request
             if exec['id'] in self.nyuki.running_workflows:
                 return Response(status=400, body={
                     'error': 'This workflow is already being rescued'
@@ -152,6 +191,12 @@ class ApiWorkflows(_WorkflowResource):
         if async_topic is not None:
             self.register_async_handler(async_topic, async_events, wflow)
 
+        if wait == 'end':
+            # The workflow instance is a future, done once it is over
+            done, _ = await asyncio.wait([wflow], timeout=timeout)
+            status = 200 if done else 202
+            return Response(wfinst.report(), status=status)
+
         try:
             # Wait up to 30 seconds for the workflow to start.
             await asyncio.wait_for(wfinst.instance._committed.wait(), 30.0)
@@ -169,11 +214,15 @@ class ApiWorkflow:
     async def get(self, request, iid):
         """
         Return a workflow instance
+        `fields` is a comma-separated list of dotted paths to return
         """
         try:
-            return Response(self.nyuki.running_workflows[iid].report(data=False))
+            wflow = self.nyuki.running_workflows[iid]
         except KeyError:
             return Response(status=404)
+        return Response(wflow.report(
+            data=False, fields=list_param(request, 'fields')
+        ))
 
     async def post(self, request, iid):
         """
@@ -289,9 +338,10 @@ class ApiWorkflowsHistory:
             * `limit` return this amount of workflows
             * `order` order results following the Ordering enum values
             * `search` search templates with specific title
+            * `fields` comma-separated list of dotted paths to return
         """
         # Filter on start date
-        since = request.GET.get('since')
+        since = request.query.get('since')
         if since:
             try:
                 since = from_isoformat(since)
@@ -300,7 +350,7 @@ class ApiWorkflowsHistory:
                     'error': "Could not parse date '{}'".format(since)
                 })
         # Filter on state value
-        state = request.GET.get('state')
+        state = request.query.get('state')
         if state:
             try:
                 state = FutureState(state)
@@ -309,7 +359,7 @@ class ApiWorkflowsHistory:
                     'error': "Unknown state '{}'".format(state)
                 })
         # Skip first items
-        offset = request.GET.get('offset')
+        offset = request.query.get('offset')
         if offset:
             try:
                 offset = int(offset)
@@ -318,7 +368,7 @@ class ApiWorkflowsHistory:
                     'error': 'Offset must be an int'
                 })
         # Limit max result
-        limit = request.GET.get('limit')
+        limit = request.query.get('limit')
         if limit:
             try:
                 limit = int(limit)
@@ -326,7 +376,7 @@ class ApiWorkflowsHistory:
                 return Response(status=400, body={
                     'error': 'Limit must be an int'
                 })
-        order = request.GET.get('ordering')
+        order = request.query.get('ordering')
         if order:
             try:
                 order = Ordering[order].value
@@ -337,11 +387,12 @@ class ApiWorkflowsHistory:
 
         try:
             count, history = await self.nyuki.storage.get_history(
-                root=(request.GET.get('root') == '1'),
-                full=(request.GET.get('full') == '1'),
-                search=request.GET.get('search'),
+                root=(request.query.get('root') == '1'),
+                full=(request.query.get('full') == '1'),
+                search=request.query.get('search'),
                 order=order,
                 offset=offset, limit=limit, since=since, state=state,
+                fields=list_param(request, 'fields'),
             )
         except AutoReconnect:
             return Response(status=503)
@@ -356,7 +407,8 @@ class ApiWorkflowHistory:
     async def get(self, request, uid):
         try:
             workflow = await self.nyuki.storage.get_instance(
-                uid, (request.GET.get('full') == '1')
+                uid, (request.query.get('full') == '1'),
+                fields=list_param(request, 'fields'),
             )
         except AutoReconnect:
             return Response(status=503)
@@ -371,7 +423,7 @@ class ApiWorkflowHistoryTask:
     async def get(self, request, uid, task_id):
         try:
             task = await self.nyuki.storage.get_instance_task(
-                task_id, (request.GET.get('full') == '1')
+                task_id, (request.query.get('full') == '1')
             )
         except AutoReconnect:
             return Response(status=503)
@@ -396,16 +448,27 @@ class ApiWorkflowHistoryTaskData:
 @resource('/workflow/triggers', versions=['v1'])
 class ApiWorkflowTriggers:
 
+    @cached(CACHE_TTL, ['triggers'])
     async def get(self, request):
         """
         Return the list of all trigger forms
+        Filters:
+            * `tid` comma-separated list of workflow template ids
+            * `offset`/`limit` return a page of trigger forms
+            * `fields` comma-separated list of fields to return
         """
+        page = page_params(request)
+        tids = list_param(request, 'tid')
+        count = None
         try:
-            triggers = await self.nyuki.storage.triggers.get()
+            triggers = await self.nyuki.storage.triggers.get(tids, **page)
+            if is_paged(page):
+                count = await self.nyuki.storage.triggers.count(tids)
         except AutoReconnect:
             return Response(status=503)
-        return Response(triggers)
+        return page_response(triggers, count)
 
+    @invalidates('triggers')
     @content_type('multipart/form-data')
     async def put(self, request):
         """
@@ -450,6 +513,7 @@ class ApiWorkflowTrigger:
             return Response(status=404)
         return Response(trigger)
 
+    @invalidates('triggers')
     async def delete(self, request, tid):
         """
         Delete a trigger form
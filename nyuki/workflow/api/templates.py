@@ -2,9 +2,12 @@ import logging
 from pymongo.errors import AutoReconnect, DuplicateKeyError
 from tukio.workflow import TemplateGraphError, WorkflowTemplate
 
-from nyuki.api import Response, resource
+from nyuki.api import Response, resource, cached, invalidates
 from nyuki.workflow.validation import validate, TemplateError
 from nyuki.workflow.db.workflow_templates import TemplateState
+from nyuki.workflow.api.utils import (
+    page_params, page_response, is_paged, CACHE_TTL
+)
 
 
 log = logging.getLogger(__name__)
@@ -64,18 +67,36 @@ class _TemplateResource:
 @resource('/workflow/templates', versions=['v1'])
 class ApiTemplates(_TemplateResource):
 
+    @cached(CACHE_TTL, ['templates'])
     async def get(self, request):
         """
         Return available workflows' DAGs
+        Filters:
+            * `full` return the full templates, with their tasks
+            * `title` templates whose title starts with this value
+            * `tag` templates with this tag
+            * `topic` templates listening on this topic
+            * `offset`/`limit` return a page of templates
+            * `fields` comma-separated list of fields to return
         """
+        page = page_params(request)
+        filters = {
+            'title': request.query.get('title'),
+            'tag': request.query.get('tag'),
+            'topic': request.query.get('topic'),
+        }
+        count = None
         try:
             templates = await self.nyuki.storage.get_templates(
-                full=(request.GET.get('full') == '1'),
+                full=(request.query.get('full') == '1'), **filters, **page
             )
+            if is_paged(page):
+                count = await self.nyuki.storage.count_templates(**filters)
         except AutoReconnect:
             return Response(status=503)
-        return Response(templates)
+        return page_response(templates, count)
 
+    @invalidates('templates')
     async def put(self, request):
         """
         Create a workflow DAG from JSON
@@ -125,6 +146,7 @@ class ApiTemplate(_TemplateResource):
             return Response(status=404)
         return Response(tmpl)
 
+    @invalidates('templates')
     async def put(self, request, tid):
         """
         Create a new draft for this template id.
@@ -162,6 +184,7 @@ class ApiTemplate(_TemplateResource):
         tmpl_dict['errors'] = self.errors_from_validation(template)
         return Response(tmpl_dict)
 
+    @invalidates('templates')
     async def patch(self, request, tid):
         """
         Modify the template's metadata
@@ -183,6 +206,7 @@ class ApiTemplate(_TemplateResource):
 
         return Response(metadata)
 
+    @invalidates('templates', 'triggers', 'vars:{tid}')
     async def delete(self, request, tid):
         """
         Delete the template and all its versions.
@@ -233,6 +257,7 @@ class ApiTemplateDraft(_TemplateResource):
 
         return Response(tmpl)
 
+    @invalidates('templates', 'vars:{tid}')
     async def post(self, request, tid):
         """
         Publish a draft into production
@@ -261,6 +286,7 @@ class ApiTemplateDraft(_TemplateResource):
         tmpl_dict['state'] = TemplateState.ACTIVE.value
         return Response(tmpl_dict)
 
+    @invalidates('templates')
     async def patch(self, request, tid):
         """
         Modify the template's draft
@@ -292,6 +318,7 @@ class ApiTemplateDraft(_TemplateResource):
         tmpl_dict['errors'] = self.errors_from_validation(template)
         return Response(tmpl_dict)
 
+    @invalidates('templates')
     async def delete(self, request, tid):
         """
         Delete the template's draft
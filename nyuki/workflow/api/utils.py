@@ -0,0 +1,60 @@
+from nyuki.api import Response, HTTPBreak
+
+
+# Seconds a cached GET is served for, writes made by other nyukis (or other
+# workers) are only seen once it expired
+CACHE_TTL = 5
+
+
+def int_param(request, name, minimum=0):
+    """
+    Read an optional integer from the query string
+    """
+    value = request.query.get(name)
+    if not value:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        value = None
+    if value is None or value < minimum:
+        raise HTTPBreak(400, {
+            'error': '{} must be an int >= {}'.format(name.capitalize(), minimum)
+        })
+    return value
+
+
+def list_param(request, name):
+    """
+    Read an optional comma-separated list from the query string
+    """
+    value = request.query.get(name)
+    if not value:
+        return None
+    return [item for item in value.split(',') if item] or None
+
+
+def page_params(request):
+    """
+    Read the pagination (offset, limit) and projection (fields) parameters
+    """
+    return {
+        'offset': int_param(request, 'offset'),
+        'limit': int_param(request, 'limit', minimum=1),
+        'fields': list_param(request, 'fields'),
+    }
+
+
+def is_paged(page):
+    return page['offset'] is not None or page['limit'] is not None
+
+
+def page_response(items, count=None):
+    """
+    List response, with the total number of matching items in the
+    'X-Total-Count' header when a page was requested.
+    """
+    headers = {}
+    if count is not None:
+        headers['X-Total-Count'] = str(count)
+    return Response(items, headers=headers)
@@ -2,7 +2,8 @@ import re
 import logging
 from pymongo.errors import AutoReconnect
 
-from nyuki.api import Response, resource, HTTPBreak
+from nyuki.api import Response, resource, HTTPBreak, cached
+from nyuki.workflow.api.utils import CACHE_TTL
 
 
 log = logging.getLogger(__name__)
@@ -52,6 +53,7 @@ class DataInspector(object):
 @resource('/workflow/vars/{tid}', versions=['v1'])
 class ApiVars(DataInspector):
 
+    @cached(CACHE_TTL, ['vars:{tid}'])
     async def get(self, request, tid):
         keys = await self.required_keys(tid)
         return Response(body=keys)
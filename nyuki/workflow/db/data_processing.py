@@ -1,4 +1,11 @@
 import logging
+from pymongo import ASCENDING
+
+from nyuki import metrics
+from .utils import (
+    STORAGE_LATENCY, projection, paginate, search_field, searchable,
+    starts_with,
+)
 
 
 log = logging.getLogger(__name__)
@@ -11,20 +18,40 @@ class DataProcessingCollection:
 
     async def index(self):
         await self._rules.create_index('id', unique=True)
+        await self._rules.create_index(search_field('title'))
+
+    @staticmethod
+    def _query(title=None):
+        if not title:
+            return {}
+        return {search_field('title'): starts_with(title)}
 
-    async def get(self):
+    @metrics.timed(STORAGE_LATENCY, 'rules.get')
+    async def get(self, title=None, offset=None, limit=None, fields=None):
         """
-        Return a list of all rules
+        Return a list of all rules, or of a page of the rules matching
+        the given title.
         """
-        cursor = self._rules.find(None, {'_id': 0})
-        return await cursor.to_list(None)
+        cursor = self._rules.find(
+            self._query(title),
+            projection(fields, ['id'], [search_field('title')]),
+        ).sort('id', ASCENDING)
+        return await paginate(cursor, offset, limit).to_list(None)
 
+    @metrics.timed(STORAGE_LATENCY, 'rules.count')
+    async def count(self, title=None):
+        return await self._rules.count(self._query(title))
+
+    @metrics.timed(STORAGE_LATENCY, 'rules.get_one')
     async def get_one(self, rule_id):
         """
         Return the rule for given id or None
         """
-        return await self._rules.find_one({'id': rule_id}, {'_id': 0})
+        return await self._rules.find_one(
+            {'id': rule_id}, projection(hidden=[search_field('title')])
+        )
 
+    @metrics.timed(STORAGE_LATENCY, 'rules.insert')
     async def insert(self, data):
         """
         Insert a new data processing rule:
@@ -42,8 +69,9 @@ class DataProcessingCollection:
             self._rules.name
         )
         log.debug('upserting data: %s', data)
-        await self._rules.replace_one(query, data, upsert=True)
+        await self._rules.replace_one(query, searchable(data), upsert=True)
 
+    @metrics.timed(STORAGE_LATENCY, 'rules.delete')
     async def delete(self, rule_id=None):
         """
         Delete a rule from its id or all rules
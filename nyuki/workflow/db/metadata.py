@@ -2,6 +2,8 @@ import logging
 
 from pymongo import ReturnDocument
 
+from .utils import search_field, searchable, starts_with
+
 
 log = logging.getLogger(__name__)
 
@@ -21,6 +23,8 @@ class MetadataCollection:
 
     async def index(self):
         await self._metadata.create_index('workflow_template_id', unique=True)
+        await self._metadata.create_index('tags')
+        await self._metadata.create_index(search_field('title'))
 
     async def get_one(self, tid):
         """
@@ -28,15 +32,44 @@ class MetadataCollection:
         """
         return await self._metadata.find_one(
             {'workflow_template_id': tid},
-            {'_id': 0, 'workflow_template_id': 0},
+            {'_id': 0, 'workflow_template_id': 0, search_field('title'): 0},
+        )
+
+    async def get_many(self, tids):
+        """
+        Return the metadata of several templates, by template id.
+        """
+        cursor = self._metadata.find(
+            {'workflow_template_id': {'$in': list(tids)}},
+            {'_id': 0, search_field('title'): 0},
+        )
+        return {
+            metadata.pop('workflow_template_id'): metadata
+            for metadata in await cursor.to_list(None)
+        }
+
+    async def find_ids(self, title=None, tag=None):
+        """
+        Return the ids of the templates matching a title and/or a tag.
+        """
+        query = {}
+        if title:
+            query[search_field('title')] = starts_with(title)
+        if tag:
+            query['tags'] = tag
+        cursor = self._metadata.find(
+            query, {'_id': 0, 'workflow_template_id': 1}
         )
+        return [
+            metadata['workflow_template_id']
+            for metadata in await cursor.to_list(None)
+        ]
 
     async def insert(self, metadata):
         """
         Insert new metadata for a template.
         """
-        await self._metadata.insert_one(metadata)
-        del metadata['_id']
+        await self._metadata.insert_one(searchable(metadata))
         return metadata
 
     async def update(self, tid, metadata):
@@ -45,12 +78,12 @@ class MetadataCollection:
         """
         return await self._metadata.find_one_and_update(
             {'workflow_template_id': tid},
-            {'$set': {
+            {'$set': searchable({
                 key: value
                 for key, value in metadata.items()
                 if value is not None
-            }},
-            projection={'_id': 0},
+            })},
+            projection={'_id': 0, search_field('title'): 0},
             return_document=ReturnDocument.AFTER,
         )
 
@@ -0,0 +1,47 @@
+import logging
+from motor.motor_asyncio import AsyncIOMotorClient
+
+
+log = logging.getLogger(__name__)
+
+COLLECTIONS = ('workflow_metadata', 'regexes', 'lookups')
+
+
+class Migration:
+
+    """
+    Titles are searched on an indexed, lower-cased copy ('title_search'),
+    filled here for the documents written before it existed.
+    """
+
+    def __init__(self, host, database, validate_on_start=None, **kwargs):
+        client = AsyncIOMotorClient(host, **kwargs)
+        self.db = client[database]
+
+    async def run(self):
+        collections = await self.db.collection_names()
+        for name in COLLECTIONS:
+            if name in collections:
+                await self._migrate_titles(self.db[name])
+
+    async def _migrate_titles(self, collection):
+        # The former title index can't serve case-insensitive searches
+        if 'title_1' in await collection.index_information():
+            await collection.drop_index('title_1')
+
+        count = 0
+        bulk = collection.initialize_unordered_bulk_op()
+        query = {
+            'title': {'$type': 'string'},
+            'title_search': {'$exists': False},
+        }
+        async for document in collection.find(query, {'title': 1}):
+            bulk.find({'_id': document['_id']}).update_one({
+                '$set': {'title_search': document['title'].lower()},
+            })
+            count += 1
+        if count:
+            await bulk.execute()
+            log.info(
+                "%s titles of '%s' made searchable", count, collection.name
+            )
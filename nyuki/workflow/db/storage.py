@@ -4,6 +4,7 @@ from copy import deepcopy
 from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo.errors import ServerSelectionTimeoutError
 
+from nyuki import metrics
 from .triggers import TriggerCollection
 from .data_processing import DataProcessingCollection
 from .metadata import MetadataCollection
@@ -11,6 +12,7 @@ from .workflow_templates import WorkflowTemplatesCollection, TemplateState
 from .task_templates import TaskTemplatesCollection
 from .workflow_instances import WorkflowInstancesCollection
 from .task_instances import TaskInstancesCollection
+from .utils import STORAGE_LATENCY
 
 
 log = logging.getLogger(__name__)
@@ -82,12 +84,14 @@ class MongoStorage:
 
     # Templates
 
+    @metrics.timed(STORAGE_LATENCY, 'update_workflow_metadata')
     async def update_workflow_metadata(self, tid, metadata):
         """
         Update and return
         """
         return await self._workflow_metadata.update(tid, metadata)
 
+    @metrics.timed(STORAGE_LATENCY, 'upsert_draft')
     async def upsert_draft(self, template):
         """
         Update a template's draft and all its associated tasks.
@@ -117,6 +121,7 @@ class MongoStorage:
         template.update({'title': metadata['title'], 'tags': metadata['tags']})
         return template
 
+    @metrics.timed(STORAGE_LATENCY, 'publish_draft')
     async def publish_draft(self, template_id):
         """
         Publish a draft into an 'active' state, and archive the old active.
@@ -124,6 +129,7 @@ class MongoStorage:
         await self._workflow_templates.publish_draft(template_id)
         log.info('Draft for template %s published', template_id[:8])
 
+    @metrics.timed(STORAGE_LATENCY, 'get_for_topic')
     async def get_for_topic(self, topic):
         """
         Return all the templates listening on a particular topic.
@@ -141,22 +147,56 @@ class MongoStorage:
             )
         return templates
 
-    async def get_templates(self, template_id=None, full=False):
+    async def _template_ids(self, title=None, tag=None):
+        """
+        Filters on metadata are applied before querying the templates.
+        """
+        if not title and not tag:
+            return None
+        return await self._workflow_metadata.find_ids(title, tag)
+
+    @metrics.timed(STORAGE_LATENCY, 'get_templates')
+    async def get_templates(self, template_id=None, full=False, title=None,
+                            tag=None, topic=None, offset=None, limit=None,
+                            fields=None):
         """
         Return all active/draft templates
         Limited to a small set of fields if 'full' is False.
-        TODO: Pagination.
         """
-        templates = await self._workflow_templates.get(template_id, full)
-        for template in templates:
-            metadata = await self._workflow_metadata.get_one(template['id'])
-            template.update(metadata)
-            if full is True:
+        ids = await self._template_ids(title, tag)
+        if ids == []:
+            return []
+        templates = await self._workflow_templates.get(
+            template_id, full, ids=ids, topic=topic,
+            offset=offset, limit=limit, fields=fields,
+        )
+        if not fields or {'title', 'tags'} & set(fields):
+            metadata = await self._workflow_metadata.get_many(
+                {template['id'] for template in templates}
+            )
+            for template in templates:
+                template.update(metadata.get(template['id'], {}))
+        if full is True and (not fields or 'tasks' in fields):
+            for template in templates:
                 template['tasks'] = await self._task_templates.get(
                     template['id'], template['version']
                 )
+        if fields:
+            keep = set(fields) | {'id'}
+            templates = [
+                {key: value for key, value in template.items() if key in keep}
+                for template in templates
+            ]
         return templates
 
+    @metrics.timed(STORAGE_LATENCY, 'count_templates')
+    async def count_templates(self, title=None, tag=None, topic=None):
+        ids = await self._template_ids(title, tag)
+        if ids == []:
+            return 0
+        return await self._workflow_templates.count(ids=ids, topic=topic)
+
+    @metrics.timed(STORAGE_LATENCY, 'get_template')
     async def get_template(self, tid, draft=False, version=None):
         """
         Return the active template.
@@ -176,6 +216,7 @@ class MongoStorage:
         )
         return template
 
+    @metrics.timed(STORAGE_LATENCY, 'delete_template')
     async def delete_template(self, tid, draft=False):
         """
         Delete a whole template or only its draft.
@@ -188,6 +229,7 @@ class MongoStorage:
 
     # Instances
 
+    @metrics.timed(STORAGE_LATENCY, 'insert_instance')
     async def insert_instance(self, instance):
         """
         Insert a static workflow instance and all its tasks.
@@ -201,29 +243,76 @@ class MongoStorage:
 
     # History
 
-    async def get_history(self, **kwargs):
+    @staticmethod
+    def _split_fields(fields):
+        """
+        Split report fields between the workflow instance and its tasks,
+        stored in their own collection.
+        Return (instance fields, task fields, tasks requested).
+        """
+        if not fields:
+            return None, None, False
+        instance_fields = []
+        task_fields = []
+        whole_tasks = False
+        for field in fields:
+            if field in ('template', 'template.tasks'):
+                whole_tasks = True
+                if field == 'template':
+                    instance_fields.append(field)
+            elif field.startswith('template.tasks.'):
+                task_fields.append(field[len('template.tasks.'):])
+            else:
+                instance_fields.append(field)
+        if whole_tasks or not task_fields:
+            task_fields = None
+        return (
+            instance_fields or ['id'],
+            task_fields,
+            whole_tasks or task_fields is not None,
+        )
+
+    @metrics.timed(STORAGE_LATENCY, 'get_history')
+    async def get_history(self, fields=None, **kwargs):
         """
         Return paginated workflow history.
+        Tasks are returned if `full` is True or if requested in `fields`.
         """
-        count, workflows = await self._workflow_instances.get(**kwargs)
-        if kwargs.get('full') is True:
+        full = kwargs.get('full') is True
+        instance_fields, task_fields, with_tasks = self._split_fields(fields)
+        count, workflows = await self._workflow_instances.get(
+            fields=instance_fields, **kwargs
+        )
+        if (full or with_tasks) and workflows:
+            tasks = await self._task_instances.get_many(
+                [workflow['id'] for workflow in workflows],
+                full=full, fields=task_fields,
+            )
             for workflow in workflows:
-                workflow['template']['tasks'] = await self._task_instances.get(
-                    workflow['id'], True
-                )
+                workflow.setdefault('template', {})['tasks'] = tasks[
+                    workflow['id']
+                ]
         return count, workflows
 
-    async def get_instance(self, instance_id, full=False):
-        workflow = await self._workflow_instances.get_one(instance_id, full)
+    @metrics.timed(STORAGE_LATENCY, 'get_instance')
+    async def get_instance(self, instance_id, full=False, fields=None):
+        instance_fields, task_fields, with_tasks = self._split_fields(fields)
+        workflow = await self._workflow_instances.get_one(
+            instance_id, full, instance_fields
+        )
         if not workflow:
             return
-        workflow['template']['tasks'] = await self._task_instances.get(
-            workflow['id'], full
+        if fields and not with_tasks:
+            return workflow
+        workflow.setdefault('template', {})['tasks'] = (
+            await self._task_instances.get(workflow['id'], full, task_fields)
         )
         return workflow
 
+    @metrics.timed(STORAGE_LATENCY, 'get_instance_task')
     async def get_instance_task(self, task_id, full=False):
         return await self._task_instances.get_one(task_id, full)
 
+    @metrics.timed(STORAGE_LATENCY, 'get_instance_task_data')
     async def get_instance_task_data(self, task_id):
         return await self._task_instances.get_data(task_id)
@@ -2,6 +2,8 @@ import logging
 from datetime import timezone
 from bson.codec_options import CodecOptions
 
+from .utils import projection
+
 
 log = logging.getLogger(__name__)
 WS_FILTERS = ('quorum', 'status', 'twilio_error', 'diff')
@@ -38,17 +40,39 @@ class TaskInstancesCollection:
         await self._instances.create_index('id', unique=True)
         await self._instances.create_index('workflow_instance_id')
 
-    async def get(self, wid, full=False):
+    def _filters(self, full=False, fields=None):
+        if fields:
+            return projection(fields)
+        if full is False:
+            return self.TASK_HISTORY_FILTERS
+        return {'_id': 0, 'workflow_instance_id': 0}
+
+    async def get(self, wid, full=False, fields=None):
         """
         Return all task instances of one workflow.
         """
-        if full is False:
-            filters = self.TASK_HISTORY_FILTERS
-        else:
-            filters = {'_id': 0, 'workflow_instance_id': 0}
-        cursor = self._instances.find({'workflow_instance_id': wid}, filters)
+        cursor = self._instances.find(
+            {'workflow_instance_id': wid}, self._filters(full, fields)
+        )
         return await cursor.to_list(None)
 
+    async def get_many(self, wids, full=False, fields=None):
+        """
+        Return the task instances of several workflows, by workflow id.
+        """
+        filters = self._filters(full, fields)
+        if filters.get('workflow_instance_id') == 0:
+            del filters['workflow_instance_id']
+        else:
+            filters = {**filters, 'workflow_instance_id': 1}
+        cursor = self._instances.find(
+            {'workflow_instance_id': {'$in': list(wids)}}, filters
+        )
+        tasks = {wid: [] for wid in wids}
+        for task in await cursor.to_list(None):
+            tasks[task.pop('workflow_instance_id')].append(task)
+        return tasks
+
     async def get_one(self, tid, full=False):
         """
         Return one task instance.
@@ -1,5 +1,9 @@
 import asyncio
 import logging
+from pymongo import ASCENDING
+
+from nyuki import metrics
+from .utils import STORAGE_LATENCY, projection, paginate
 
 
 log = logging.getLogger(__name__)
@@ -13,19 +17,33 @@ class TriggerCollection:
     async def index(self):
         await self._triggers.create_index('tid', unique=True)
 
-    async def get(self):
+    @staticmethod
+    def _query(tids=None):
+        return {'tid': {'$in': tids}} if tids else {}
+
+    @metrics.timed(STORAGE_LATENCY, 'triggers.get')
+    async def get(self, tids=None, offset=None, limit=None, fields=None):
         """
-        Return a list of all trigger forms
+        Return a list of all trigger forms, or of a page of the forms of
+        the given workflow template ids.
         """
-        cursor = self._triggers.find(None, {'_id': 0})
-        return await cursor.to_list(None)
+        cursor = self._triggers.find(
+            self._query(tids), projection(fields, ['tid'])
+        ).sort('tid', ASCENDING)
+        return await paginate(cursor, offset, limit).to_list(None)
+
+    @metrics.timed(STORAGE_LATENCY, 'triggers.count')
+    async def count(self, tids=None):
+        return await self._triggers.count(self._query(tids))
 
+    @metrics.timed(STORAGE_LATENCY, 'triggers.get_one')
     async def get_one(self, template_id):
         """
         Return the trigger form of a given workflow template id
         """
         return await self._triggers.find_one({'tid': template_id}, {'_id': 0})
 
+    @metrics.timed(STORAGE_LATENCY, 'triggers.insert')
     async def insert(self, tid, form):
         """
         Insert a trigger form for the given workflow template
@@ -34,6 +52,7 @@ class TriggerCollection:
         await self._triggers.replace_one({'tid': tid}, data, upsert=True)
         return data
 
+    @metrics.timed(STORAGE_LATENCY, 'triggers.delete')
     async def delete(self, tid):
         """
         Delete a trigger form
@@ -0,0 +1,61 @@
+import re
+
+from nyuki import metrics
+from nyuki.utils import field_tree, field_paths
+
+
+STORAGE_LATENCY = metrics.histogram(
+    'nyuki_storage_duration_seconds', 'Storage operations latency',
+    ['operation'],
+)
+
+
+def projection(fields=None, required=(), hidden=()):
+    """
+    Mongo projection returning only `fields` (and `required`), or every
+    field but the `hidden` ones if None. Fields are dotted paths,
+    overlapping paths are merged.
+    """
+    proj = {'_id': 0}
+    if fields:
+        tree = field_tree(list(fields) + list(required))
+        proj.update({path: 1 for path in field_paths(tree)})
+    else:
+        proj.update({path: 0 for path in hidden})
+    return proj
+
+
+def paginate(cursor, offset=None, limit=None):
+    """
+    Apply offset/limit to a cursor, it must be sorted to be stable.
+    """
+    if offset:
+        cursor.skip(offset)
+    if limit:
+        cursor.limit(limit)
+    return cursor
+
+
+def search_field(field):
+    """
+    Name of the indexed, lower-cased copy of a searchable string field.
+    """
+    return '{}_search'.format(field)
+
+
+def searchable(document, field='title'):
+    """
+    Copy of a document along with the search field of `field`.
+    """
+    value = document.get(field)
+    if not isinstance(value, str):
+        return dict(document)
+    return {**document, search_field(field): value.lower()}
+
+
+def starts_with(value):
+    """
+    Case-insensitive prefix query, on a search field. Anchored and
+    case-sensitive, the regex only scans the matching range of its index.
+    """
+    return {'$regex': '^{}'.format(re.escape(value.lower()))}
@@ -6,6 +6,8 @@ from datetime import datetime, timezone
 from bson.codec_options import CodecOptions
 from pymongo import DESCENDING, ASCENDING
 
+from .utils import projection
+
 
 log = logging.getLogger(__name__)
 
@@ -45,14 +47,22 @@ class WorkflowInstancesCollection:
         await self._instances.create_index([('start', DESCENDING)])
         await self._instances.create_index([('end', DESCENDING)])
 
-    async def get_one(self, instance_id, full=False):
+    async def get_one(self, instance_id, full=False, fields=None):
         """
         Return the instance with `instance_id` from workflow history.
+        The graph is only returned if `full` is True.
         """
-        return await self._instances.find_one({'id': instance_id}, {'_id': 0})
+        if fields:
+            filters = projection(fields, ['id'])
+        elif full is True:
+            filters = {'_id': 0}
+        else:
+            filters = {'_id': 0, 'template.graph': 0}
+        return await self._instances.find_one({'id': instance_id}, filters)
 
     async def get(self, root=False, full=False, offset=None, limit=None,
-                  since=None, state=None, search=None, order=None):
+                  since=None, state=None, search=None, order=None,
+                  fields=None):
         """
         Return all instances from history from `since` with state `state`.
         """
@@ -67,7 +77,7 @@ class WorkflowInstancesCollection:
         if search:
             query['template.title'] = {'$regex': '.*{}.*'.format(search)}
 
-        cursor = self._instances.find(query, {'_id': 0})
+        cursor = self._instances.find(query, projection(fields, ['id']))
         # Count total results regardless of limit/offset
         count = await cursor.count()
 
@@ -1,7 +1,9 @@
 import asyncio
 import logging
 from enum import Enum
-from pymongo import DESCENDING
+from pymongo import ASCENDING, DESCENDING
+
+from .utils import projection, paginate
 
 
 log = logging.getLogger(__name__)
@@ -53,21 +55,36 @@ class WorkflowTemplatesCollection:
             [('id', DESCENDING), ('state', DESCENDING)]
         )
 
-    async def get(self, template_id=None, full=False):
+    @staticmethod
+    def _query(template_id=None, ids=None, topic=None):
+        # Retrieve only the actives and the drafts
+        query = {'state': {'$in': TemplateState.active_states()}}
+        if template_id is not None:
+            query['id'] = template_id
+        elif ids is not None:
+            query['id'] = {'$in': ids}
+        if topic is not None:
+            query['topics'] = topic
+        return query
+
+    async def get(self, template_id=None, full=False, ids=None, topic=None,
+                  offset=None, limit=None, fields=None):
         """
         Return all active and draft templates
         Used at nyuki's startup and GET /v1/templates
         """
-        query = {'state': {'$in': TemplateState.active_states()}}
-        if template_id is not None:
-            query['id'] = template_id
-        filters = {'_id': 0}
-        if full is False:
-            filters.update({'id': 1, 'state': 1, 'version': 1, 'topics': 1})
-
-        # Retrieve only the actives and the drafts
-        cursor = self._templates.find(query, filters)
-        return await cursor.to_list(None)
+        if fields is None and full is False:
+            fields = ['state', 'version', 'topics']
+        cursor = self._templates.find(
+            self._query(template_id, ids, topic),
+            projection(fields, ['id', 'version']),
+        ).sort([('id', ASCENDING), ('version', ASCENDING)])
+        return await paginate(cursor, offset, limit).to_list(None)
+
+    async def count(self, template_id=None, ids=None, topic=None):
+        return await self._templates.count(
+            self._query(template_id, ids, topic)
+        )
 
     async def get_one(self, tid, version=None, draft=False):
         """
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+class EventSubscriber:
+
+    """
+    A client of the workflow event stream, with its own filters and
+    bounded queue of pending events.
+    Empty filters let every event through.
+    """
+
+    def __init__(self, instances=None, templates=None, types=None,
+                 queue_size=100, loop=None):
+        self._queue = asyncio.Queue(maxsize=queue_size, loop=loop)
+        self.instances = set()
+        self.templates = set()
+        self.types = set()
+        self.closed = False
+        self.update(instances, templates, types)
+
+    def update(self, instances=None, templates=None, types=None):
+        """
+        Replace the filters of this subscriber.
+        """
+        self.instances = set(instances or [])
+        self.templates = set(templates or [])
+        self.types = set(types or [])
+
+    def matches(self, instance_id, template_id, etype):
+        return (
+            (not self.instances or instance_id in self.instances) and
+            (not self.templates or template_id in self.templates) and
+            (not self.types or etype in self.types)
+        )
+
+    def put(self, payload):
+        """
+        Queue an event, return False if the subscriber can't keep up.
+        """
+        try:
+            self._queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def get(self):
+        """
+        Wait for the next event, None once the subscriber is closed.
+        """
+        return await self._queue.get()
+
+    def close(self):
+        """
+        Drop the pending events and wake up the reader.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+
+class EventHub:
+
+    """
+    Fan out workflow exec events to the event stream subscribers.
+    A subscriber whose queue is full is a slow consumer, it is closed
+    rather than buffering unbounded data or slowing the workflows down.
+    """
+
+    def __init__(self, queue_size=100, loop=None):
+        self.queue_size = queue_size
+        self._loop = loop
+        self._subscribers = set()
+        self.dropped = 0
+
+    @property
+    def subscribers(self):
+        return len(self._subscribers)
+
+    def subscribe(self, instances=None, templates=None, types=None):
+        subscriber = EventSubscriber(
+            instances, templates, types,
+            queue_size=self.queue_size, loop=self._loop,
+        )
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+        subscriber.close()
+
+    def publish(self, payload, instance_id, template_id):
+        """
+        Queue an event for every subscriber it matches.
+        """
+        for subscriber in list(self._subscribers):
+            if not subscriber.matches(instance_id, template_id,
+                                      payload['type']):
+                continue
+            if not subscriber.put(payload):
+                log.warning('Dropping slow event stream subscriber')
+                self.dropped += 1
+                self.unsubscribe(subscriber)
@@ -1,6 +1,5 @@
 import asyncio
 import logging
-from aiohttp import ClientSession
 from copy import deepcopy
 from tukio.task import register
 from tukio.task.holder import TaskHolder
@@ -125,9 +124,8 @@ class FactoryTask(TaskHolder):
 
     def __init__(self, config):
         super().__init__(config)
-        self.api_url = 'http://localhost:{}/v1/workflow'.format(
-            runtime.config['api']['port']
-        )
+        # Reach the local API through its unix socket when there is one
+        self.api_url = '{}/v1/workflow'.format(runtime.api.local_url)
         self.session = None
 
     async def get_regex(self, rule):
@@ -182,8 +180,8 @@ class FactoryTask(TaskHolder):
     async def execute(self, event):
         data = event.data
         runtime_config = deepcopy(self.config)
-        async with ClientSession() as self.session:
-            await self.get_factory_rules(runtime_config)
+        self.session = runtime.http.session(local=True)
+        await self.get_factory_rules(runtime_config)
         log.debug('Full factory config: %s', runtime_config)
 
         converter = Converter.from_dict(runtime_config)
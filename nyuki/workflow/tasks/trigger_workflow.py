@@ -2,17 +2,25 @@ import json
 import asyncio
 import logging
 from enum import Enum
-from aiohttp import ClientSession
+from aiohttp import ClientConnectorError, ClientError
 from tukio.task import register
 from tukio.task.holder import TaskHolder
 from tukio.workflow import WorkflowExecState, Workflow
 
+from nyuki import metrics
+
 from .utils import runtime
 from .utils.uri import URI
 
 
 log = logging.getLogger(__name__)
 
+TRIGGER_ROUTES = metrics.counter(
+    'nyuki_trigger_workflow_requests_total',
+    'Requests to the engine of triggered workflows, per route',
+    ['route'],
+)
+
 
 class WorkflowStatus(Enum):
 
@@ -26,10 +34,13 @@ class WorkflowStatus(Enum):
 class TriggerWorkflowTask(TaskHolder):
 
     __slots__ = (
-        'template', 'blocking', 'task', '_engine', 'data',
+        'template', 'blocking', 'task', '_engine', '_local', 'data',
         'status', 'triggered_id', 'async_future',
     )
 
+    # Requests safe to send again through the gateway
+    IDEMPOTENT = ('GET', 'HEAD', 'DELETE')
+
     SCHEMA = {
         'type': 'object',
         'required': ['template'],
@@ -54,10 +65,15 @@ class TriggerWorkflowTask(TaskHolder):
         self.template = self.config['template']
         self.blocking = self.config.get('blocking', True)
         self.task = None
-        self._engine = 'http://{}/{}/api/v1/workflow'.format(
-            runtime.config.get('http_host', 'localhost'),
-            self.template['service'],
-        )
+        # Triggering a workflow on our own service skips the gateway
+        self._local = self.template['service'] == runtime.config.get('service')
+        if self._local:
+            self._engine = '{}/v1/workflow'.format(runtime.api.local_url)
+        else:
+            self._engine = 'http://{}/{}/api/v1/workflow'.format(
+                runtime.config.get('http_host', 'localhost'),
+                self.template['service'],
+            )
 
         # Reporting
         self.status = WorkflowStatus.PENDING.value
@@ -80,6 +96,51 @@ class TriggerWorkflowTask(TaskHolder):
             self.async_future.set_result(data)
         await runtime.bus.unsubscribe(topic)
 
+    async def _request(self, method, path, direct=True, **kwargs):
+        """
+        Send a request to the triggered service's workflow engine, directly
+        to one of its instances if a balancer is set, through the gateway
+        otherwise or if that instance can't be reached.
+        A request that may have been received (e.g. timed out) is only sent
+        again if it is idempotent.
+        Return the engine used, the response status and body.
+        """
+        route = 'gateway'
+        balancer = runtime.balancer
+        if direct and not self._local and balancer is not None:
+            instance = await balancer.pick(self.template['service'])
+            if instance is not None:
+                address, port = instance
+                engine = 'http://{}:{}/v1/workflow'.format(
+                    address, port or runtime.api.port
+                )
+                if method in self.IDEMPOTENT:
+                    retry_on = (ClientError, asyncio.TimeoutError)
+                else:
+                    retry_on = ClientConnectorError
+                try:
+                    with balancer.track(instance):
+                        async with runtime.http.request(
+                            method, engine + path, **kwargs
+                        ) as response:
+                            body = await response.text()
+                    TRIGGER_ROUTES.labels('direct').inc()
+                    return engine, response.status, body
+                except retry_on as exc:
+                    log.warning(
+                        "Instance %s of service '%s' unreachable (%s), "
+                        "using the gateway", address,
+                        self.template['service'], exc,
+                    )
+                    route = 'fallback'
+
+        async with runtime.http.request(
+            method, self._engine + path, local=self._local, **kwargs
+        ) as response:
+            body = await response.text()
+        TRIGGER_ROUTES.labels(route).inc()
+        return self._engine, response.status, body
+
     async def execute(self, event):
         """
         Entrypoint execution method.
@@ -120,44 +181,42 @@ class TriggerWorkflowTask(TaskHolder):
                 asyncio.ensure_future(runtime.bus.unsubscribe(topic))
             self.task.add_done_callback(_unsub)
 
-        async with ClientSession() as session:
-            # Compute data to send to sub-workflows
-            url = '{}/vars/{}{}'.format(
-                self._engine,
-                self.template['id'],
-                '/draft' if is_draft else '',
+        # Compute data to send to sub-workflows
+        path = '/vars/{}{}'.format(
+            self.template['id'],
+            '/draft' if is_draft else '',
+        )
+        _, status, body = await self._request('GET', path)
+        if status != 200:
+            raise RuntimeError("Can't load template info")
+        wf_vars = json.loads(body)
+        lightened_data = {
+            key: self.data[key]
+            for key in wf_vars
+            if key in self.data
+        }
+
+        engine, status, body = await self._request(
+            'PUT', '/instances',
+            headers=headers,
+            data=json.dumps({
+                'id': self.template['id'],
+                'draft': is_draft,
+                'inputs': lightened_data,
+            }),
+        )
+        if status != 200:
+            log.critical(body)
+            msg = "Can't process workflow template {} on {}".format(
+                self.template, engine
             )
-            async with session.get(url) as response:
-                if response.status != 200:
-                    raise RuntimeError("Can't load template info")
-                wf_vars = await response.json()
-            lightened_data = {
-                key: self.data[key]
-                for key in wf_vars
-                if key in self.data
-            }
-
-            params = {
-                'url': '{}/instances'.format(self._engine),
-                'headers': headers,
-                'data': json.dumps({
-                    'id': self.template['id'],
-                    'draft': is_draft,
-                    'inputs': lightened_data,
-                })
-            }
-            async with session.put(**params) as response:
-                if response.status != 200:
-                    log.critical(await response.text())
-                    msg = "Can't process workflow template {} on {}".format(
-                        self.template, self.nyuki_api
-                    )
-                    if response.status % 400 < 100:
-                        reason = await response.json()
-                        msg = "{}, reason: {}".format(msg, reason['error'])
-                    raise RuntimeError(msg)
-                resp_body = await response.json()
-                self.triggered_id = resp_body['id']
+            if status % 400 < 100:
+                reason = json.loads(body)
+                msg = "{}, reason: {}".format(msg, reason['error'])
+            raise RuntimeError(msg)
+        self.triggered_id = json.loads(body)['id']
+        # The triggered workflow runs on this engine's instance
+        self._engine = engine
 
         wf_id = '@'.join([self.triggered_id[:8], self.template['service']])
         self.status = WorkflowStatus.RUNNING.value
@@ -179,13 +238,12 @@ class TriggerWorkflowTask(TaskHolder):
         Asynchronously cancel the triggered workflow.
         """
         wf_id = '@'.join([self.triggered_id[:8], self.template['service']])
-        async with ClientSession() as session:
-            url = '{}/instances/{}'.format(self._engine, self.triggered_id)
-            async with session.delete(url) as response:
-                if response.status != 200:
-                    log.warning('Failed to cancel workflow %s', wf_id)
-                else:
-                    log.info('Workflow %s has been cancelled', wf_id)
+        path = '/instances/{}'.format(self.triggered_id)
+        _, status, _ = await self._request('DELETE', path, direct=False)
+        if status != 200:
+            log.warning('Failed to cancel workflow %s', wf_id)
+        else:
+            log.info('Workflow %s has been cancelled', wf_id)
 
     def teardown(self):
         """
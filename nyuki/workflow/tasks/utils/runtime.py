@@ -18,6 +18,9 @@ class RuntimeContext(object):
     def __init__(self):
         self._config = dict()
         self._bus = None
+        self._api = None
+        self._http = None
+        self._balancer = None
 
     @property
     def config(self):
@@ -35,5 +38,29 @@ class RuntimeContext(object):
     def bus(self, value):
         self._bus = value
 
+    @property
+    def api(self):
+        return self._api
+
+    @api.setter
+    def api(self, value):
+        self._api = value
+
+    @property
+    def http(self):
+        return self._http
+
+    @http.setter
+    def http(self, value):
+        self._http = value
+
+    @property
+    def balancer(self):
+        return self._balancer
+
+    @balancer.setter
+    def balancer(self, value):
+        self._balancer = value
+
 
 sys.modules[__name__] = RuntimeContext.instance()
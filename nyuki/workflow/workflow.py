@@ -2,18 +2,17 @@ import json
 import asyncio
 import logging
 import pickle
-import aiohttp
 from uuid import uuid4
 from copy import deepcopy
-from random import shuffle
 from datetime import datetime
 from tukio import Engine, TaskRegistry, get_broker, EXEC_TOPIC
 from tukio.workflow import Workflow, WorkflowExecState
 from tukio.task.factory import TaskExecState
 
-from nyuki import Nyuki
+from nyuki import Nyuki, metrics
+from nyuki.discovery import ServiceBalancer
 from nyuki.memory import memsafe
-from nyuki.utils import serialize_object, utcnow
+from nyuki.utils import serialize_object, utcnow, field_tree, select_fields
 from nyuki.workflow.db.storage import MongoStorage
 from nyuki.workflow.db.migrations import run_migrations
 from nyuki.workflow.db.task_instances import WS_FILTERS
@@ -34,6 +33,8 @@ from .api.instances import (
 from .api.vars import (
     ApiVars, ApiVarsVersion, ApiVarsDraft
 )
+from .api.events import ApiWorkflowEvents
+from .events import EventHub
 
 from .tasks import *
 from .tasks.utils import runtime, CONTACT_PROGRESS
@@ -42,6 +43,35 @@ from .tukio import WorkflowSelector
 
 log = logging.getLogger(__name__)
 
+WORKFLOWS_RUNNING = metrics.gauge(
+    'nyuki_workflows_running', 'Workflow instances currently running',
+)
+WORKFLOWS_ENDED = metrics.counter(
+    'nyuki_workflows_ended_total', 'Workflow instances ended', ['state'],
+)
+TASK_DURATION = metrics.histogram(
+    'nyuki_workflow_task_duration_seconds', 'Workflow tasks duration',
+    ['task', 'state'],
+    buckets=(.01, .05, .1, .5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 3600.0),
+)
+WORKFLOWS_SNAPSHOTS = metrics.counter(
+    'nyuki_workflow_snapshots_total',
+    'Exec events written to shared memory right away, on the next flush or '
+    'coalesced into an already pending write',
+    ['trigger'],
+)
+
+# Exec events a rescuer relies on, written to shared memory right away
+SNAPSHOT_EVENTS = {
+    WorkflowExecState.BEGIN.value,
+    WorkflowExecState.SUSPEND.value,
+    WorkflowExecState.RESUME.value,
+    TaskExecState.END.value,
+    TaskExecState.ERROR.value,
+    TaskExecState.SKIP.value,
+    TaskExecState.TIMEOUT.value,
+}
+
 
 class BadRequestError(Exception):
     pass
@@ -103,24 +133,41 @@ class WorkflowInstance:
     def exec(self):
         return self._exec
 
-    def report(self, tasks=True, data=True):
+    def report(self, tasks=True, data=True, fields=None):
         """
         Merge a workflow exec instance report and its template.
+        `fields` restricts the report to a list of dotted paths, such as
+        'template.tasks.state'.
         """
-        template = deepcopy(self._template)
+        tree = None
+        if fields:
+            tree = field_tree(fields)
+            template_tree = tree.get('template')
+            if template_tree is None or (
+                template_tree and
+                'tasks' not in template_tree and 'graph' not in template_tree
+            ):
+                # Skip merging the tasks execs if they are not requested
+                tasks = False
+
         inst = self._instance.report()
         inst['exec'].update(self._exec)
 
+        if tasks is False:
+            template = deepcopy({
+                key: value
+                for key, value in self._template.items()
+                if key not in ('graph', 'tasks')
+            })
+            result = {**inst['exec'], 'template': template}
+            return select_fields(result, tree) if tree else result
+
+        template = deepcopy(self._template)
         result = {
             **inst['exec'],
             'template': template,
         }
 
-        if tasks is False:
-            del result['template']['graph']
-            del result['template']['tasks']
-            return result
-
         tasks = {task['id']: {'template': task} for task in template['tasks']}
         for task_dict in inst['tasks']:
             if not task_dict.get('exec'):
@@ -151,7 +198,7 @@ class WorkflowInstance:
             tasks[task_dict['id']].update(task_dict['exec'])
 
         result['template']['tasks'] = list(tasks.values())
-        return result
+        return select_fields(result, tree) if tree else result
 
 
 class WorkflowNyuki(Nyuki):
@@ -178,6 +225,30 @@ class WorkflowNyuki(Nyuki):
             'topics': {
                 'type': 'array',
                 'items': {'type': 'string', 'minLength': 1}
+            },
+            'partition': {
+                'type': 'object',
+                'properties': {
+                    'field': {'type': 'string', 'minLength': 1},
+                }
+            },
+            'snapshots': {
+                'type': 'object',
+                'properties': {
+                    'interval': {
+                        'type': 'number', 'minimum': 0, 'default': 1,
+                    },
+                }
+            },
+            'routing': {
+                'type': 'object',
+                'properties': {
+                    'policy': {
+                        'type': 'string',
+                        'enum': ['gateway'] + list(ServiceBalancer.POLICIES),
+                        'default': 'gateway',
+                    },
+                }
             }
         }
     }
@@ -206,6 +277,7 @@ class WorkflowNyuki(Nyuki):
         ApiVars,                    # /v1/workflow/vars/{uid}
         ApiVarsVersion,             # /v1/workflow/vars/{uid}/{version}
         ApiVarsDraft,               # /v1/workflow/data/{uid}/draft
+        ApiWorkflowEvents,          # /v1/workflow/events
     ]
 
     DEFAULT_POLICY = None
@@ -223,10 +295,20 @@ class WorkflowNyuki(Nyuki):
 
         # Stores workflow instances with their template data
         self.running_workflows = {}
+        # Tasks start time, per workflow instance (metrics only)
+        self._task_starts = {}
+        # Websocket clients of /v1/workflow/events
+        self.events = EventHub(loop=self.loop)
+        # Workflow instances to write to shared memory on the next flush
+        self._dirty = set()
+        self._flush_handle = None
 
         runtime.bus = self.bus
+        runtime.api = self.api
+        runtime.http = self.http
         runtime.config = self.config
         runtime.workflows = self.running_workflows
+        runtime.balancer = None
 
     @property
     def mongo_config(self):
@@ -236,6 +318,43 @@ class WorkflowNyuki(Nyuki):
     def topics(self):
         return self.config.get('topics', [])
 
+    @property
+    def partition(self):
+        return self.config.get('partition')
+
+    @property
+    def routing(self):
+        return self.config.get('routing', {})
+
+    def balancer(self):
+        """
+        Balancer of the direct calls to other services, None to call them
+        through the gateway.
+        """
+        policy = self.routing.get('policy', 'gateway')
+        if policy == 'gateway' or 'discovery' not in self._services.all:
+            return None
+        return ServiceBalancer(self.discovery, policy)
+
+    @property
+    def snapshot_interval(self):
+        return self.config.get('snapshots', {}).get('interval', 1)
+
+    def partition_key(self, topic, data):
+        """
+        Key of a bus event, the value of the configured partition field
+        (dotted path in the event data) or its topic.
+        """
+        field = self.partition.get('field')
+        if not field:
+            return topic
+        value = data
+        for key in field.split('.'):
+            if not isinstance(value, dict) or key not in value:
+                return topic
+            value = value[key]
+        return value
+
     async def setup(self):
         self.storage.configure(**self.mongo_config)
         # Blocks until connection to Mongo is done.
@@ -243,22 +362,31 @@ class WorkflowNyuki(Nyuki):
         await run_migrations(**self.mongo_config)
         selector = WorkflowSelector(self.storage)
         self.engine = Engine(selector=selector, loop=self.loop)
+        runtime.balancer = self.balancer()
+        callback = self.workflow_event
+        if self.partition is not None and 'raft' in self._services.all:
+            # Each event triggers workflows on a single instance
+            callback = self.raft.partitioned(callback, self.partition_key)
         for topic in self.topics:
-            asyncio.ensure_future(self.bus.subscribe(
-                topic, self.workflow_event
-            ))
+            asyncio.ensure_future(self.bus.subscribe(topic, callback))
         # Enable workflow exec follow-up
         get_broker().register(self.report_workflow, topic=EXEC_TOPIC)
         # Handle distributed workflow's failures
         if 'raft' in self._services.all:
             self.raft.register('failures', self.failure_handler)
+            self.raft.register_load(
+                'workflows', lambda: len(self.running_workflows)
+            )
 
     async def reload(self):
         self.storage.configure(**self.mongo_config)
+        runtime.balancer = self.balancer()
 
     async def teardown(self):
         if self.engine:
             await self.engine.stop()
+        if 'memory' in self._services and self.memory.available:
+            await self.flush_reports()
 
     def new_workflow(self, template, instance, **kwargs):
         """
@@ -266,6 +394,7 @@ class WorkflowNyuki(Nyuki):
         """
         wflow = WorkflowInstance(template, instance, **kwargs)
         self.running_workflows[instance.uid] = wflow
+        WORKFLOWS_RUNNING.set(len(self.running_workflows))
         if 'memory' in self._services and self.memory.available:
             asyncio.ensure_future(
                 self.write_report(wflow.report(), False)
@@ -335,6 +464,9 @@ class WorkflowNyuki(Nyuki):
             # Update topic for this event
             payload['topic'] = topic
 
+            if metrics.REGISTRY.enabled:
+                self._observe_task(wflow, source, event.data['type'])
+
         memwrite = True
         # Workflow begins, also send the full template.
         if event.data['type'] == WorkflowExecState.BEGIN.value:
@@ -351,17 +483,85 @@ class WorkflowNyuki(Nyuki):
             ))
             del self.running_workflows[instance_id]
             memwrite = False
+            WORKFLOWS_RUNNING.set(len(self.running_workflows))
+            WORKFLOWS_ENDED.labels(event.data['type']).inc()
+            self._task_starts.pop(instance_id, None)
 
         # Shared memory set/del
         if 'memory' in self._services and self.memory.available:
-            if memwrite:
-                memjob = self.write_report(wflow.report())
+            if not memwrite:
+                self._dirty.discard(instance_id)
+                asyncio.ensure_future(self.clear_report(instance_id))
             else:
-                memjob = self.clear_report(instance_id)
-            asyncio.ensure_future(memjob)
+                self.snapshot(instance_id, event.data['type'])
 
+        self.events.publish(payload, instance_id, wflow.template['id'])
         await self.bus.publish(payload, 'websocket/{}'.format(topic))
 
+    def snapshot(self, instance_id, etype):
+        """
+        Write a workflow's report to shared memory after an exec event,
+        right away if a rescue relies on it, otherwise on the next flush
+        (at most once per interval, whatever the number of events).
+        """
+        if etype in SNAPSHOT_EVENTS or not self.snapshot_interval:
+            self._dirty.discard(instance_id)
+            WORKFLOWS_SNAPSHOTS.labels('immediate').inc()
+            wflow = self.running_workflows[instance_id]
+            asyncio.ensure_future(self.write_report(wflow.report()))
+            return
+
+        if instance_id in self._dirty:
+            WORKFLOWS_SNAPSHOTS.labels('coalesced').inc()
+            return
+        WORKFLOWS_SNAPSHOTS.labels('flush').inc()
+        self._dirty.add(instance_id)
+        if self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(
+                self.snapshot_interval,
+                lambda: asyncio.ensure_future(self.flush_reports()),
+            )
+
+    async def flush_reports(self):
+        """
+        Write the reports of the workflows updated since the last flush.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        dirty, self._dirty = self._dirty, set()
+        await asyncio.gather(*[
+            self.write_report(self.running_workflows[instance_id].report())
+            for instance_id in dirty
+            if instance_id in self.running_workflows
+        ])
+
+    def _observe_task(self, wflow, source, etype):
+        """
+        Measure the duration of tasks from their exec events.
+        """
+        starts = self._task_starts.setdefault(source['workflow_exec_id'], {})
+        if etype == TaskExecState.BEGIN.value:
+            starts[source['task_exec_id']] = self.loop.time()
+            return
+        if etype not in (
+            TaskExecState.END.value,
+            TaskExecState.ERROR.value,
+            TaskExecState.TIMEOUT.value,
+        ):
+            return
+
+        try:
+            start = starts.pop(source['task_exec_id'])
+        except KeyError:
+            return
+        name = 'unknown'
+        for task in wflow.template['tasks']:
+            if task['id'] == source['task_template_id']:
+                name = task['name']
+                break
+        TASK_DURATION.labels(name, etype).observe(self.loop.time() - start)
+
     async def workflow_event(self, topic, data):
         """
         New bus event received, trigger workflows if needed.
@@ -413,23 +613,23 @@ class WorkflowNyuki(Nyuki):
                     log.error("Workflow %s memory has been wiped out", wflow)
                     break
 
-                shuffle(rescuers)
                 report = json.dumps(report, default=serialize_object)
 
-                # Send a failover request to a valid, not failing, instance.
-                for ito in rescuers:
+                # Send a failover request to a valid, not failing, instance,
+                # the least loaded first.
+                for ito in self.raft.least_loaded(rescuers):
                     request = {
                         'url': 'http://{}:{}/v1/workflow/instances'.format(
-                            ito, self.api._port
+                            ito, self.raft.ports.get(ito) or self.api._port
                         ),
                         'headers': {'Content-Type': 'application/json'},
                         'data': report
                     }
-                    async with aiohttp.ClientSession() as session:
-                        async with session.put(**request) as resp:
-                            if resp.status == 200:
-                                # `ito` rescuer has taken over the workflow
-                                break
+                    async with self.http.request('put', **request) as resp:
+                        if resp.status == 200:
+                            # `ito` rescuer has taken over the workflow
+                            self.raft.add_load(ito, 'workflows')
+                            break
                 else:
                     log.error("Workflow %s hasn't be rescued properly", wflow)
                     continue
@@ -441,13 +641,11 @@ class WorkflowNyuki(Nyuki):
         Remove a report from the shared memory.
         """
         _iform = ifrom or self.id
-        await self.memory.store.delete(
-            key=self.memory.key(_iform, 'workflows', 'instances', uid)
-        )
-        await self.memory.store.srem(
-            key=self.memory.key(_iform, 'workflows', 'instances'),
-            member=uid
-        )
+        async with self.memory.pipeline('clear_report') as pipe:
+            pipe.delete(
+                self.memory.key(_iform, 'workflows', 'instances', uid)
+            )
+            pipe.srem(self.memory.key(_iform, 'workflows', 'instances'), uid)
 
     @memsafe
     async def write_report(self, report, replace=True, ito=None):
@@ -455,23 +653,23 @@ class WorkflowNyuki(Nyuki):
         Store an instance report into shared memory.
         A simple 'set' is used againts a 'hset' (hash storage), even though the
         'hset' seems more appropriate, because a field in a hash can't have TTL
+        The report and its index are written in a single transaction.
         """
         _ito = ito or self.id
         uid = report['exec']['id']
-        response = await self.memory.store.set(
-            key=self.memory.key(_ito, 'workflows', 'instances', uid),
-            value=pickle.dumps(report),
-            expire=86400,
-            exist=None if replace else False
-        )
+        keyspace = self.memory.key(self.id, 'workflows', 'instances')
+        async with self.memory.pipeline('write_report') as pipe:
+            response = pipe.set(
+                self.memory.key(_ito, 'workflows', 'instances', uid),
+                pickle.dumps(report),
+                expire=86400,
+                exist=None if replace else False
+            )
+            pipe.sadd(keyspace, uid)
+            pipe.expire(keyspace, 86400)
 
-        if not response:
+        if not await response:
             log.error("Can't share workflow id %s context in memory", uid)
-            return
-
-        keyspace = self.memory.key(self.id, 'workflows', 'instances')
-        await self.memory.store.sadd(key=keyspace, member=uid)
-        await self.memory.store.expire(key=keyspace, timeout=86400)
 
     @memsafe
     async def read_report(self, uid, ifrom=None):
@@ -1,11 +1,18 @@
-from aiohttp import web
+import asyncio
+import os
+import socket
+import tempfile
+from aiohttp import web, ClientSession
 from asynctest import TestCase, Mock, patch, ignore_loop
 from json import loads
 from nose.tools import (
-    assert_is, assert_is_not_none, assert_raises, assert_true, eq_
+    assert_is, assert_is_not_none, assert_raises, assert_true, assert_false,
+    eq_
 )
 
-from nyuki.api.api import Api, mw_capability, Response
+from nyuki.api.api import (
+    Api, AdmissionControl, mw_admission, mw_capability, resource, Response
+)
 
 from tests import make_future
 
@@ -25,7 +32,7 @@ class TestApi(TestCase):
         eq_(handler_mock.call_count, 1)
         eq_(create_server_mock.call_count, 1)
         create_server_mock.assert_called_with(
-            self._api._handler, host=None, port=None
+            self._api._handler, host=None, port=None, reuse_port=False
         )
 
     async def test_002_destroy_server(self):
@@ -38,6 +45,52 @@ class TestApi(TestCase):
                     eq_(call_close.call_count, 1)
                     eq_(i_server.wait_closed.call_count, 1)
 
+    async def test_003_unix_socket(self):
+        @resource('/ping', versions=['v1'])
+        class ApiPing:
+            async def get(self, request):
+                return Response({'pong': True})
+
+        self._api._nyuki.HTTP_RESOURCES = [ApiPing]
+        self._api._nyuki.worker = None
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'nyuki.sock')
+            # Not a socket, nothing is started
+            open(path, 'w').close()
+            self._api.configure(host='127.0.0.1', port=0, unix_socket=path)
+            with assert_raises(ValueError):
+                await self._api.start()
+            eq_(self._api._server, None)
+            os.unlink(path)
+
+            # Still served by another process, nothing is started
+            live = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            live.bind(path)
+            live.listen(1)
+            with assert_raises(ValueError):
+                await self._api.start()
+            eq_(self._api._server, None)
+            assert_true(os.path.exists(path))
+            live.close()
+            os.unlink(path)
+
+            # Stale socket file left by a killed process
+            stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            stale.bind(path)
+            stale.close()
+            assert_true(os.path.exists(path))
+            await self._api.start()
+            eq_(self._api.local_url, 'http://localhost')
+            async with ClientSession(
+                connector=self._api.local_connector()
+            ) as session:
+                url = '{}/v1/ping'.format(self._api.local_url)
+                async with session.get(url) as resp:
+                    eq_(resp.status, 200)
+                    eq_(await resp.json(), {'pong': True})
+            await self._api.stop()
+            assert_false(os.path.exists(path))
+
 
 class TestCapabilityMiddleware(TestCase):
 
@@ -124,3 +177,90 @@ class TestCapabilityMiddleware(TestCase):
         ar = await self._request.json()
         eq_(ar['capability'], 'test')
         eq_(self._request.headers.get('Content-Type'), 'application/json')
+
+
+class TestAdmissionControl(TestCase):
+
+    def setUp(self):
+        self.admission = AdmissionControl(
+            limit=1, queue=1, timeout=0.05, retry_after=2,
+            groups={'history': {'routes': ['/v1/workflow/history']}},
+            loop=self.loop,
+        )
+
+    def _request(self, path, streaming=False):
+        request = Mock()
+        request.match_info.get_info.return_value = {'formatter': path}
+        request.match_info.handler.STREAMING = streaming
+        request.headers = {}
+        return request
+
+    async def test_001_gates(self):
+        eq_(self.admission.gate('/v1/raft'), None)
+        gate = self.admission.gate('/v1/workflow/history/{uid}')
+        eq_(gate.name, 'history')
+        assert_is(self.admission.gate('/v1/workflow/history'), gate)
+        eq_(self.admission.gate('/v1/config').name, '/v1/config')
+
+    async def test_002_queue_and_reject(self):
+        gate = self.admission.gate('/v1/config')
+        assert_true(await gate.acquire())
+        # One waiting in the queue, the next one is rejected immediately
+        waiting = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0)
+        eq_(gate.waiting, 1)
+        assert_false(await gate.acquire())
+        gate.release()
+        assert_true(await waiting)
+        # Queued request times out
+        assert_false(await gate.acquire())
+        gate.release()
+        eq_(gate.stats(), {
+            'limit': 1, 'queue': 1, 'running': 0, 'waiting': 0,
+            'admitted': 2, 'queued': 2, 'rejected': 2,
+        })
+
+    async def test_003_middleware(self):
+        app = {'admission': self.admission}
+        release = asyncio.Event()
+
+        async def handler(request):
+            await release.wait()
+            return Response({'ok': True})
+
+        mdw = await mw_admission(app, handler)
+        running = asyncio.ensure_future(mdw(self._request('/v1/config')))
+        await asyncio.sleep(0)
+        # Admitted in the queue but never served before timing out
+        response = await mdw(self._request('/v1/config'))
+        eq_(response.status, 503)
+        eq_(response.headers['Retry-After'], '2')
+        # The control plane is never shed
+        release.set()
+        response = await mdw(self._request('/v1/raft'))
+        eq_(response.status, 200)
+        eq_((await running).status, 200)
+
+    async def test_004_streaming(self):
+        app = {'admission': self.admission}
+        release = asyncio.Event()
+
+        async def handler(request):
+            await release.wait()
+            return Response({'ok': True})
+
+        mdw = await mw_admission(app, handler)
+        # Streams don't hold a slot
+        streams = [
+            asyncio.ensure_future(mdw(self._request('/v1/config', True)))
+            for _ in range(3)
+        ]
+        running = asyncio.ensure_future(mdw(self._request('/v1/config')))
+        await asyncio.sleep(0)
+        # The client can't choose to skip the gate
+        request = self._request('/v1/config')
+        request.headers = {'Upgrade': 'websocket'}
+        eq_((await mdw(request)).status, 503)
+        release.set()
+        for future in streams + [running]:
+            eq_((await future).status, 200)
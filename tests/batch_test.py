@@ -0,0 +1,127 @@
+import asyncio
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import make_mocked_request
+from asynctest import TestCase, Mock
+from nose.tools import assert_raises, eq_
+
+from nyuki.api.api import Api, Response, resource, streaming
+from nyuki.api.batch import ApiBatch, _with_body
+
+
+class TestBatch(TestCase):
+
+    async def setUp(self):
+        self.items = {}
+        self.running = 0
+        self.concurrent = 0
+        self.headers = None
+        test = self
+
+        @resource('/items/{name}', versions=['v1'])
+        class ApiItem:
+
+            async def get(self, request, name):
+                test.headers = request.headers
+                test.running += 1
+                test.concurrent = max(test.concurrent, test.running)
+                await asyncio.sleep(0.01)
+                test.running -= 1
+                if name not in test.items:
+                    return Response({'error': 'missing'}, status=404)
+                return Response(test.items[name])
+
+            async def put(self, request, name):
+                test.items[name] = await request.json()
+                return Response(test.items[name])
+
+        @resource('/stream', versions=['v1'])
+        class ApiStream:
+
+            @streaming
+            async def get(self, request):
+                response = web.StreamResponse()
+                await response.prepare(request)
+                return response
+
+        nyuki = Mock()
+        nyuki.HTTP_RESOURCES = [ApiBatch, ApiItem, ApiStream]
+        nyuki.loop = self.loop
+        nyuki.worker = None
+        self.api = Api(nyuki)
+        self.api.configure(host='127.0.0.1', port=0)
+        await self.api.start()
+        port = self.api._server.sockets[0].getsockname()[1]
+        self.url = 'http://127.0.0.1:{}/v1/batch'.format(port)
+
+    async def tearDown(self):
+        await self.api.stop()
+
+    async def _batch(self, body, headers=None):
+        async with ClientSession() as session:
+            async with session.post(
+                self.url, json=body, headers=headers
+            ) as resp:
+                return resp.status, await resp.json()
+
+    async def test_001_batch(self):
+        status, body = await self._batch([
+            {'method': 'PUT', 'path': '/v1/items/a', 'body': {'value': 1}},
+            {'method': 'GET', 'path': '/v1/items/a'},
+            {'method': 'GET', 'path': '/v1/items/b'},
+            {'method': 'GET', 'path': '/v1/items/a?verbose=1'},
+            {'method': 'PUT', 'path': '/v1/items/b', 'body': {'value': 2}},
+            {'method': 'GET', 'path': '/v1/items/b'},
+            {'method': 'DELETE', 'path': '/v1/items/b'},
+            {'method': 'GET', 'path': '/v1/nothing'},
+            {'method': 'POST', 'path': '/v1/batch', 'body': []},
+            {'method': 'GET', 'path': '/v1/stream'},
+        ])
+        eq_(status, 200)
+        eq_([item['status'] for item in body], [
+            200, 200, 404, 200, 200, 200, 405, 404, 400, 400
+        ])
+        eq_(body[1]['body'], {'value': 1})
+        eq_(body[2]['body'], {'error': 'missing'})
+        eq_(body[5]['body'], {'value': 2})
+        # The three consecutive GET requests ran together
+        eq_(self.concurrent, 3)
+
+    async def test_001b_headers(self):
+        status, body = await self._batch([
+            {'method': 'GET', 'path': '/v1/items/a'},
+        ], headers={
+            'Expect': '100-continue',
+            'Authorization': 'Bearer token',
+            'Accept-Language': 'fr',
+            'X-Request-Id': '1',
+            'Cache-Control': 'no-cache',
+        })
+        # A single '100 Continue', for the batch itself
+        eq_((status, body[0]['status']), (200, 404))
+        eq_(self.headers['Authorization'], 'Bearer token')
+        eq_(self.headers['Accept-Language'], 'fr')
+        eq_(self.headers['X-Request-Id'], '1')
+        assert 'Expect' not in self.headers
+        assert 'Cache-Control' not in self.headers
+
+    async def test_002_invalid(self):
+        status, body = await self._batch({'method': 'GET'})
+        eq_(status, 400)
+        status, body = await self._batch([{'method': 'GET', 'path': 'a'}])
+        eq_(status, 400)
+        status, body = await self._batch(
+            [{'method': 'GET', 'path': '/v1/items/a'}] * 101
+        )
+        eq_(status, 400)
+
+    async def test_003_aiohttp_internals(self):
+        # Sub-requests rely on these, check them on aiohttp upgrades
+        request = make_mocked_request('POST', '/v1/batch', payload=Mock())
+        request._read_bytes = b'batch'
+        with assert_raises(RuntimeError):
+            request.clone()
+        clone = _with_body(request, b'{}', method='PUT', rel_url='/v1/a')
+        eq_((clone.method, clone.path), ('PUT', '/v1/a'))
+        eq_(await clone.read(), b'{}')
+        eq_(await request.read(), b'batch')
+        assert callable(getattr(web.Application, '_handle', None))
@@ -0,0 +1,125 @@
+from aiohttp import ClientSession
+from asynctest import TestCase, Mock, patch, ignore_loop
+from nose.tools import eq_, assert_is_none
+
+from nyuki.api.api import (
+    Api, Response, ResponseCache, resource, cached, invalidates
+)
+
+
+class TestResponseCache(TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache(enabled=True, max_entries=2)
+
+    @ignore_loop
+    def test_001_set_get(self):
+        assert_is_none(self.cache.get('/a?', '/a'))
+        self.cache.set('/a?', Response({'a': 1}), 10, ['a'])
+        # Only successful responses are kept
+        self.cache.set('/b?', Response(status=404), 10, ['b'])
+        response = self.cache.get('/a?', '/a')
+        eq_(response.status, 200)
+        eq_(response.body, b'{"a": 1}')
+        eq_(response.content_type, 'application/json')
+        assert_is_none(self.cache.get('/b?', '/b'))
+        stats = self.cache.stats()
+        eq_((stats['hits'], stats['misses'], stats['entries']), (1, 2, 1))
+        eq_(stats['routes']['/a'], {'hits': 1, 'misses': 1})
+
+    @ignore_loop
+    def test_002_expiry(self):
+        with patch('nyuki.api.api.time.monotonic', return_value=100):
+            self.cache.set('/a?', Response({'a': 1}), 10, ['a'])
+        with patch('nyuki.api.api.time.monotonic', return_value=109):
+            eq_(self.cache.get('/a?', '/a').status, 200)
+        with patch('nyuki.api.api.time.monotonic', return_value=110):
+            assert_is_none(self.cache.get('/a?', '/a'))
+        eq_(self.cache.stats()['entries'], 0)
+
+    @ignore_loop
+    def test_003_invalidate_and_evict(self):
+        self.cache.set('/a?', Response({'a': 1}), 10, ['all', 'a'])
+        self.cache.set('/b?', Response({'b': 1}), 10, ['all', 'b'])
+        self.cache.invalidate('a')
+        assert_is_none(self.cache.get('/a?', '/a'))
+        eq_(self.cache.get('/b?', '/b').status, 200)
+        self.cache.invalidate('all')
+        eq_(self.cache.stats()['entries'], 0)
+        eq_(self.cache.stats()['invalidations'], 2)
+
+        # Least recently used first
+        self.cache.set('/a?', Response({'a': 1}), 10, ['a'])
+        self.cache.set('/b?', Response({'b': 1}), 10, ['b'])
+        self.cache.get('/a?', '/a')
+        self.cache.set('/c?', Response({'c': 1}), 10, ['c'])
+        assert_is_none(self.cache.get('/b?', '/b'))
+        eq_(self.cache.get('/a?', '/a').status, 200)
+        eq_(self.cache.stats()['evictions'], 1)
+
+    @ignore_loop
+    def test_004_opt_in(self):
+        # Invalidations don't reach other processes, off unless configured
+        api = Api(Mock(loop=None, worker=None))
+        api.configure()
+        eq_(api.cache.enabled, False)
+        api.configure(cache={'enabled': True})
+        eq_(api.cache.enabled, True)
+
+
+class TestCachedResource(TestCase):
+
+    async def setUp(self):
+        self.items = {}
+        self.reads = 0
+        test = self
+
+        @resource('/items/{name}', versions=['v1'])
+        class ApiItem:
+
+            @cached(10, ['item:{name}'])
+            async def get(self, request, name):
+                test.reads += 1
+                if name not in test.items:
+                    return Response(status=404)
+                return Response(test.items[name])
+
+            @invalidates('item:{name}')
+            async def put(self, request, name):
+                test.items[name] = await request.json()
+                return Response(test.items[name])
+
+        nyuki = Mock()
+        nyuki.HTTP_RESOURCES = [ApiItem]
+        nyuki.loop = self.loop
+        nyuki.worker = None
+        self.api = Api(nyuki)
+        self.api.configure(
+            host='127.0.0.1', port=0, cache={'enabled': True}
+        )
+        await self.api.start()
+        port = self.api._server.sockets[0].getsockname()[1]
+        self.url = 'http://127.0.0.1:{}/v1/items'.format(port)
+
+    async def tearDown(self):
+        await self.api.stop()
+
+    async def _request(self, method, path, **kwargs):
+        async with ClientSession() as session:
+            url = '{}/{}'.format(self.url, path)
+            async with session.request(method, url, **kwargs) as resp:
+                return resp.status, await resp.read()
+
+    async def test_001_cache(self):
+        eq_((await self._request('GET', 'a'))[0], 404)
+        await self._request('PUT', 'a', json={'v': 1})
+        eq_(await self._request('GET', 'a?x=1&y=2'), (200, b'{"v": 1}'))
+        # Same query, in another order
+        eq_(await self._request('GET', 'a?y=2&x=1'), (200, b'{"v": 1}'))
+        eq_(self.reads, 2)
+
+        await self._request('PUT', 'a', json={'v': 2})
+        eq_(await self._request('GET', 'a?x=1&y=2'), (200, b'{"v": 2}'))
+        eq_(self.reads, 3)
+        stats = self.api.cache.stats()
+        eq_((stats['hits'], stats['misses']), (1, 3))
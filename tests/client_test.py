@@ -0,0 +1,68 @@
+from aiohttp import web
+from asynctest import TestCase, Mock
+from nose.tools import eq_, assert_in, assert_is
+
+from nyuki import metrics
+from nyuki.client import HttpClient
+
+
+class TestHttpClient(TestCase):
+
+    async def setUp(self):
+        self.connections = 0
+
+        def connection_made(*args, **kwargs):
+            self.connections += 1
+            return handler(*args, **kwargs)
+
+        async def hello(request):
+            return web.json_response({'hello': 'world'})
+
+        app = web.Application()
+        app.router.add_get('/hello', hello)
+        handler = app.make_handler(access_log=None)
+        self.handler = handler
+        self.server = await self.loop.create_server(
+            connection_made, '127.0.0.1', 0
+        )
+        port = self.server.sockets[0].getsockname()[1]
+        self.url = 'http://127.0.0.1:{}/hello'.format(port)
+
+        nyuki = Mock()
+        nyuki.loop = self.loop
+        nyuki.api.local_connector.return_value = None
+        self.client = HttpClient(nyuki)
+        self.client.configure()
+        await self.client.start()
+        metrics.REGISTRY.enabled = True
+        metrics.REGISTRY.clear()
+
+    async def tearDown(self):
+        metrics.REGISTRY.clear()
+        metrics.REGISTRY.enabled = False
+        await self.client.stop()
+        self.server.close()
+        await self.handler.shutdown()
+        await self.server.wait_closed()
+
+    async def test_001_keepalive(self):
+        for _ in range(3):
+            async with self.client.request('get', self.url) as resp:
+                eq_(resp.status, 200)
+                eq_(await resp.json(), {'hello': 'world'})
+        # A single connection kept alive
+        eq_(self.connections, 1)
+        assert_is(self.client.session(local=True), self.client.session())
+
+    async def test_002_metrics(self):
+        async with self.client.request('get', self.url) as resp:
+            await resp.read()
+        text = metrics.REGISTRY.expose()
+        assert_in(
+            'nyuki_http_client_requests_total{method="GET",'
+            'host="127.0.0.1",status="200"} 1.0', text
+        )
+        assert_in(
+            'nyuki_http_client_request_duration_seconds_count{method="GET",'
+            'host="127.0.0.1"} 1.0', text
+        )
@@ -0,0 +1,319 @@
+import asyncio
+from types import SimpleNamespace
+from asynctest import TestCase, Mock, CoroutineMock, patch
+from nose.tools import eq_, assert_raises
+
+from aiodns.error import DNSError
+
+from nyuki import metrics
+from nyuki.discovery import BusDiscovery, ServiceBalancer
+from nyuki.discovery.dns import DnsDiscovery, DNS_QUERIES
+from nyuki.raft import RaftProtocol
+
+
+def record(host, ttl, port=None):
+    return SimpleNamespace(host=host, ttl=ttl, port=port)
+
+
+class TestDnsDiscovery(TestCase):
+
+    def setUp(self):
+        self.nyuki = Mock()
+        self.nyuki.config = {'service': 'test'}
+        self.discovery = DnsDiscovery(self.nyuki, loop=self.loop)
+        self.discovery.configure(period=2)
+        self.updates = []
+
+        async def callback(added, removed):
+            self.updates.append((added, sorted(removed)))
+
+        self.discovery.register(callback)
+
+    async def test_001_deltas(self):
+        assert self.discovery.update({'10.0.0.1': None, '10.0.0.2': None})
+        # Nothing changed, nothing to do
+        assert not self.discovery.update({'10.0.0.2': None, '10.0.0.1': None})
+        assert self.discovery.update({'10.0.0.2': 80, '10.0.0.3': None})
+        await asyncio.sleep(0)
+        eq_(self.updates, [
+            ({'10.0.0.1': None, '10.0.0.2': None}, []),
+            ({'10.0.0.2': 80, '10.0.0.3': None}, ['10.0.0.1', '10.0.0.2']),
+        ])
+        with assert_raises(ValueError):
+            self.discovery.register(self.discovery._callbacks[0])
+
+    async def test_002_resolve(self):
+        self.discovery._resolver.query = CoroutineMock(return_value=[
+            record('10.0.0.1', 30), record('10.0.0.2', 10),
+        ])
+        eq_(await self.discovery.resolve(),
+            ({'10.0.0.1': None, '10.0.0.2': None}, 10))
+
+        async def query(name, qtype):
+            if qtype == 'SRV':
+                return [record('a.test', 30, 5558), record('b.test', 5, 5559)]
+            return [record('10.0.0.1' if name == 'a.test' else '10.0.0.2', 8)]
+
+        self.discovery.configure(entry='_api._tcp.test', record='SRV')
+        self.discovery._resolver.query = query
+        eq_(await self.discovery.resolve(),
+            ({'10.0.0.1': 5558, '10.0.0.2': 5559}, 5))
+
+    async def test_003_periodic(self):
+        metrics.REGISTRY.enabled = True
+        DNS_QUERIES.clear()
+        answers = [record('10.0.0.1', 30)]
+        self.discovery._resolver.query = CoroutineMock(side_effect=[
+            answers, DNSError(1, 'timeout'), answers,
+            asyncio.CancelledError(),
+        ])
+        sleeps = []
+
+        async def sleep(delay):
+            sleeps.append(delay)
+
+        with patch('asyncio.sleep', new=sleep):
+            with assert_raises(asyncio.CancelledError):
+                await self.discovery.periodic_query()
+        eq_(DNS_QUERIES.labels('A', 'ok').value, 2)
+        eq_(DNS_QUERIES.labels('A', 'error').value, 1)
+        metrics.REGISTRY.enabled = False
+        # TTL respected, retried after a failure
+        eq_(sleeps, [30, DnsDiscovery._RETRY_PERIOD, 30])
+        # A single update
+        await asyncio.sleep(0)
+        eq_(len(self.updates), 1)
+
+        # Never more often than the configured period
+        self.discovery._resolver.query = CoroutineMock(side_effect=[
+            [record('10.0.0.1', 0)], asyncio.CancelledError(),
+        ])
+        sleeps.clear()
+        with patch('asyncio.sleep', new=sleep):
+            with assert_raises(asyncio.CancelledError):
+                await self.discovery.periodic_query()
+        eq_(sleeps, [2])
+
+
+class TestRaftMembership(TestCase):
+
+    async def test_001_membership(self):
+        nyuki = Mock()
+        nyuki.config = {'service': 'test'}
+        raft = RaftProtocol(nyuki)
+        raft.ipv4 = '10.0.0.1'
+        raft.loop = self.loop
+        await raft.membership_handler(
+            {'10.0.0.1': 5558, '10.0.0.2': 5559, '10.0.0.3': None}, []
+        )
+        eq_(sorted(raft.cluster), ['10.0.0.2', '10.0.0.3'])
+        eq_(raft.ports, {'10.0.0.1': 5558, '10.0.0.2': 5559})
+        # A port change is not a departure
+        await raft.membership_handler({'10.0.0.2': 5560}, ['10.0.0.2'])
+        eq_(sorted(raft.cluster), ['10.0.0.2', '10.0.0.3'])
+        eq_(raft.ports['10.0.0.2'], 5560)
+        await raft.membership_handler({}, ['10.0.0.3'])
+        eq_(sorted(raft.cluster), ['10.0.0.2'])
+
+
+class FakeBroker:
+
+    """
+    In-memory MQTT broker: retained events and last wills.
+    """
+
+    def __init__(self):
+        self.retained = {}
+        self.subscriptions = []
+
+    def client(self):
+        broker = self
+        bus = Mock()
+        bus.will = None
+
+        def set_will(data, topic):
+            bus.will = (data, topic)
+
+        async def subscribe(topic, callback):
+            prefix = topic.rstrip('+')
+            broker.subscriptions.append((prefix, callback))
+            for retained, data in list(broker.retained.items()):
+                if retained.startswith(prefix):
+                    await callback(retained, data)
+
+        async def publish(data, topic, retain=False):
+            if retain and data is None:
+                broker.retained.pop(topic, None)
+            elif retain:
+                broker.retained[topic] = data
+            for prefix, callback in list(broker.subscriptions):
+                if topic.startswith(prefix):
+                    await callback(topic, data)
+
+        bus.set_will = set_will
+        bus.subscribe = subscribe
+        bus.publish = publish
+        return bus
+
+    async def disconnect(self, bus):
+        await bus.publish(*bus.will, retain=True)
+
+
+class TestBusDiscovery(TestCase):
+
+    def setUp(self):
+        self.broker = FakeBroker()
+
+    def _instance(self, ipv4, updates):
+        nyuki = Mock()
+        nyuki.config = {'service': 'test', 'bus': {}}
+        nyuki.api.port = 5558
+        nyuki.bus = self.broker.client()
+        with patch('socket.gethostbyname', return_value=ipv4):
+            discovery = BusDiscovery(nyuki, loop=self.loop)
+        discovery.configure(period=0.05)
+
+        async def callback(added, removed):
+            updates.append((added, sorted(removed)))
+
+        discovery.register(callback)
+        return discovery
+
+    async def test_001_presence(self):
+        updates = {ipv4: [] for ipv4 in ('10.0.0.1', '10.0.0.2')}
+        first = self._instance('10.0.0.1', updates['10.0.0.1'])
+        eq_(first._nyuki.bus.will, (
+            {'address': '10.0.0.1', 'port': 5558, 'up': False},
+            'nyuki/presence/test/10.0.0.1',
+        ))
+        await first.start()
+        await asyncio.sleep(0.01)
+        eq_(first.members, {'10.0.0.1': 5558})
+
+        # The retained announce is received right away
+        second = self._instance('10.0.0.2', updates['10.0.0.2'])
+        await second.start()
+        await asyncio.sleep(0.01)
+        eq_(first.members, second.members)
+        eq_(sorted(first.members), ['10.0.0.1', '10.0.0.2'])
+        eq_(updates['10.0.0.1'], [
+            ({'10.0.0.1': 5558}, []), ({'10.0.0.2': 5558}, []),
+        ])
+
+        # Last will
+        second._future.cancel()
+        await self.broker.disconnect(second._nyuki.bus)
+        eq_(first.members, {'10.0.0.1': 5558})
+        # Neither the last will nor the departure are kept by the broker
+        await asyncio.sleep(0)
+        await first.stop()
+        eq_(self.broker.retained, {})
+
+    async def test_002_timeout(self):
+        updates = []
+        first = self._instance('10.0.0.1', updates)
+        await first.start()
+        await first.presence_handler('nyuki/presence/test/10.0.0.2', {
+            'address': '10.0.0.2', 'port': 5559, 'up': True,
+        })
+        eq_(first.members, {'10.0.0.1': 5558, '10.0.0.2': 5559})
+        # No heartbeat for 3 periods
+        await asyncio.sleep(0.2)
+        eq_(first.members, {'10.0.0.1': 5558})
+        await first.stop()
+
+    async def test_003_broker_down(self):
+        first = self._instance('10.0.0.1', [])
+        connected = asyncio.Event()
+
+        async def subscribe(topic, callback):
+            await connected.wait()
+
+        first._nyuki.bus.subscribe = subscribe
+        # Started without waiting for the broker
+        await asyncio.wait_for(first.start(), 0.1)
+        eq_(first.members, {'10.0.0.1': 5558})
+        connected.set()
+        await first.stop()
+
+
+class TestServiceBalancer(TestCase):
+
+    def setUp(self):
+        self.discovery = Mock()
+        self.discovery.lookup = CoroutineMock(return_value={
+            '10.0.0.2': 5559, '10.0.0.1': None, '10.0.0.3': 5558,
+        })
+
+    async def test_001_round_robin(self):
+        balancer = ServiceBalancer(self.discovery)
+        picks = [await balancer.pick('other') for _ in range(4)]
+        eq_(picks, [
+            ('10.0.0.1', None), ('10.0.0.2', 5559), ('10.0.0.3', 5558),
+            ('10.0.0.1', None),
+        ])
+        self.discovery.lookup.return_value = {}
+        eq_(await balancer.pick('other'), None)
+        with assert_raises(ValueError):
+            ServiceBalancer(self.discovery, 'random')
+
+    async def test_002_least_outstanding(self):
+        balancer = ServiceBalancer(self.discovery, 'least_outstanding')
+        first = await balancer.pick('other')
+        with balancer.track(first):
+            second = await balancer.pick('other')
+            with balancer.track(second):
+                third = await balancer.pick('other')
+                eq_(len({first, second, third}), 3)
+                eq_(balancer.outstanding, {first: 1, second: 1})
+            assert await balancer.pick('other') != first
+        eq_(balancer.outstanding, {})
+
+
+class TestLookup(TestCase):
+
+    async def test_001_dns(self):
+        nyuki = Mock()
+        nyuki.config = {'service': 'test'}
+        discovery = DnsDiscovery(nyuki, loop=self.loop)
+        discovery.configure(period=2, lookup='{service}.internal')
+        discovery._resolver.query = CoroutineMock(side_effect=[
+            [record('10.0.0.5', 0)], DNSError(1, 'timeout'),
+        ])
+        eq_(await discovery.lookup('other'), {'10.0.0.5': None})
+        discovery._resolver.query.assert_called_once_with(
+            'other.internal', 'A'
+        )
+        # Cached for the period
+        eq_(await discovery.lookup('other'), {'10.0.0.5': None})
+        eq_(discovery._resolver.query.call_count, 1)
+        # The last answer is kept while the DNS fails
+        discovery._lookups['other'] = ({'10.0.0.5': None}, 0)
+        eq_(await discovery.lookup('other'), {'10.0.0.5': None})
+        eq_(discovery._resolver.query.call_count, 2)
+
+    async def test_002_bus(self):
+        broker = FakeBroker()
+        nyuki = Mock()
+        nyuki.config = {'service': 'test', 'bus': {}}
+        nyuki.api.port = 5558
+        nyuki.bus = broker.client()
+        with patch('socket.gethostbyname', return_value='10.0.0.1'):
+            discovery = BusDiscovery(nyuki, loop=self.loop)
+        discovery.configure(period=0.05)
+        broker.retained['nyuki/presence/other/10.0.0.5'] = {
+            'address': '10.0.0.5', 'port': 5560, 'up': True,
+        }
+        eq_(await discovery.lookup('other'), {})
+        await asyncio.sleep(0)
+        eq_(await discovery.lookup('other'), {'10.0.0.5': 5560})
+        await nyuki.bus.publish({
+            'address': '10.0.0.6', 'port': None, 'up': True,
+        }, 'nyuki/presence/other/10.0.0.6')
+        await nyuki.bus.publish({
+            'address': '10.0.0.5', 'port': 5560, 'up': False,
+        }, 'nyuki/presence/other/10.0.0.5')
+        eq_(await discovery.lookup('other'), {'10.0.0.6': None})
+        # Not heard from within the timeout
+        await asyncio.sleep(0.2)
+        eq_(await discovery.lookup('other'), {})
@@ -0,0 +1,86 @@
+import asyncio
+import pickle
+from asynctest import TestCase, Mock
+from nose.tools import eq_, assert_raises
+
+from nyuki import metrics
+from nyuki.memory import Memory, MEMORY_LATENCY
+from nyuki.workflow.workflow import WorkflowNyuki
+
+
+class FakePipeline:
+
+    def __init__(self, store):
+        self.store = store
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            future = asyncio.Future()
+            self.commands.append((name, args, kwargs, future))
+            return future
+        return command
+
+    async def execute(self):
+        # A single round trip for all the commands
+        await asyncio.sleep(0.001)
+        self.store.round_trips.append([
+            (name, args) for name, args, _, _ in self.commands
+        ])
+        for name, args, kwargs, future in self.commands:
+            future.set_result(True)
+
+
+class FakeStore:
+
+    def __init__(self):
+        self.round_trips = []
+
+    def multi_exec(self):
+        return FakePipeline(self)
+
+
+class TestMemoryPipeline(TestCase):
+
+    def setUp(self):
+        self.nyuki = Mock()
+        self.nyuki.id = 'me'
+        self.nyuki.memory = Memory(Mock(
+            config={'service': 'test'}, loop=self.loop
+        ))
+        self.nyuki.memory.store = FakeStore()
+
+    async def test_001_pipeline(self):
+        metrics.REGISTRY.enabled = True
+        MEMORY_LATENCY.clear()
+        store = self.nyuki.memory.store
+        async with self.nyuki.memory.pipeline('test') as pipe:
+            result = pipe.incr('key')
+        assert await result
+        eq_(MEMORY_LATENCY.labels('test').count, 1)
+        metrics.REGISTRY.enabled = False
+
+        # Nothing is sent if the block failed
+        with assert_raises(ValueError):
+            async with self.nyuki.memory.pipeline('test') as pipe:
+                pipe.incr('key')
+                raise ValueError
+        eq_(len(store.round_trips), 1)
+
+    async def test_002_reports(self):
+        store = self.nyuki.memory.store
+        report = {'exec': {'id': 'wf1'}}
+        await WorkflowNyuki.write_report(self.nyuki, report)
+        await WorkflowNyuki.clear_report(self.nyuki, 'wf1', ifrom='other')
+        eq_(store.round_trips, [
+            [
+                ('set', ('test.me.workflows.instances.wf1',
+                         pickle.dumps(report))),
+                ('sadd', ('test.me.workflows.instances', 'wf1')),
+                ('expire', ('test.me.workflows.instances', 86400)),
+            ],
+            [
+                ('delete', ('test.other.workflows.instances.wf1',)),
+                ('srem', ('test.other.workflows.instances', 'wf1')),
+            ],
+        ])
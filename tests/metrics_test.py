@@ -0,0 +1,99 @@
+from asynctest import TestCase, Mock, ignore_loop
+from nose.tools import eq_, assert_in, assert_is, assert_raises
+
+from nyuki import metrics
+from nyuki.api.api import Response, mw_metrics
+
+
+class TestRegistry(TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry(enabled=True)
+
+    @ignore_loop
+    def test_001_disabled(self):
+        self.registry.enabled = False
+        counter = self.registry.counter('test_total', 'Test', ['code'])
+        assert_is(counter.labels('200'), metrics.NOOP)
+        counter.labels('200').inc()
+        eq_(self.registry.expose(), '# HELP test_total Test\n'
+                                    '# TYPE test_total counter\n')
+
+    @ignore_loop
+    def test_002_counter_gauge(self):
+        counter = self.registry.counter('test_total', 'Test', ['code'])
+        assert_is(self.registry.counter('test_total', 'Test'), counter)
+        counter.labels('200').inc()
+        counter.labels('200').inc(2)
+        counter.labels('a"b').inc()
+        gauge = self.registry.gauge('test_running', 'Running')
+        gauge.set(5)
+        gauge.dec()
+        text = self.registry.expose()
+        assert_in('# TYPE test_total counter', text)
+        assert_in('test_total{code="200"} 3.0', text)
+        assert_in('test_total{code="a\\"b"} 1.0', text)
+        assert_in('# TYPE test_running gauge', text)
+        assert_in('test_running 4.0', text)
+        with assert_raises(ValueError):
+            self.registry.gauge('test_total', 'Test')
+        with assert_raises(ValueError):
+            counter.labels()
+
+    @ignore_loop
+    def test_003_histogram(self):
+        histogram = self.registry.histogram(
+            'test_seconds', 'Duration', buckets=(0.1, 1)
+        )
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        text = self.registry.expose()
+        assert_in('test_seconds_bucket{le="0.1"} 1.0', text)
+        assert_in('test_seconds_bucket{le="1.0"} 2.0', text)
+        assert_in('test_seconds_bucket{le="+Inf"} 3.0', text)
+        assert_in('test_seconds_sum 5.55', text)
+        assert_in('test_seconds_count 3.0', text)
+
+    async def test_004_timed(self):
+        histogram = self.registry.histogram('test_seconds', 'Duration', ['op'])
+
+        @metrics.timed(histogram, 'get')
+        async def get():
+            return 'value'
+
+        eq_(await get(), 'value')
+        eq_(histogram.labels('get').count, 1)
+
+
+class TestMetricsMiddleware(TestCase):
+
+    def setUp(self):
+        metrics.REGISTRY.enabled = True
+        metrics.REGISTRY.clear()
+
+    def tearDown(self):
+        metrics.REGISTRY.clear()
+        metrics.REGISTRY.enabled = False
+
+    async def test_001_request(self):
+        request = Mock()
+        request.method = 'GET'
+        request.match_info.get_info.return_value = {
+            'formatter': '/v1/workflow/history/{uid}'
+        }
+
+        async def handler(request):
+            return Response(status=404)
+
+        mdw = await mw_metrics(None, handler)
+        eq_((await mdw(request)).status, 404)
+        text = metrics.REGISTRY.expose()
+        assert_in(
+            'nyuki_http_requests_total{method="GET",'
+            'route="/v1/workflow/history/{uid}",status="404"} 1.0', text
+        )
+        assert_in(
+            'nyuki_http_request_duration_seconds_count{method="GET",'
+            'route="/v1/workflow/history/{uid}"} 1.0', text
+        )
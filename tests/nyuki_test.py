@@ -37,6 +37,16 @@ class TestNyuki(TestCase):
         with open(self.default, 'r') as f:
             eq_(f.read(), '{"bus": {"dsn": "mqtt://test@localhost"}}')
 
+    @ignore_loop
+    @patch('nyuki.workers.os.fork')
+    def test_002_invalid_workers(self, fork):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as conf:
+            conf.write('{"workers": "4"}')
+            conf.flush()
+            with assert_raises(ValidationError):
+                Nyuki(config=conf.name)
+        eq_(fork.call_count, 0)
+
     @ignore_loop
     def test_003_get_rest_configuration(self):
         response = self.apiconf.get(None)
@@ -84,8 +94,8 @@ class TestNyuki(TestCase):
                 'port': {'type': 'integer'}
             }
         })
-        # Base + API + Bus + custom
-        eq_(len(self.nyuki._schemas), 4)
+        # Base + API + HTTP client + Bus + custom
+        eq_(len(self.nyuki._schemas), 5)
 
     async def test_005_stop(self):
         with patch.object(self.nyuki._services, 'stop') as mock:
@@ -0,0 +1,106 @@
+from asynctest import TestCase, Mock, ignore_loop
+from nose.tools import eq_
+
+from nyuki.raft import RaftProtocol
+from nyuki.utils import HashRing
+from nyuki.workflow.workflow import WorkflowNyuki
+from tests.raft_sim import RaftSimulation, simulate
+
+
+KEYS = ['device/{}'.format(index) for index in range(10000)]
+
+
+class TestHashRing(TestCase):
+
+    @ignore_loop
+    def test_001_balance(self):
+        nodes = ['10.0.0.{}'.format(index) for index in range(1, 6)]
+        ring = HashRing(nodes)
+        owned = {node: 0 for node in nodes}
+        for key in KEYS:
+            owned[ring.get(key)] += 1
+        # Every node owns a fair share (2000 keys each)
+        assert min(owned.values()) > 1400
+        assert max(owned.values()) < 2600
+        # Same nodes, same ring, in any order
+        eq_(HashRing(reversed(nodes)).get('device/1'), ring.get('device/1'))
+        eq_(HashRing().get('device/1'), None)
+
+    @ignore_loop
+    def test_002_rebalance(self):
+        nodes = ['10.0.0.{}'.format(index) for index in range(1, 6)]
+        ring = HashRing(nodes)
+        before = {key: ring.get(key) for key in KEYS}
+        assert not ring.update(reversed(nodes))
+
+        # A new node only takes keys, about 1/6 of them
+        assert ring.update(nodes + ['10.0.0.6'])
+        moved = [key for key in KEYS if ring.get(key) != before[key]]
+        assert len(moved) < len(KEYS) / 4
+        eq_({ring.get(key) for key in moved}, {'10.0.0.6'})
+
+        # A node leaving only gives its own keys away
+        ring.update(nodes[1:])
+        moved = [key for key in KEYS if ring.get(key) != before[key]]
+        eq_({before[key] for key in moved}, {'10.0.0.1'})
+
+
+class TestPartitionedEvents(TestCase):
+
+    async def test_001_filter(self):
+        nyuki = Mock()
+        nyuki.config = {'service': 'test'}
+        raft = RaftProtocol(nyuki)
+        raft.ipv4 = '10.0.0.1'
+        raft.ring = HashRing(['10.0.0.1', '10.0.0.2'])
+        received = []
+
+        async def callback(topic, data):
+            received.append(topic)
+
+        owned = raft.partitioned(callback)
+        for key in KEYS[:100]:
+            await owned(key, {})
+        eq_(received, [key for key in KEYS[:100] if raft.owns(key)])
+        assert 0 < len(received) < 100
+
+        # Partitioned by a field of the event
+        received.clear()
+        owned = raft.partitioned(callback, lambda topic, data: data['id'])
+        for key in KEYS[:100]:
+            await owned('topic', {'id': key})
+        eq_(len(received), len([key for key in KEYS[:100] if raft.owns(key)]))
+
+    @ignore_loop
+    def test_002_key(self):
+        nyuki = Mock(partition={'field': 'device.id'})
+        key = WorkflowNyuki.partition_key
+        eq_(key(nyuki, 'topic', {'device': {'id': 12}}), 12)
+        eq_(key(nyuki, 'topic', {'device': 12}), 'topic')
+        eq_(key(nyuki, 'topic', {}), 'topic')
+        nyuki.partition = {}
+        eq_(key(nyuki, 'topic', {'device': {'id': 12}}), 'topic')
+
+    @ignore_loop
+    def test_003_cluster(self):
+        async def cluster(loop):
+            sim = RaftSimulation(5, loop)
+            await sim.start()
+            received = []
+            callbacks = {}
+            for ipv4, raft in sim.nodes.items():
+                async def callback(topic, data, ipv4=ipv4):
+                    received.append((topic, ipv4))
+                callbacks[ipv4] = raft.partitioned(callback)
+
+            # Every instance receives every event
+            for key in KEYS[:1000]:
+                for callback in callbacks.values():
+                    await callback(key, {})
+            await sim.stop()
+            return received
+
+        received = simulate(cluster)
+        # Each one is processed once, by any of the instances
+        eq_(sorted(topic for topic, _ in received), sorted(KEYS[:1000]))
+        eq_(len({ipv4 for _, ipv4 in received}), 5)
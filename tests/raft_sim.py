@@ -0,0 +1,515 @@
+"""
+Deterministic simulation of a Raft cluster: N `RaftProtocol` instances run
+in one process on a virtual clock, talking through a fake network that
+injects latency, loss and partitions.
+
+Run `python -m tests.raft_sim` to print the election and failure detection
+report of 3, 10 and 50 nodes clusters, `--lag <stalls>` to count the
+elections caused by stalled event loops instead.
+"""
+import asyncio
+import heapq
+import json
+import random
+import socket
+from argparse import ArgumentParser
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from nyuki.raft import ApiRaft, Event, RaftProtocol, State
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+
+    """
+    Event loop whose clock jumps to the next scheduled callback as soon as
+    there is nothing left to run, timers cost no real time.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._now = 0.0
+
+    def time(self):
+        return self._now
+
+    def _run_once(self):
+        # Jump to the next timer that is not cancelled
+        while self._scheduled and self._scheduled[0]._cancelled:
+            self._timer_cancelled_count -= 1
+            heapq.heappop(self._scheduled)._scheduled = False
+        if not self._ready and self._scheduled:
+            self._now = max(self._now, self._scheduled[0]._when)
+        super()._run_once()
+
+
+class _Request:
+
+    def __init__(self, data):
+        self._data = data
+
+    async def json(self):
+        return self._data
+
+
+class SimNetwork:
+
+    """
+    Deliver the Raft requests between simulated nodes. A message is lost
+    (never answered) if the link is down or with the `loss` probability.
+    """
+
+    def __init__(self, loop, rng, latency=(0.0005, 0.002), loss=0.0):
+        self.loop = loop
+        self.rng = rng
+        self.latency = latency
+        self.loss = loss
+        self.nodes = {}
+        self.down = set()
+        # Address -> loop time its event loop is stalled until
+        self.stalled = {}
+        self._cuts = set()
+        # Counters of requests and of request+response bytes, per method
+        self.messages = {}
+        self.bytes = {}
+
+    def partition(self, *groups):
+        """
+        Cut the links between these groups of addresses.
+        """
+        for group in groups:
+            for other in groups:
+                if other is not group:
+                    self._cuts.update((a, b) for a in group for b in other)
+
+    def heal(self):
+        self._cuts.clear()
+
+    def _reachable(self, src, dst):
+        return (
+            src not in self.down and dst not in self.down and
+            (src, dst) not in self._cuts
+        )
+
+    async def _hop(self, src, dst):
+        await asyncio.sleep(self.rng.uniform(*self.latency))
+        if not self._reachable(src, dst) or self.rng.random() < self.loss:
+            # Lost, the sender times out
+            await asyncio.sleep(3600)
+
+    def _count(self, method, payload, request=True):
+        if request:
+            self.messages[method] = self.messages.get(method, 0) + 1
+        size = len(json.dumps(payload))
+        self.bytes[method] = self.bytes.get(method, 0) + size
+
+    async def send(self, src, dst, method, data):
+        self._count(method, data)
+        await self._hop(src, dst)
+        # A stalled loop reads its messages once it is back
+        stalled = self.stalled.get(dst, 0) - self.loop.time()
+        if stalled > 0:
+            await asyncio.sleep(stalled + 0.001)
+        api = self.nodes[dst]
+        response = await getattr(api, method.lower())(
+            _Request(json.loads(json.dumps(data)))
+        )
+        body = json.loads(response.body.decode()) if response.body else None
+        self._count(method, body, request=False)
+        await self._hop(dst, src)
+        if response.status != 200:
+            return response.status, None
+        return response.status, body
+
+
+class RaftSimulation:
+
+    """
+    A cluster of `size` nodes, addressed 10.0.0.1 to 10.0.0.<size>.
+    `heartbeat` and `timeout` override `RaftProtocol.HEARTBEAT/TIMEOUT`,
+    `configure` is given to each `RaftProtocol.configure`.
+    """
+
+    def __init__(self, size, loop, seed=0, latency=(0.0005, 0.002),
+                 loss=0.0, heartbeat=None, timeout=None, configure=None):
+        self.loop = loop
+        self.rng = random.Random(seed)
+        # Election timers use the module's random generator
+        random.seed(seed)
+        self.network = SimNetwork(loop, self.rng, latency, loss)
+        self.nodes = {}
+        # (time, ipv4, term) of each candidacy and promotion
+        self.candidacies = []
+        self.promotions = []
+        # (time, ipv4) of each election timeout not followed by a candidacy
+        self.aborted = []
+        # (time, ipv4, failing uids) of each failure handler call
+        self.failures = []
+        # (time, ipv4, uid) of each live node reported as failing
+        self.false_failures = []
+
+        for index in range(1, size + 1):
+            ipv4 = '10.0.0.{}'.format(index)
+            self.nodes[ipv4] = self._new_node(
+                ipv4, heartbeat, timeout, configure or {}
+            )
+
+    def _new_node(self, ipv4, heartbeat, timeout, configure):
+        nyuki = SimpleNamespace(
+            config={'service': 'sim'},
+            loop=self.loop,
+            id='node-{}'.format(ipv4.rsplit('.', 1)[1]),
+            api=SimpleNamespace(port=5558),
+            register_schema=lambda schema: None,
+        )
+        with patch.object(socket, 'gethostbyname', return_value=ipv4):
+            raft = RaftProtocol(nyuki)
+        if heartbeat is not None:
+            raft.HEARTBEAT = heartbeat
+        if timeout is not None:
+            raft.TIMEOUT = timeout
+        raft.configure(**configure)
+        nyuki.raft = raft
+        api = ApiRaft()
+        api.nyuki = nyuki
+        self.network.nodes[ipv4] = api
+
+        async def send(dst, method, data):
+            return await self.network.send(ipv4, dst, method, data)
+
+        raft._send = send
+        self._instrument(ipv4, raft)
+        return raft
+
+    def _instrument(self, ipv4, raft):
+        candidate, promote = raft.candidate, raft.promote
+
+        async def on_candidate():
+            start, term = self.loop.time(), raft.term
+            await candidate()
+            if raft.term != term:
+                self.candidacies.append((start, ipv4, raft.term))
+            elif raft.cluster:
+                # Pre-vote failed
+                self.aborted.append((start, ipv4))
+
+        async def on_promote():
+            self.promotions.append((self.loop.time(), ipv4, raft.term))
+            await promote()
+
+        async def on_failures(uids):
+            self.failures.append((self.loop.time(), ipv4, uids))
+            for node in self.alive.values():
+                if node.uid in uids:
+                    self.false_failures.append(
+                        (self.loop.time(), ipv4, node.uid)
+                    )
+
+        raft.candidate = on_candidate
+        raft.promote = on_promote
+        raft.register(Event.FAILURES, on_failures)
+
+    async def start(self):
+        addresses = list(self.nodes)
+        for raft in self.nodes.values():
+            await raft.start()
+        for raft in self.nodes.values():
+            await raft.discovery_handler(addresses)
+
+    async def stop(self):
+        for raft in self.nodes.values():
+            await raft.stop()
+
+    @property
+    def alive(self):
+        return {
+            ipv4: raft for ipv4, raft in self.nodes.items()
+            if ipv4 not in self.network.down
+        }
+
+    def leader(self):
+        """
+        The leader, if there is exactly one and all the nodes it can reach
+        hold its log.
+        """
+        leaders = [
+            raft for raft in self.alive.values()
+            if raft.state is State.LEADER
+        ]
+        if len(leaders) != 1:
+            return None
+        leader = leaders[0]
+        for ipv4, raft in self.alive.items():
+            if raft is leader or not self.network._reachable(
+                    leader.ipv4, ipv4):
+                continue
+            if raft.state is not State.FOLLOWER or \
+                    raft.log_leader != leader.uid:
+                return None
+        return leader
+
+    async def run_until(self, predicate, limit, step=0.01):
+        """
+        Run the cluster until `predicate()` is true, return the time it
+        took (None if not within `limit` seconds).
+        """
+        start = self.loop.time()
+        while self.loop.time() - start < limit:
+            if predicate():
+                return self.loop.time() - start
+            await asyncio.sleep(step)
+        return None
+
+    async def run(self, duration):
+        await asyncio.sleep(duration)
+
+    def crash(self, ipv4):
+        """
+        The node stops answering, and its own timers stop.
+        """
+        self.network.down.add(ipv4)
+        raft = self.nodes[ipv4]
+        if raft.timer:
+            raft.timer.cancel()
+        if raft._tick:
+            raft._tick.cancel()
+        raft.state = State.UNKNOWN
+
+    def stall(self, ipv4, duration):
+        """
+        Freeze the node's event loop: its timers due meanwhile all fire at
+        the end of the stall, before it reads the messages received.
+        """
+        end = self.loop.time() + duration
+        self.network.stalled[ipv4] = end
+        raft = self.nodes[ipv4]
+        for name in ('timer', '_tick'):
+            handle = getattr(raft, name)
+            if handle is None or handle._cancelled or handle._when >= end:
+                continue
+            callback, args = handle._callback, handle._args
+            handle.cancel()
+            setattr(raft, name, self.loop.call_at(end, callback, *args))
+
+    def elections(self, since=0):
+        """
+        Number of election terms, and terms that elected no leader.
+        """
+        terms = {
+            (ipv4, term) for time, ipv4, term in self.candidacies
+            if time >= since
+        }
+        won = {
+            term for time, ipv4, term in self.promotions if time >= since
+        }
+        all_terms = {term for _, term in terms}
+        return len(all_terms), len(all_terms - won)
+
+
+async def scenario(size, loop, seed=0, steady=10.0, limit=120.0, **kwargs):
+    """
+    Measure on a cluster of `size` nodes:
+        * the time to elect a leader from a cold start
+        * the election terms, and how many of them elected no leader
+        * the heartbeat traffic while stable
+        * the failover time once the leader crashed
+        * the failure detection delay once a follower crashed
+        * the live nodes reported as failing
+    """
+    sim = RaftSimulation(size, loop, seed=seed, **kwargs)
+    report = {'size': size}
+    await sim.start()
+    report['convergence'] = await sim.run_until(sim.leader, limit)
+
+    messages = sim.network.messages.get('POST', 0)
+    sent = sim.network.bytes.get('POST', 0)
+    await sim.run(steady)
+    report['heartbeats_per_second'] = (
+        sim.network.messages.get('POST', 0) - messages
+    ) / steady
+    report['heartbeat_bytes_per_second'] = (
+        sim.network.bytes.get('POST', 0) - sent
+    ) / steady
+
+    leader = sim.leader()
+    if leader is not None:
+        sim.crash(leader.ipv4)
+        report['failover'] = await sim.run_until(
+            lambda: sim.leader() not in (None, leader), limit
+        )
+    else:
+        report['failover'] = None
+
+    leader = sim.leader()
+    followers = [
+        raft for raft in sim.alive.values() if raft is not leader
+    ]
+    report['detection'] = None
+    if leader is not None and followers:
+        crashed = followers[0]
+        sim.crash(crashed.ipv4)
+        report['detection'] = await sim.run_until(lambda: any(
+            crashed.uid in uids for _, ipv4, uids in sim.failures
+            if ipv4 == leader.ipv4
+        ), limit)
+
+    report['terms'], report['split_terms'] = sim.elections()
+    report['false_failures'] = len(sim.false_failures)
+    await sim.stop()
+    return report
+
+
+async def lag_scenario(size, loop, seed=0, stalls=20, every=5.0,
+                       limit=120.0, **kwargs):
+    """
+    Once a leader is elected, stall the event loop of a random follower
+    every `every` seconds, for 1.5 times its longest election timeout.
+    Count the election terms, leader changes and false failures caused.
+    """
+    sim = RaftSimulation(size, loop, seed=seed, **kwargs)
+    report = {'size': size, 'stalls': stalls}
+    await sim.start()
+    await sim.run_until(sim.leader, limit)
+    since = loop.time()
+    promotions = len(sim.promotions)
+
+    for _ in range(stalls):
+        leader = sim.leader()
+        # Distinct stalls, a node frozen for good is failing indeed
+        followers = sorted(
+            ipv4 for ipv4, raft in sim.nodes.items()
+            if raft is not leader and
+            sim.network.stalled.get(ipv4, 0) <= loop.time()
+        )
+        ipv4 = sim.rng.choice(followers)
+        sim.stall(ipv4, sim.nodes[ipv4].election_timeout[1] * 1.5)
+        await sim.run(every)
+
+    report['terms'], report['split_terms'] = sim.elections(since)
+    report['leader_changes'] = len(sim.promotions) - promotions
+    report['aborted'] = len([
+        time for time, _ in sim.aborted if time >= since
+    ])
+    report['false_failures'] = len(sim.false_failures)
+    await sim.stop()
+    return report
+
+
+def simulate(factory):
+    """
+    Run the coroutine returned by `factory(loop)` in a new virtual clock
+    loop, and return its result.
+    """
+    loop = VirtualClockLoop()
+    previous = asyncio.get_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(factory(loop))
+    finally:
+        # Lost messages are still pending
+        pending = asyncio.Task.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(
+            asyncio.gather(*pending, return_exceptions=True)
+        )
+        loop.close()
+        asyncio.set_event_loop(previous)
+
+
+def run_scenario(size, seed=0, **kwargs):
+    return simulate(lambda loop: scenario(size, loop, seed=seed, **kwargs))
+
+
+def run_lag_scenario(size, seed=0, **kwargs):
+    return simulate(
+        lambda loop: lag_scenario(size, loop, seed=seed, **kwargs)
+    )
+
+
+def _format(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return '{:.2f}'.format(value)
+    return str(value)
+
+
+COLUMNS = [
+    ('size', 'nodes'),
+    ('convergence', 'convergence (s)'),
+    ('terms', 'terms'),
+    ('split_terms', 'split terms'),
+    ('heartbeats_per_second', 'HB/s'),
+    ('heartbeat_bytes_per_second', 'HB bytes/s'),
+    ('failover', 'failover (s)'),
+    ('detection', 'detection (s)'),
+    ('false_failures', 'false failures'),
+]
+
+
+LAG_COLUMNS = [
+    ('size', 'nodes'),
+    ('stalls', 'stalls'),
+    ('terms', 'terms'),
+    ('split_terms', 'split terms'),
+    ('leader_changes', 'leader changes'),
+    ('aborted', 'failed pre-votes'),
+    ('false_failures', 'false failures'),
+]
+
+
+def print_reports(reports, columns=COLUMNS):
+    widths = [max(len(title), 8) for _, title in columns]
+    print('  '.join(
+        title.rjust(width) for (_, title), width in zip(columns, widths)
+    ))
+    for report in reports:
+        print('  '.join(
+            _format(report[key]).rjust(width)
+            for (key, _), width in zip(columns, widths)
+        ))
+
+
+def main():
+    parser = ArgumentParser(description='Simulated Raft cluster report')
+    parser.add_argument('--sizes', default='3,10,50')
+    parser.add_argument('--seeds', type=int, default=5)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--heartbeat', type=float)
+    parser.add_argument('--timeout', type=float, nargs=2)
+    parser.add_argument('--heartbeat-min', type=float)
+    parser.add_argument('--heartbeat-max', type=float)
+    parser.add_argument('--latency', type=float, nargs=2)
+    parser.add_argument('--no-pre-vote', action='store_true')
+    parser.add_argument('--lag', type=int, metavar='STALLS')
+    args = parser.parse_args()
+
+    kwargs = {'loss': args.loss, 'configure': {}}
+    if args.heartbeat_min is not None:
+        kwargs['configure']['heartbeat_min'] = args.heartbeat_min
+    if args.heartbeat_max is not None:
+        kwargs['configure']['heartbeat_max'] = args.heartbeat_max
+    if args.latency:
+        kwargs['latency'] = tuple(args.latency)
+    if args.no_pre_vote:
+        kwargs['configure']['pre_vote'] = False
+    if args.heartbeat:
+        kwargs['heartbeat'] = args.heartbeat
+    if args.timeout:
+        kwargs['timeout'] = tuple(args.timeout)
+
+    reports = []
+    for size in (int(size) for size in args.sizes.split(',')):
+        for seed in range(args.seeds):
+            if args.lag:
+                reports.append(run_lag_scenario(
+                    size, seed=seed, stalls=args.lag, **kwargs
+                ))
+            else:
+                reports.append(run_scenario(size, seed=seed, **kwargs))
+    print_reports(reports, LAG_COLUMNS if args.lag else COLUMNS)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,18 @@
+import asyncio
 import json
-from asynctest import TestCase, Mock, patch, CoroutineMock
-from nose.tools import eq_, assert_in, assert_not_equal, assert_not_in
+from aiohttp import web
+from asynctest import TestCase, Mock, patch, CoroutineMock, ignore_loop
+from nose.tools import (
+    eq_, assert_in, assert_is_none, assert_not_equal, assert_not_in,
+    assert_raises,
+)
 
-from nyuki.raft import ApiRaft, RaftProtocol, State
+from nyuki.raft import (
+    ApiRaft, Event, PeerRtt, PhiAccrual, RaftProtocol, State
+)
+from tests.raft_sim import (
+    RaftSimulation, run_lag_scenario, run_scenario, simulate
+)
 
 
 def from_context(params={}):
@@ -89,16 +99,19 @@ class TestRaftProtocol(TestCase):
     @patch('nyuki.raft.RaftProtocol.heartbeat')
     async def test_001b_discovery(self, hb_mock):
         """
-        Discovery handler called with additional and suspicious instances
+        Discovery handler called with additional and removed instances
         """
         raft = from_context({
-            'cluster': {'10.50.0.2': '000002'}
+            'cluster': {'10.50.0.2': '000002'},
+            'loop': self.loop,
         }).raft
         await raft.start()
         raft.state = State.LEADER
 
         await raft.discovery_handler(['10.50.0.1', '10.50.0.3'])
-        assert_in(('10.50.0.2', '000002'), raft.suspicious)
+        await asyncio.sleep(0)
+        # The leader handles removed instances right away
+        eq_(raft.failed, {'10.50.0.2': '000002'})
         assert_in('10.50.0.3', raft.cluster)
         eq_(hb_mock.call_count, 1)
 
@@ -172,3 +185,489 @@ class TestRaftProtocol(TestCase):
             request_mock.return_value = {'instance': '10.50.0.2'}
             await raft.request_vote('10.50.0.2', 13)
             eq_(raft.state, State.LEADER)
+
+
+class TestRaftTransport(TestCase):
+
+    async def setUp(self):
+        self.delay = 0
+        self.peers = set()
+
+        async def handler(request):
+            self.peers.add(request.transport.get_extra_info('peername'))
+            await asyncio.sleep(self.delay)
+            return web.json_response({'instance': '000002'})
+
+        app = web.Application(loop=self.loop)
+        app.router.add_route('*', '/v1/raft', handler)
+        self.handler = app.make_handler()
+        self.server = await self.loop.create_server(
+            self.handler, '127.0.0.1', 0
+        )
+        self.raft = from_context().raft
+        self.raft.loop = self.loop
+        self.raft.configure(
+            port=self.server.sockets[0].getsockname()[1], timeout=0.1
+        )
+
+    async def tearDown(self):
+        await self.raft.stop()
+        self.server.close()
+        await self.handler.shutdown()
+        await self.server.wait_closed()
+
+    async def test_001_keepalive(self):
+        for _ in range(3):
+            response = await self.raft.request('127.0.0.1', 'post', {})
+            eq_(response, {'instance': '000002'})
+        # A single connection was used
+        eq_(len(self.peers), 1)
+        rtt = self.raft.rtt['127.0.0.1']
+        eq_((rtt.samples, rtt.failures), (3, 0))
+        assert 0 < rtt.srtt < 0.1
+
+    async def test_002_timeout(self):
+        self.delay = 0.2
+        assert_is_none(await self.raft.request('127.0.0.1', 'post', {}))
+        rtt = self.raft.rtt['127.0.0.1']
+        eq_((rtt.failures, rtt.missed), (1, 1))
+        # An answer ends the failures in a row
+        self.delay = 0
+        await self.raft.request('127.0.0.1', 'post', {})
+        eq_((rtt.failures, rtt.missed), (1, 0))
+
+
+class TestRaftReplication(TestCase):
+
+    def setUp(self):
+        self.leader = from_context({
+            'uid': '000001',
+            'state': State.LEADER,
+            'cluster': {'10.50.0.2': '000002', '10.50.0.3': None},
+        }).raft
+        self.follower = from_context({'uid': '000002'}).raft
+
+    def _heartbeat(self, ipv4):
+        return {
+            'leader': self.leader.uid,
+            'version': self.leader.log_version,
+            **self.leader._log_entry(ipv4),
+        }
+
+    async def test_001_deltas(self):
+        self.leader.update_log()
+        eq_(self.leader.log_version, 1)
+        # Nothing acknowledged yet, the whole log is sent
+        data = self._heartbeat('10.50.0.2')
+        eq_(data['log'], self.leader.network)
+        eq_(self.follower.replicate(data), 1)
+        eq_(self.follower.log, self.leader.network)
+
+        # Nothing changed, nothing to send
+        self.leader.acked['10.50.0.2'] = 1
+        self.leader.update_log()
+        eq_(self._heartbeat('10.50.0.2'), {
+            'leader': '000001', 'version': 1,
+            'base': 1, 'delta': {'set': {}, 'del': []},
+        })
+
+        self.leader.cluster['10.50.0.3'] = '000003'
+        self.leader.update_log()
+        del self.leader.cluster['10.50.0.3']
+        self.leader.update_log()
+        data = self._heartbeat('10.50.0.2')
+        eq_(data['delta'], {'set': {}, 'del': ['10.50.0.3']})
+        eq_(self.follower.replicate(data), 3)
+        eq_(self.follower.log, self.leader.network)
+
+    async def test_002_out_of_sync(self):
+        self.leader.update_log()
+        self.follower.replicate(self._heartbeat('10.50.0.2'))
+        # The follower missed a version
+        self.leader.cluster['10.50.0.3'] = '000003'
+        self.leader.update_log()
+        self.leader.cluster['10.50.0.4'] = None
+        self.leader.update_log()
+        self.leader.acked['10.50.0.2'] = 2
+        eq_(self.follower.replicate(self._heartbeat('10.50.0.2')), 1)
+        self.leader.acked['10.50.0.2'] = 1
+        eq_(self.follower.replicate(self._heartbeat('10.50.0.2')), 3)
+        eq_(self.follower.log, self.leader.network)
+        # Another leader's versions are not acknowledged
+        eq_(self.follower.replicate({'leader': '000004', 'version': 7,
+                                     'base': 3, 'delta': {}}), None)
+
+    async def test_003_broadcast(self):
+        self.leader.loop = self.loop
+        self.leader.HEARTBEAT = 0.05
+        sent = []
+
+        async def request(ipv4, method, data):
+            sent.append(ipv4)
+            if ipv4 == '10.50.0.3':
+                await asyncio.sleep(1)
+            return {'instance': '000002', 'suspicious': [], 'version': 1}
+
+        with patch.object(self.leader, 'request', new=request):
+            await self.leader.broadcast()
+            eq_(sorted(sent), ['10.50.0.2', '10.50.0.3'])
+            eq_(self.leader.acked, {'10.50.0.2': 1})
+            # Missed the deadline, no heartbeat recorded
+            eq_(self.leader.detectors['10.50.0.3']._started, False)
+            eq_(self.leader.detectors['10.50.0.2']._started, True)
+            # Next ticks, to all followers
+            await asyncio.sleep(0.06)
+            assert len(sent) > 2
+            eq_(len(sent) % 2, 0)
+            await self.leader.stop()
+
+
+class TestRaftSimulation(TestCase):
+
+    @ignore_loop
+    def test_001_scenario(self):
+        report = run_scenario(3, seed=1, steady=2.0)
+        assert report['convergence'] is not None
+        assert report['failover'] is not None
+        assert report['detection'] is not None
+        # Failure detector: a crash is told apart from a stall (up to 1.5
+        # times the longest election timeout) once the pause is over
+        assert report['detection'] < 7
+        eq_(report['false_failures'], 0)
+        # Fast network, 2 followers at the fastest heartbeat (0.25s)
+        eq_(report['heartbeats_per_second'], 8.0)
+        # Same seed, same run
+        eq_(run_scenario(3, seed=1, steady=2.0), report)
+
+    @ignore_loop
+    def test_002_partition(self):
+        async def partition(loop):
+            sim = RaftSimulation(5, loop, seed=2)
+            await sim.start()
+            await sim.run_until(sim.leader, 60)
+            old = sim.leader()
+            # The leader is left alone with a single follower
+            minority = [old.ipv4, next(
+                ipv4 for ipv4 in sim.nodes if ipv4 != old.ipv4
+            )]
+            majority = [ipv4 for ipv4 in sim.nodes if ipv4 not in minority]
+            sim.network.partition(minority, majority)
+            elected = await sim.run_until(lambda: any(
+                sim.nodes[ipv4].state is State.LEADER for ipv4 in majority
+            ), 60)
+            await sim.stop()
+            return elected
+
+        assert simulate(partition) is not None
+
+    @ignore_loop
+    def test_004_leader_jobs(self):
+        async def handover(loop):
+            sim = RaftSimulation(5, loop, seed=4)
+            runs = []
+            for ipv4, raft in sim.nodes.items():
+                async def job(ipv4=ipv4):
+                    runs.append((loop.time(), ipv4))
+                raft.run_on_leader(job, 5.0, name='compaction')
+            await sim.start()
+            await sim.run_until(sim.leader, 60)
+            old = sim.leader()
+            await sim.run(20)
+            sim.crash(old.ipv4)
+            await sim.run(20)
+            await sim.stop()
+            return old.ipv4, runs
+
+        old, runs = simulate(handover)
+        # Once per interval cluster-wide, taken over by the new leader
+        gaps = [b[0] - a[0] for a, b in zip(runs, runs[1:])]
+        assert min(gaps) > 4.99
+        assert max(gaps) < 7.0
+        eq_(len({ipv4 for _, ipv4 in runs}), 2)
+        eq_(runs[0][1], old)
+        assert runs[-1][1] != old
+
+    @ignore_loop
+    def test_003_adaptive(self):
+        fixed = run_scenario(10, seed=3, steady=2.0, configure={
+            'heartbeat_min': 1.0
+        })
+        adaptive = run_scenario(10, seed=3, steady=2.0)
+        eq_(fixed['heartbeats_per_second'], 9.0)
+        assert adaptive['failover'] < fixed['failover'] / 2
+        # Slow network, back to the slowest heartbeat
+        slow = run_scenario(10, seed=3, steady=2.0, latency=(0.02, 0.2))
+        eq_(slow['heartbeats_per_second'], 9.0)
+
+
+class TestRaftAdaptiveTimeouts(TestCase):
+
+    @ignore_loop
+    def test_001_heartbeat(self):
+        raft = from_context({
+            'cluster': {'10.50.0.2': None, '10.50.0.3': None},
+        }).raft
+        raft.configure(heartbeat_min=0.1, heartbeat_max=1.0)
+        # No RTT known yet
+        eq_(raft.adapt_heartbeat(), 1.0)
+        raft.rtt['10.50.0.2'] = PeerRtt()
+        raft.rtt['10.50.0.2'].update(0.002)
+        eq_(raft.adapt_heartbeat(), 0.1)
+        raft.rtt['10.50.0.3'] = PeerRtt()
+        raft.rtt['10.50.0.3'].update(0.02)
+        # srtt + 4 * rttvar = 0.06
+        eq_(round(raft.adapt_heartbeat(), 3), 0.6)
+        eq_(tuple(round(t, 3) for t in raft.election_timeout), (1.2, 2.1))
+
+    @ignore_loop
+    def test_002_follower(self):
+        raft = from_context().raft
+        raft.configure(heartbeat_min=0.2, heartbeat_max=1.0)
+        raft.follow_heartbeat(0.01)
+        eq_(raft.heartbeat_interval, 0.2)
+        raft.follow_heartbeat(None)
+        eq_(raft.heartbeat_interval, 1.0)
+        eq_(raft.election_timeout, RaftProtocol.TIMEOUT)
+
+
+class TestRaftPreVote(TestCase):
+
+    def setUp(self):
+        self.api = ApiRaft()
+        self.api.nyuki = from_context({'uid': '000001'})
+        self.raft = self.api.nyuki.raft
+        self.raft.configure()
+        self.raft.loop = self.loop
+        self.raft.state = State.FOLLOWER
+
+    async def test_001_pre_vote(self):
+        response = await self.api.patch(Request({'candidate': '000002'}))
+        eq_(json.loads(response.text)['granted'], True)
+        # Heard from a leader, the candidate would disrupt it
+        await self.api.post(Request({'leader': '000003', 'log': {}}))
+        response = await self.api.patch(Request({'candidate': '000002'}))
+        eq_(json.loads(response.text)['granted'], False)
+        # The leader is not sticky forever
+        self.raft.leader_contact -= self.raft.election_timeout[0]
+        response = await self.api.patch(Request({'candidate': '000002'}))
+        eq_(json.loads(response.text)['granted'], True)
+        self.raft.timer.cancel()
+
+    async def test_002_sticky_vote(self):
+        await self.api.post(Request({'leader': '000003', 'log': {}}))
+        self.raft.voted_for = None
+        response = await self.api.put(
+            Request({'candidate': '000002', 'term': 10})
+        )
+        eq_(response.status, 403)
+        eq_(self.raft.voted_for, None)
+        self.raft.timer.cancel()
+
+    @ignore_loop
+    def test_003_loop_lag(self):
+        report = run_lag_scenario(3, seed=1, stalls=5)
+        eq_((report['terms'], report['leader_changes']), (0, 0))
+        eq_(report['aborted'], 5)
+        # Stalled followers aren't handled as failing
+        eq_(report['false_failures'], 0)
+        report = run_lag_scenario(
+            3, seed=1, stalls=5, configure={'pre_vote': False}
+        )
+        assert report['leader_changes'] > 0
+
+
+class TestRaftFailureDetector(TestCase):
+
+    def setUp(self):
+        self.api = ApiRaft()
+        self.api.nyuki = from_context({'uid': '000001'})
+        self.raft = self.api.nyuki.raft
+        self.raft.configure()
+        self.raft.loop = self.loop
+        self.raft.state = State.LEADER
+        self.raft.cluster = {'10.50.0.2': '000002', '10.50.0.3': '000003'}
+        self.failures = []
+
+        async def on_failures(uids):
+            self.failures.extend(uids)
+
+        self.raft.register(Event.FAILURES, on_failures)
+
+    @ignore_loop
+    def test_001_phi(self):
+        detector = PhiAccrual(1.0, 0.0)
+        for now in (1.0, 2.1, 2.9, 4.0, 5.0):
+            detector.heartbeat(now)
+        phis = [detector.phi(5.0 + elapsed) for elapsed in (0.5, 1, 2, 3)]
+        assert phis[0] < 0.5
+        eq_(phis, sorted(phis))
+        assert phis[-1] > 8
+        # An irregular peer is suspected later
+        jittery = PhiAccrual(1.0, 0.0)
+        for now in (0.5, 2.0, 2.5, 4.0, 5.0):
+            jittery.heartbeat(now)
+        assert jittery.phi(8.0) < phis[-1]
+        # As well as with an acceptable pause
+        detector.pause = 1.0
+        assert detector.phi(8.0) < phis[-1]
+
+    async def test_002_threshold(self):
+        now = self.loop.time()
+        self.raft.detectors = {
+            '10.50.0.2': self.raft._new_detector(),
+            '10.50.0.3': self.raft._new_detector(),
+        }
+        self.raft.detectors['10.50.0.2'].last = now - 10
+        self.raft.detectors['10.50.0.3'].last = now - 10
+        # Unless its requests fail, a suspected instance is only stalled
+        self.raft.rtt['10.50.0.2'] = PeerRtt()
+        self.raft.rtt['10.50.0.2'].missed = self.raft.FAILED_RPCS
+        self.raft.rtt['10.50.0.3'] = PeerRtt()
+        self.raft.check_failures()
+        self.raft.check_failures()
+        await asyncio.sleep(0.01)
+        # Handled once
+        eq_(self.failures, ['000002'])
+        eq_(self.raft.failed, {'10.50.0.2': '000002'})
+
+        # It was alive after all
+        async def request(ipv4, method, data):
+            return {'instance': '000002', 'suspicious': [], 'version': 1}
+
+        with patch.object(self.raft, 'request', new=request):
+            await self.raft.heartbeat('10.50.0.2')
+        eq_(self.raft.failed, {})
+
+    async def test_003_reported(self):
+        # Followers report failing instances to the leader
+        self.raft.state = State.FOLLOWER
+        self.raft.suspect([('10.50.0.4', '000004')])
+        response = await self.api.post(Request({'leader': '000002'}))
+        eq_(json.loads(response.text)['suspicious'],
+            [['10.50.0.4', '000004']])
+        eq_(self.raft.suspicious, set())
+        self.raft.timer.cancel()
+
+        self.raft.state = State.LEADER
+        self.raft.update_log()
+
+        async def request(ipv4, method, data):
+            return {
+                'instance': '000003',
+                'suspicious': [['10.50.0.4', '000004']],
+                'version': 1,
+            }
+
+        with patch.object(self.raft, 'request', new=request):
+            await self.raft.heartbeat('10.50.0.3')
+            await self.raft.heartbeat('10.50.0.3')
+        await asyncio.sleep(0.01)
+        eq_(self.failures, ['000004'])
+
+
+class TestRaftLeaderJobs(TestCase):
+
+    def setUp(self):
+        self.api = ApiRaft()
+        self.api.nyuki = from_context({'uid': '000001'})
+        self.raft = self.api.nyuki.raft
+        self.raft.configure()
+        self.raft.loop = self.loop
+        self.raft.state = State.FOLLOWER
+        self.runs = []
+
+    async def _job(self):
+        self.runs.append(self.loop.time())
+
+    async def test_001_events(self):
+        events = []
+        for event in (Event.ELECTED, Event.DISMISSED):
+            async def handler(event=event):
+                events.append(event)
+            self.raft.register(event, handler)
+        self.raft.state = State.LEADER
+        self.raft.state = State.LEADER
+        self.raft.state = State.FOLLOWER
+        self.raft.state = State.FOLLOWER
+        await asyncio.sleep(0)
+        eq_(events, [Event.ELECTED, Event.DISMISSED])
+
+    async def test_002_run_on_leader(self):
+        job = self.raft.run_on_leader(self._job, 0.05)
+        with assert_raises(ValueError):
+            self.raft.run_on_leader(self._job, 0.05)
+        await asyncio.sleep(0.02)
+        eq_(self.runs, [])
+        self.raft.state = State.LEADER
+        assert job.running
+        await asyncio.sleep(0.12)
+        eq_(len(self.runs), 3)
+        await self.raft.stop()
+        assert not job.running
+        await asyncio.sleep(0.1)
+        eq_(len(self.runs), 3)
+
+    async def test_003_handover(self):
+        job = self.raft.run_on_leader(self._job, 0.1, name='job')
+        # The previous leader ran it 40ms ago
+        await self.api.post(Request({
+            'leader': '000002', 'log': {}, 'jobs': {'job': 0.04},
+        }))
+        self.raft.timer.cancel()
+        start = self.loop.time()
+        self.raft.state = State.LEADER
+        await asyncio.sleep(0.1)
+        eq_(len(self.runs), 1)
+        assert 0.05 < self.runs[0] - start < 0.07
+        job.stop()
+
+
+class TestRaftLoad(TestCase):
+
+    def setUp(self):
+        self.api = ApiRaft()
+        self.api.nyuki = from_context({'uid': '000001'})
+        self.raft = self.api.nyuki.raft
+        self.raft.configure()
+        self.raft.loop = self.loop
+        self.raft.register_load('workflows', lambda: 4)
+
+    async def test_001_vector(self):
+        response = await self.api.post(Request({'leader': '000002'}))
+        self.raft.timer.cancel()
+        load = json.loads(response.text)['load']
+        eq_(load['workflows'], 4)
+        eq_(load['lag'], 0)
+        assert load['memory'] > 0
+
+    @ignore_loop
+    def test_002_least_loaded(self):
+        self.raft.cluster = {
+            '10.50.0.2': '000002', '10.50.0.3': '000003',
+            '10.50.0.4': '000004',
+        }
+        self.raft._loads = {
+            '10.50.0.2': {'workflows': 0, 'lag': 0.001, 'memory': 100},
+            '10.50.0.3': {'workflows': 2, 'lag': 0.5, 'memory': 100},
+        }
+        self.raft.load_vector = lambda: {
+            'workflows': 2, 'lag': 0.001, 'memory': 100
+        }
+        eq_(self.raft.least_loaded(sorted(self.raft.network)), [
+            '10.50.0.2', '10.50.0.1', '10.50.0.3', '10.50.0.4'
+        ])
+        # Work sent counts until the next heartbeat
+        placed = []
+        for _ in range(2):
+            ipv4 = self.raft.least_loaded(['10.50.0.1', '10.50.0.2'])[0]
+            self.raft.add_load(ipv4, 'workflows')
+            placed.append(ipv4)
+        eq_(placed, ['10.50.0.2', '10.50.0.2'])
+        self.raft.add_load('10.50.0.2', 'workflows')
+        eq_(self.raft.least_loaded(['10.50.0.1', '10.50.0.2'])[0],
+            '10.50.0.1')
+
+    async def test_003_lag(self):
+        self.raft._probe_lag(self.loop.time() - 0.2)
+        eq_(round(self.raft.loop_lag, 3), 0.05)
+        self.raft._lag_probe.cancel()
@@ -0,0 +1,54 @@
+import signal
+from unittest import TestCase
+from unittest.mock import patch, call
+from nose.tools import eq_, assert_raises
+
+from nyuki.workers import WorkerSupervisor
+
+
+class TestWorkerSupervisor(TestCase):
+
+    def test_001_count(self):
+        with assert_raises(ValueError):
+            WorkerSupervisor(0)
+
+    @patch('nyuki.workers.os.fork')
+    def test_002a_fork_supervisor(self, fork_mock):
+        fork_mock.side_effect = [101, 102, 103]
+        supervisor = WorkerSupervisor(3)
+        eq_(supervisor.fork(), None)
+        eq_(supervisor.workers, {101: 0, 102: 1, 103: 2})
+
+    @patch('nyuki.workers.signal.signal')
+    @patch('nyuki.workers.os.fork')
+    def test_002b_fork_worker(self, fork_mock, signal_mock):
+        # Second fork returns in the child process
+        fork_mock.side_effect = [101, 0]
+        supervisor = WorkerSupervisor(3)
+        eq_(supervisor.fork(), 1)
+        eq_(supervisor.workers, {})
+        signal_mock.assert_called_once_with(signal.SIGINT, signal.SIG_IGN)
+
+    @patch('nyuki.workers.os.kill')
+    def test_003_relay(self, kill_mock):
+        supervisor = WorkerSupervisor(2)
+        supervisor.workers = {101: 0, 102: 1}
+        supervisor._relay(signal.SIGINT, None)
+        kill_mock.assert_has_calls([
+            call(101, signal.SIGTERM), call(102, signal.SIGTERM)
+        ], any_order=True)
+        kill_mock.reset_mock()
+        supervisor._relay(signal.SIGHUP, None)
+        kill_mock.assert_has_calls([
+            call(101, signal.SIGHUP), call(102, signal.SIGHUP)
+        ], any_order=True)
+
+    @patch('nyuki.workers.signal.signal')
+    @patch('nyuki.workers.os.wait')
+    def test_004_run(self, wait_mock, signal_mock):
+        wait_mock.side_effect = [(102, 0), (101, 256)]
+        supervisor = WorkerSupervisor(2)
+        supervisor.workers = {101: 0, 102: 1}
+        supervisor.run()
+        eq_(supervisor.workers, {})
+        eq_(wait_mock.call_count, 2)
@@ -0,0 +1,112 @@
+import asyncio
+from aiohttp import ClientSession, WSMsgType, WSCloseCode
+from asynctest import TestCase, Mock, ignore_loop
+from nose.tools import eq_, assert_true, assert_false
+
+from nyuki.api.api import Api
+from nyuki.workflow.api.events import ApiWorkflowEvents
+from nyuki.workflow.events import EventHub
+
+
+class TestEventHub(TestCase):
+
+    def setUp(self):
+        self.hub = EventHub(queue_size=2, loop=self.loop)
+
+    @ignore_loop
+    def test_001_filters(self):
+        sub = self.hub.subscribe(instances=['i1'], types=['task-end'])
+        assert_true(sub.matches('i1', 't1', 'task-end'))
+        assert_false(sub.matches('i2', 't1', 'task-end'))
+        assert_false(sub.matches('i1', 't1', 'task-begin'))
+        sub.update(templates=['t2'])
+        assert_true(sub.matches('i2', 't2', 'task-begin'))
+        assert_false(sub.matches('i2', 't1', 'task-begin'))
+
+    async def test_002_publish(self):
+        sub = self.hub.subscribe(templates=['t1'])
+        self.hub.publish({'type': 'begin'}, 'i1', 't2')
+        self.hub.publish({'type': 'begin'}, 'i1', 't1')
+        eq_(await sub.get(), {'type': 'begin'})
+
+    async def test_003_slow_consumer(self):
+        slow = self.hub.subscribe()
+        for _ in range(3):
+            self.hub.publish({'type': 'begin'}, 'i1', 't1')
+        eq_(self.hub.subscribers, 0)
+        eq_(self.hub.dropped, 1)
+        # Pending events are dropped, the reader is woken up
+        eq_(await slow.get(), None)
+
+
+class TestEventsWebsocket(TestCase):
+
+    async def setUp(self):
+        nyuki = Mock()
+        nyuki.HTTP_RESOURCES = [ApiWorkflowEvents]
+        nyuki.loop = self.loop
+        nyuki.worker = None
+        nyuki.events = EventHub(queue_size=10, loop=self.loop)
+        self.hub = nyuki.events
+        self.api = Api(nyuki)
+        self.api.configure(host='127.0.0.1', port=0)
+        await self.api.start()
+        port = self.api._server.sockets[0].getsockname()[1]
+        self.url = 'http://127.0.0.1:{}/v1/workflow/events'.format(port)
+
+    async def tearDown(self):
+        await self.api.stop()
+
+    async def _wait_subscribers(self, count):
+        while self.hub.subscribers != count:
+            await asyncio.sleep(0.01)
+
+    async def test_001_stream(self):
+        async with ClientSession() as session:
+            async with session.get(self.url) as resp:
+                eq_(resp.status, 400)
+
+            ws = await session.ws_connect(self.url + '?instances=i1')
+            await self._wait_subscribers(1)
+            self.hub.publish({'type': 'begin', 'id': 1}, 'i2', 't1')
+            self.hub.publish({'type': 'begin', 'id': 2}, 'i1', 't1')
+            eq_(await ws.receive_json(), {'type': 'begin', 'id': 2})
+
+            # Replace the filters
+            await ws.send_json({'instances': ['i2']})
+            while next(iter(self.hub._subscribers)).instances != {'i2'}:
+                await asyncio.sleep(0.01)
+            self.hub.publish({'type': 'end', 'id': 3}, 'i1', 't1')
+            self.hub.publish({'type': 'end', 'id': 4}, 'i2', 't1')
+            eq_(await ws.receive_json(), {'type': 'end', 'id': 4})
+
+            await ws.close()
+            await self._wait_subscribers(0)
+
+    async def test_002_slow_consumer(self):
+        async with ClientSession() as session:
+            ws = await session.ws_connect(self.url)
+            await self._wait_subscribers(1)
+            # Fill the queue before the sender can flush it
+            for index in range(11):
+                self.hub.publish({'type': 'begin', 'id': index}, 'i1', 't1')
+            msg = await ws.receive()
+            eq_(msg.type, WSMsgType.CLOSE)
+            eq_(msg.data, WSCloseCode.TRY_AGAIN_LATER)
+            eq_(self.hub.dropped, 1)
+
+    async def test_003_admission(self):
+        await self.api.stop()
+        self.api.configure(
+            host='127.0.0.1', port=0, admission={'limit': 1, 'queue': 0}
+        )
+        await self.api.start()
+        port = self.api._server.sockets[0].getsockname()[1]
+        url = 'http://127.0.0.1:{}/v1/workflow/events'.format(port)
+        # More websockets than admission slots
+        async with ClientSession() as session:
+            first = await session.ws_connect(url)
+            second = await session.ws_connect(url)
+            await self._wait_subscribers(2)
+            await first.close()
+            await second.close()
@@ -0,0 +1,79 @@
+from asynctest import TestCase, Mock, ignore_loop
+from nose.tools import eq_
+
+from nyuki.utils import field_tree, field_paths, select_fields
+from nyuki.workflow.db.storage import MongoStorage
+from nyuki.workflow.workflow import WorkflowInstance
+
+
+class TestFields(TestCase):
+
+    @ignore_loop
+    def test_001_tree(self):
+        tree = field_tree(['id', 'template.tasks.state', 'template.title'])
+        eq_(tree, {
+            'id': {}, 'template': {'tasks': {'state': {}}, 'title': {}}
+        })
+        # A parent selects everything below it, in any order
+        eq_(field_tree(['a.b', 'a', 'c']), {'a': {}, 'c': {}})
+        eq_(field_tree(['a', 'a.b']), {'a': {}})
+        eq_(sorted(field_paths(field_tree(['a.b', 'a.c.d', 'a.b.e']))),
+            ['a.b', 'a.c.d'])
+
+    @ignore_loop
+    def test_002_select(self):
+        report = {
+            'id': '1',
+            'state': 'pending',
+            'template': {
+                'title': 'test',
+                'tasks': [
+                    {'id': 't1', 'state': 'done', 'outputs': {}},
+                    {'id': 't2', 'state': 'pending', 'outputs': {}},
+                ],
+            },
+        }
+        tree = field_tree(['id', 'template.tasks.state', 'missing'])
+        eq_(select_fields(report, tree), {
+            'id': '1',
+            'template': {'tasks': [{'state': 'done'}, {'state': 'pending'}]},
+        })
+
+    @ignore_loop
+    def test_003_split(self):
+        split = MongoStorage._split_fields
+        eq_(split(None), (None, None, False))
+        eq_(split(['id', 'template.title']),
+            (['id', 'template.title'], None, False))
+        eq_(split(['template.tasks.state']), (['id'], ['state'], True))
+        eq_(split(['template', 'template.tasks.state']),
+            (['template'], None, True))
+
+
+class TestWorkflowInstanceReport(TestCase):
+
+    def setUp(self):
+        template = {
+            'id': 'tmpl', 'title': 'test', 'graph': {'t1': []},
+            'tasks': [{'id': 't1', 'name': 'join'}],
+        }
+        instance = Mock()
+        instance.report.return_value = {
+            'exec': {'id': 'inst', 'state': 'pending'},
+            'tasks': [{'id': 't1', 'exec': {
+                'id': 'e1', 'state': 'done', 'start': None, 'end': None,
+                'inputs': None, 'outputs': None, 'reporting': None,
+            }}],
+        }
+        self.wflow = WorkflowInstance(template, instance, requester='me')
+
+    @ignore_loop
+    def test_001_fields(self):
+        eq_(self.wflow.report(fields=['id', 'template.tasks.state']), {
+            'id': 'inst', 'template': {'tasks': [{'state': 'done'}]},
+        })
+        eq_(self.wflow.report(fields=['requester', 'template.title']), {
+            'requester': 'me', 'template': {'title': 'test'},
+        })
+        # The full report is left untouched
+        eq_(self.wflow.report()['template']['graph'], {'t1': []})
@@ -0,0 +1,68 @@
+import asyncio
+from asynctest import TestCase, Mock, CoroutineMock
+from nose.tools import eq_
+
+from nyuki.workflow.api.instances import ApiWorkflows
+
+
+class TestWorkflowsWaitEnd(TestCase):
+
+    def setUp(self):
+        self.api = ApiWorkflows()
+        self.api.nyuki = Mock()
+        self.api.nyuki.bus.name = 'test'
+        self.api.nyuki.storage.get_template = CoroutineMock(return_value={
+            'id': 'tmpl', 'graph': {'t1': []},
+            'tasks': [{'id': 't1', 'name': 'task'}],
+        })
+        self.wflow = asyncio.Future()
+        self.triggered = 0
+
+        # A mock would await a returned future
+        async def trigger(*args):
+            self.triggered += 1
+            return self.wflow
+
+        self.api.nyuki.engine.trigger = trigger
+        self.api.nyuki.new_workflow.return_value.report.return_value = {
+            'id': 'inst'
+        }
+
+    def _request(self, query):
+        request = Mock()
+        request.headers = {}
+        request.query = query
+        request.json = CoroutineMock(return_value={'id': 'tmpl'})
+        return request
+
+    async def test_001_end(self):
+        self.loop.call_later(0.01, self.wflow.set_result, None)
+        response = await self.api.put(self._request({'wait': 'end'}))
+        eq_(response.status, 200)
+        assert self.wflow.done()
+
+    async def test_002_timeout(self):
+        response = await self.api.put(
+            self._request({'wait': 'end', 'timeout': '0.01'})
+        )
+        eq_(response.status, 202)
+        assert not self.wflow.done()
+
+    async def test_003_invalid(self):
+        for query in (
+            {'wait': 'start'},
+            {'wait': 'end', 'timeout': 'a'},
+            {'wait': 'end', 'timeout': '0'},
+            {'wait': 'end', 'timeout': '3600'},
+        ):
+            response = await self.api.put(self._request(query))
+            eq_(response.status, 400)
+        eq_(self.triggered, 0)
+
+    async def test_004_no_wait(self):
+        # The timeout is ignored without 'wait', as it always was
+        wfinst = self.api.nyuki.new_workflow.return_value
+        wfinst.instance._committed.wait = CoroutineMock()
+        response = await self.api.put(self._request({'timeout': 'a'}))
+        eq_(response.status, 200)
+        eq_(self.triggered, 1)
@@ -0,0 +1,95 @@
+from asynctest import TestCase, Mock, MagicMock, CoroutineMock, ignore_loop
+from nose.tools import eq_, assert_raises
+
+from nyuki.api import HTTPBreak
+from nyuki.workflow.api.utils import page_params, page_response
+from nyuki.workflow.db.data_processing import DataProcessingCollection
+from nyuki.workflow.db.utils import projection, searchable, starts_with
+
+
+class TestPageParams(TestCase):
+
+    @ignore_loop
+    def test_001_params(self):
+        request = Mock()
+        request.query = {'offset': '10', 'limit': '5', 'fields': 'id,title,'}
+        eq_(page_params(request), {
+            'offset': 10, 'limit': 5, 'fields': ['id', 'title']
+        })
+        request.query = {}
+        eq_(page_params(request), {
+            'offset': None, 'limit': None, 'fields': None
+        })
+
+    @ignore_loop
+    def test_002_invalid(self):
+        request = Mock()
+        for query in ({'offset': 'a'}, {'offset': '-1'}, {'limit': '0'}):
+            request.query = query
+            with assert_raises(HTTPBreak):
+                page_params(request)
+
+    @ignore_loop
+    def test_003_response(self):
+        eq_(page_response([], 12).headers['X-Total-Count'], '12')
+        assert 'X-Total-Count' not in page_response([]).headers
+
+    @ignore_loop
+    def test_004_projection(self):
+        eq_(projection(), {'_id': 0})
+        eq_(projection(['title'], ['id']), {'_id': 0, 'title': 1, 'id': 1})
+        eq_(projection(hidden=['title_search']), {'_id': 0, 'title_search': 0})
+        eq_(projection(['title'], hidden=['title_search']),
+            {'_id': 0, 'title': 1})
+
+    @ignore_loop
+    def test_005_search(self):
+        eq_(searchable({'id': 1, 'title': 'My Rule'}),
+            {'id': 1, 'title': 'My Rule', 'title_search': 'my rule'})
+        eq_(searchable({'id': 1}), {'id': 1})
+        # Anchored, usable as an index range
+        eq_(starts_with('A.b'), {'$regex': r'^a\.b'})
+
+
+class TestDataProcessingQueries(TestCase):
+
+    def setUp(self):
+        self.cursor = MagicMock()
+        self.cursor.sort.return_value = self.cursor
+        self.cursor.to_list = CoroutineMock(return_value=[])
+        self.rules = MagicMock()
+        self.rules.find.return_value = self.cursor
+        self.collection = DataProcessingCollection(
+            {'regexes': self.rules}, 'regexes'
+        )
+
+    async def test_001_get_all(self):
+        await self.collection.get()
+        self.rules.find.assert_called_once_with(
+            {}, {'_id': 0, 'title_search': 0}
+        )
+        eq_(self.cursor.skip.call_count, 0)
+        eq_(self.cursor.limit.call_count, 0)
+
+    async def test_002_get_page(self):
+        await self.collection.get(
+            title='a.b', offset=20, limit=10, fields=['title']
+        )
+        self.rules.find.assert_called_once_with(
+            {'title_search': {'$regex': r'^a\.b'}},
+            {'_id': 0, 'title': 1, 'id': 1},
+        )
+        self.cursor.skip.assert_called_once_with(20)
+        self.cursor.limit.assert_called_once_with(10)
+
+    async def test_003_insert(self):
+        self.rules.replace_one = CoroutineMock()
+        rule = {'id': 'r1', 'title': 'Rule'}
+        await self.collection.insert(rule)
+        self.rules.replace_one.assert_called_once_with(
+            {'id': 'r1'},
+            {'id': 'r1', 'title': 'Rule', 'title_search': 'rule'},
+            upsert=True,
+        )
+        # The caller's document is left untouched
+        eq_(rule, {'id': 'r1', 'title': 'Rule'})
@@ -0,0 +1,64 @@
+import asyncio
+from asynctest import TestCase, Mock, CoroutineMock
+from nose.tools import eq_
+
+from nyuki.workflow.workflow import WorkflowNyuki
+
+
+class Response:
+
+    def __init__(self, status):
+        self.status = status
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class TestWorkflowRescue(TestCase):
+
+    def setUp(self):
+        self.nyuki = Mock()
+        self.nyuki.config = {'service': 'test'}
+        self.nyuki.api._port = 5558
+        self.nyuki.raft.ports = {}
+        self.nyuki.raft.network = {
+            '10.0.0.1': 'me', '10.0.0.2': 'idle', '10.0.0.3': 'dead',
+        }
+        self.nyuki.raft.least_loaded.side_effect = lambda ipv4s: sorted(
+            ipv4s, reverse=True
+        )
+        self.nyuki.memory.key = lambda *args: ':'.join(args)
+        self.nyuki.memory.store.smembers = CoroutineMock(
+            return_value=[b'wf1', b'wf2']
+        )
+        self.nyuki.read_report = CoroutineMock(return_value={'exec': {}})
+        self.nyuki.clear_report = CoroutineMock()
+        self.urls = []
+
+        def request(method, url, **kwargs):
+            self.urls.append(url)
+            # The least loaded instance refuses the second workflow
+            if len(self.urls) == 2:
+                return Response(500)
+            return Response(200)
+
+        self.nyuki.http.request = request
+
+    async def test_001_least_loaded(self):
+        await WorkflowNyuki.failure_handler(self.nyuki, ['dead'])
+        await asyncio.sleep(0)
+        eq_(self.urls, [
+            'http://10.0.0.2:5558/v1/workflow/instances',
+            'http://10.0.0.2:5558/v1/workflow/instances',
+            'http://10.0.0.1:5558/v1/workflow/instances',
+        ])
+        self.nyuki.raft.least_loaded.assert_called_with(
+            ['10.0.0.1', '10.0.0.2']
+        )
+        eq_([call[0] for call in self.nyuki.raft.add_load.call_args_list], [
+            ('10.0.0.2', 'workflows'), ('10.0.0.1', 'workflows'),
+        ])
+        eq_(self.nyuki.clear_report.call_count, 2)
@@ -0,0 +1,56 @@
+import asyncio
+from asynctest import TestCase, Mock, CoroutineMock
+from nose.tools import eq_
+
+from nyuki.workflow.workflow import WorkflowNyuki
+
+
+class TestWorkflowSnapshots(TestCase):
+
+    def setUp(self):
+        self.nyuki = Mock()
+        self.nyuki.loop = self.loop
+        self.nyuki.snapshot_interval = 0.05
+        self.nyuki.running_workflows = {
+            'wf1': Mock(report=Mock(return_value={'exec': {'id': 'wf1'}})),
+            'wf2': Mock(report=Mock(return_value={'exec': {'id': 'wf2'}})),
+        }
+        self.nyuki._dirty = set()
+        self.nyuki._flush_handle = None
+        self.nyuki.write_report = CoroutineMock()
+        self.nyuki.flush_reports = lambda: WorkflowNyuki.flush_reports(
+            self.nyuki
+        )
+
+    def written(self):
+        return sorted(
+            call[0][0]['exec']['id']
+            for call in self.nyuki.write_report.call_args_list
+        )
+
+    async def test_001_debounce(self):
+        # A burst of progress events, a single write per workflow
+        for _ in range(50):
+            WorkflowNyuki.snapshot(self.nyuki, 'wf1', 'task-progress')
+            WorkflowNyuki.snapshot(self.nyuki, 'wf2', 'task-progress')
+        await asyncio.sleep(0.01)
+        eq_(self.written(), [])
+        await asyncio.sleep(0.1)
+        eq_(self.written(), ['wf1', 'wf2'])
+        eq_(self.nyuki._dirty, set())
+        eq_(self.nyuki._flush_handle, None)
+
+    async def test_002_immediate(self):
+        WorkflowNyuki.snapshot(self.nyuki, 'wf1', 'task-progress')
+        # A task ended, the rescuer must know right away
+        WorkflowNyuki.snapshot(self.nyuki, 'wf1', 'task-end')
+        await asyncio.sleep(0)
+        eq_(self.written(), ['wf1'])
+        await asyncio.sleep(0.1)
+        eq_(self.written(), ['wf1'])
+
+        # No interval, every event is written
+        self.nyuki.snapshot_interval = 0
+        WorkflowNyuki.snapshot(self.nyuki, 'wf2', 'task-progress')
+        await asyncio.sleep(0)
+        eq_(self.written(), ['wf1', 'wf2'])
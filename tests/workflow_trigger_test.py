@@ -0,0 +1,103 @@
+import asyncio
+from aiohttp import ClientConnectorError, ClientError
+from asynctest import TestCase, Mock
+from nose.tools import assert_raises, eq_
+
+from nyuki.discovery import ServiceBalancer
+from nyuki.workflow.tasks.trigger_workflow import TriggerWorkflowTask
+from nyuki.workflow.tasks.utils import runtime
+
+
+class Response:
+
+    def __init__(self, status, body='{}'):
+        self.status = status
+        self.body = body
+
+    async def text(self):
+        return self.body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class TestTriggerRouting(TestCase):
+
+    def setUp(self):
+        runtime.config = {'service': 'test', 'http_host': 'gateway'}
+        runtime.api = Mock(port=5558)
+        runtime.http = Mock()
+        self.discovery = Mock()
+
+        async def lookup(service):
+            return {'10.0.0.2': None, '10.0.0.3': 5559}
+
+        self.discovery.lookup = lookup
+        self.urls = []
+        self.error = ClientError('unreachable')
+
+        def request(method, url, **kwargs):
+            self.urls.append((method, url))
+            if '10.0.0.3' in url:
+                raise self.error
+            return Response(200)
+
+        runtime.http.request = request
+        self.task = TriggerWorkflowTask({
+            'template': {'service': 'other', 'id': 'template'},
+        })
+
+    def tearDown(self):
+        runtime.balancer = None
+
+    async def test_001_gateway(self):
+        runtime.balancer = None
+        engine, status, _ = await self.task._request('GET', '/vars/template')
+        eq_((engine, status), ('http://gateway/other/api/v1/workflow', 200))
+
+    async def test_002_direct(self):
+        runtime.balancer = ServiceBalancer(self.discovery)
+        for _ in range(2):
+            await self.task._request('GET', '/vars/template')
+        eq_(self.urls, [
+            ('GET', 'http://10.0.0.2:5558/v1/workflow/vars/template'),
+            # Fallback on the gateway
+            ('GET', 'http://10.0.0.3:5559/v1/workflow/vars/template'),
+            ('GET', 'http://gateway/other/api/v1/workflow/vars/template'),
+        ])
+        eq_(runtime.balancer.outstanding, {})
+
+        # Cancelled on the instance it was triggered on
+        engine, _, _ = await self.task._request('PUT', '/instances')
+        eq_(engine, 'http://10.0.0.2:5558/v1/workflow')
+        self.task._engine = engine
+        self.urls.clear()
+        await self.task._request('DELETE', '/instances/1', direct=False)
+        eq_(self.urls, [
+            ('DELETE', 'http://10.0.0.2:5558/v1/workflow/instances/1'),
+        ])
+
+    async def test_003_not_replayed(self):
+        runtime.balancer = ServiceBalancer(self.discovery)
+        runtime.balancer._turns['other'] = 1
+        # The instance may have started the workflow
+        self.error = asyncio.TimeoutError()
+        with assert_raises(asyncio.TimeoutError):
+            await self.task._request('PUT', '/instances')
+        eq_(self.urls, [
+            ('PUT', 'http://10.0.0.3:5559/v1/workflow/instances'),
+        ])
+
+        # Never sent, the gateway takes it
+        runtime.balancer._turns['other'] = 1
+        self.urls.clear()
+        self.error = ClientConnectorError(Mock(), OSError('refused'))
+        engine, _, _ = await self.task._request('PUT', '/instances')
+        eq_(engine, 'http://gateway/other/api/v1/workflow')
+        eq_(self.urls, [
+            ('PUT', 'http://10.0.0.3:5559/v1/workflow/instances'),
+            ('PUT', 'http://gateway/other/api/v1/workflow/instances'),
+        ])